@@ -0,0 +1,165 @@
+# Денормализованные итоги продаж, которые поддерживаются триггерами.
+# Сумма заказа - sum(order_lines.quantity * items.selling_price) по orders.id;
+# если считать ее по запросу, каждый запрос дашборда соединяет order_lines с items.
+# Здесь итоги лежат в двух сводных таблицах:
+#   order_totals     - сумма и число строк по каждому заказу
+#   customer_revenue - выручка по каждому покупателю
+# Их изменяют приращения (дельты), которые считают сгенерированные триггеры на
+# order_lines (вставка, изменение, удаление), items (изменение selling_price),
+# orders (новый заказ, смена покупателя, удаление) и customers. Поэтому итоги
+# не расходятся ни при записи через Core, ни через ORM, ни через чистый SQL.
+# rebuild() пересчитывает обе таблицы целиком (после install или для сверки).
+# Поддерживаются PostgreSQL (функции plpgsql) и SQLite (тела триггеров).
+#
+#   install(engine)        # сводные таблицы, триггеры и начальный пересчет
+#   conn.execute(select(customer_revenue).order_by(customer_revenue.c.revenue.desc()).limit(10))
+from sqlalchemy import MetaData, Table, Column, Integer, Numeric, Index, func, select
+
+from sales_schema import customers, orders, items, order_lines
+from schema_reconcile import raw_ddl
+
+aggregate_metadata = MetaData()
+
+order_totals = Table('order_totals', aggregate_metadata,
+                     Column('order_id', Integer(), primary_key=True, autoincrement=False),
+                     Column('total', Numeric(14, 2), nullable=False, default=0),
+                     Column('lines', Integer(), nullable=False, default=0))
+
+customer_revenue = Table('customer_revenue', aggregate_metadata,
+                         Column('customer_id', Integer(), primary_key=True, autoincrement=False),
+                         Column('revenue', Numeric(14, 2), nullable=False, default=0),
+                         Index('ix_customer_revenue_revenue', 'revenue'))
+
+_PRICE = '(SELECT selling_price FROM items WHERE id = {row}.item_id)'
+_ORDER_UPSERT = ('INSERT INTO order_totals (order_id, total, lines) {select} '
+                 'ON CONFLICT (order_id) DO UPDATE SET total = order_totals.total + excluded.total, '
+                 'lines = order_totals.lines + excluded.lines')
+_CUSTOMER_UPSERT = ('INSERT INTO customer_revenue (customer_id, revenue) {select} '
+                    'ON CONFLICT (customer_id) DO UPDATE SET '
+                    'revenue = customer_revenue.revenue + excluded.revenue')
+
+
+def _line(row, sign):
+    # строка заказа row (NEW или OLD) прибавляется (sign='') или вычитается (sign='-')
+    amount = f'{sign}(COALESCE({row}.quantity, 0) * COALESCE({_PRICE.format(row=row)}, 0))'
+    return [
+        _ORDER_UPSERT.format(select=f'SELECT {row}.order_id, {amount}, {sign}1 '
+                                    f'WHERE {row}.order_id IS NOT NULL'),
+        _CUSTOMER_UPSERT.format(select=f'SELECT o.customer_id, {amount} FROM orders o '
+                                       f'WHERE o.id = {row}.order_id'),
+    ]
+
+
+def _price_change():
+    # новая цена товара меняет все заказы с ним на sum(quantity) * (новая - старая)
+    delta = '(NEW.selling_price - OLD.selling_price)'
+    return [
+        _ORDER_UPSERT.format(select=f'SELECT ol.order_id, SUM(COALESCE(ol.quantity, 0)) * {delta}, 0 '
+                                    'FROM order_lines ol WHERE ol.item_id = NEW.id '
+                                    'AND ol.order_id IS NOT NULL GROUP BY ol.order_id'),
+        _CUSTOMER_UPSERT.format(select=f'SELECT o.customer_id, SUM(COALESCE(ol.quantity, 0)) * {delta} '
+                                       'FROM order_lines ol JOIN orders o ON o.id = ol.order_id '
+                                       'WHERE ol.item_id = NEW.id GROUP BY o.customer_id'),
+    ]
+
+
+def _order_revenue(row, sign):
+    total = f'{sign}COALESCE((SELECT total FROM order_totals WHERE order_id = {row}.id), 0)'
+    return _CUSTOMER_UPSERT.format(select=f'SELECT {row}.customer_id, {total} WHERE true')
+
+
+def _triggers(distinct):
+    # (имя, событие, таблица, условие WHEN, тело); distinct - "значения различаются" на диалекте
+    return [
+        ('agg_order_lines_insert', 'INSERT', 'order_lines', None, _line('NEW', '')),
+        ('agg_order_lines_update', 'UPDATE OF order_id, item_id, quantity', 'order_lines', None,
+         _line('OLD', '-') + _line('NEW', '')),
+        ('agg_order_lines_delete', 'DELETE', 'order_lines', None, _line('OLD', '-')),
+        ('agg_items_price', 'UPDATE OF selling_price', 'items',
+         distinct.format('OLD.selling_price', 'NEW.selling_price'), _price_change()),
+        ('agg_orders_insert', 'INSERT', 'orders', None,
+         ['INSERT INTO order_totals (order_id, total, lines) SELECT NEW.id, 0, 0 WHERE true '
+          'ON CONFLICT (order_id) DO NOTHING']),
+        ('agg_orders_customer', 'UPDATE OF customer_id', 'orders',
+         distinct.format('OLD.customer_id', 'NEW.customer_id'),
+         [_order_revenue('OLD', '-'), _order_revenue('NEW', '')]),
+        ('agg_orders_delete', 'DELETE', 'orders', None,
+         [_order_revenue('OLD', '-'), 'DELETE FROM order_totals WHERE order_id = OLD.id']),
+        ('agg_customers_insert', 'INSERT', 'customers', None,
+         ['INSERT INTO customer_revenue (customer_id, revenue) SELECT NEW.id, 0 WHERE true '
+          'ON CONFLICT (customer_id) DO NOTHING']),
+        ('agg_customers_delete', 'DELETE', 'customers', None,
+         ['DELETE FROM customer_revenue WHERE customer_id = OLD.id']),
+    ]
+
+
+def trigger_ddl(dialect):
+    # -> (команды создания, команды удаления); индекс по order_lines.item_id нужен
+    # триггеру на смену цены, иначе каждое изменение цены читает order_lines целиком
+    create = ['CREATE INDEX IF NOT EXISTS ix_agg_order_lines_item_id ON order_lines (item_id)']
+    drop = ['DROP INDEX IF EXISTS ix_agg_order_lines_item_id']
+    if dialect.name == 'postgresql':
+        for name, event, table, when, body in _triggers('{} IS DISTINCT FROM {}'):
+            statements = ''.join(f'    {statement};\n' for statement in body)
+            create.append(f'CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$\nBEGIN\n'
+                          f'{statements}    RETURN NULL;\nEND\n$$ LANGUAGE plpgsql')
+            create.append(f'CREATE TRIGGER {name} AFTER {event} ON {table} FOR EACH ROW'
+                          + (f' WHEN ({when})' if when else '') + f' EXECUTE FUNCTION {name}()')
+            drop.append(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+            drop.append(f'DROP FUNCTION IF EXISTS {name}()')
+    elif dialect.name == 'sqlite':
+        for name, event, table, when, body in _triggers('{} IS NOT {}'):
+            statements = ''.join(f'    {statement};\n' for statement in body)
+            create.append(f'CREATE TRIGGER {name} AFTER {event} ON {table} FOR EACH ROW'
+                          + (f' WHEN {when}' if when else '') + f'\nBEGIN\n{statements}END')
+            drop.append(f'DROP TRIGGER IF EXISTS {name}')
+    else:
+        raise ValueError(f'aggregate triggers are not generated for {dialect.name}')
+    return create, drop
+
+
+def order_totals_query():
+    # итоги заказов "по запросу" - тот же расчет, что ведут триггеры
+    return select(orders.c.id.label('order_id'),
+                  func.coalesce(func.sum(order_lines.c.quantity * items.c.selling_price), 0).label('total'),
+                  func.count(order_lines.c.order_id).label('lines')) \
+        .select_from(orders.outerjoin(order_lines).outerjoin(items)) \
+        .group_by(orders.c.id)
+
+
+def customer_revenue_query():
+    return select(customers.c.id.label('customer_id'),
+                  func.coalesce(func.sum(order_lines.c.quantity * items.c.selling_price), 0).label('revenue')) \
+        .select_from(customers.outerjoin(orders).outerjoin(order_lines).outerjoin(items)) \
+        .group_by(customers.c.id)
+
+
+def rebuild(connection):
+    # полный пересчет в текущей транзакции; на PostgreSQL исходные таблицы
+    # на это время закрываются для записи (чтение не блокируется)
+    if connection.dialect.name == 'postgresql':
+        connection.execute(raw_ddl('LOCK TABLE customers, orders, items, order_lines IN SHARE MODE'))
+    connection.execute(order_totals.delete())
+    connection.execute(customer_revenue.delete())
+    connection.execute(order_totals.insert().from_select(['order_id', 'total', 'lines'], order_totals_query()))
+    connection.execute(customer_revenue.insert().from_select(['customer_id', 'revenue'],
+                                                             customer_revenue_query()))
+
+
+def install(engine, initial_rebuild=True):
+    # создает сводные таблицы и триггеры (заменяя прежние) и пересчитывает итоги
+    create, drop = trigger_ddl(engine.dialect)
+    with engine.begin() as conn:
+        aggregate_metadata.create_all(conn)
+        for sql in drop + create:
+            conn.execute(raw_ddl(sql))
+        if initial_rebuild:
+            rebuild(conn)
+
+
+def uninstall(engine):
+    _, drop = trigger_ddl(engine.dialect)
+    with engine.begin() as conn:
+        for sql in drop:
+            conn.execute(raw_ddl(sql))
+        aggregate_metadata.drop_all(conn)
@@ -0,0 +1,69 @@
+# Асинхронный вариант CRUD-операций из first_db.py поверх create_async_engine.
+# Используются те же таблицы customers/items/orders/order_lines из sales_schema.py.
+# Вставки разбиваются на порции, которые пишутся параллельно, но не более чем
+# в concurrency соединений одновременно - так сервис приема данных может
+# совмещать много мелких записей, не исчерпывая пул.
+# Драйверы: asyncpg для PostgreSQL и aiosqlite для локальных тестов.
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from bulk_load import chunked
+from engine_factory import postgres_url
+
+
+def get_async_engine(db_name=None, url=None, pool_size=10, **kwargs):
+    if url is None:
+        url = postgres_url(db_name, driver='asyncpg')
+    if str(url).startswith('sqlite'):
+        # у aiosqlite свой пул не нужен: одно соединение на порцию
+        return create_async_engine(url, **kwargs)
+    kwargs.setdefault('pool_pre_ping', True)
+    return create_async_engine(url, pool_size=pool_size, max_overflow=0, **kwargs)
+
+
+async def insert_batches(engine, table, rows, batch_size=1000, concurrency=4):
+    # вставляет строки порциями по batch_size; одновременно пишут не больше
+    # concurrency соединений, каждая порция - отдельная транзакция.
+    # Возвращает число вставленных строк
+    batches = chunked(rows, batch_size)
+
+    async def writer():
+        count = 0
+        # итератор общий для всех писателей: каждый берет следующую порцию
+        for batch in batches:
+            async with engine.begin() as conn:
+                await conn.execute(table.insert(), batch)
+            count += len(batch)
+        return count
+
+    counts = await asyncio.gather(*(writer() for _ in range(concurrency)))
+    return sum(counts)
+
+
+async def insert_rows(engine, table, rows):
+    # одна порция строк в одной транзакции
+    async with engine.begin() as conn:
+        result = await conn.execute(table.insert(), list(rows))
+    return result.rowcount
+
+
+async def update_rows(engine, table, where, **values):
+    # например: await update_rows(engine, items, items.c.name == 'Water Bottle', quantity=60)
+    async with engine.begin() as conn:
+        result = await conn.execute(table.update().where(where).values(**values))
+    return result.rowcount
+
+
+async def delete_rows(engine, table, where):
+    # например: await delete_rows(engine, customers, customers.c.username.like('Vladim%'))
+    async with engine.begin() as conn:
+        result = await conn.execute(table.delete().where(where))
+    return result.rowcount
+
+
+async def create_schema(engine, metadata, drop=False):
+    async with engine.begin() as conn:
+        if drop:
+            await conn.run_sync(metadata.drop_all)
+        await conn.run_sync(metadata.create_all)
@@ -0,0 +1 @@
+# бенчмарки запускаются из корня репозитория: python -m benchmarks.<имя>
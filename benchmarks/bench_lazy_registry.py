@@ -0,0 +1,126 @@
+# время от запуска процесса до первого запроса для модуля схемы из N таблиц и моделей:
+#   eager  - обычный модуль: все Table и декларативные классы объявляются при импорте
+#   lazy   - LazyRegistry без кэша: собираются только нужные таблица и модель
+#   cached - LazyRegistry с pickle-кэшем MetaData (файл собран предыдущим запуском)
+# в двух сценариях: процессу нужна одна модель или вся схема (create_all)
+# python -m benchmarks.bench_lazy_registry --models 500
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HEADER = '''import time
+start = time.perf_counter()
+import os
+from datetime import datetime
+from sqlalchemy import Table, Column, Integer, String, Numeric, DateTime, ForeignKey, create_engine, select
+from sqlalchemy.orm import relationship, Session
+'''
+
+COLUMNS = '''Column('id', Integer(), primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('price', Numeric(10, 2)),
+    Column('quantity', Integer()),
+    Column('created_on', DateTime(), default=datetime.now),
+    Column('updated_on', DateTime(), default=datetime.now, onupdate=datetime.now)'''
+
+EAGER_TABLE = '''
+t{i:04d} = Table('t{i:04d}', metadata, {columns}{fk})
+
+
+class M{i:04d}(Base):
+    __table__ = t{i:04d}
+{rel}
+'''
+
+LAZY_TABLE = '''
+@registry.table
+def t{i:04d}(metadata):
+    return Table('t{i:04d}', metadata, {columns}{fk})
+
+
+@registry.model{requires}
+def M{i:04d}(Base, tables):
+    class M{i:04d}(Base):
+        __table__ = tables['t{i:04d}']
+    {rel}
+    return M{i:04d}
+'''
+
+QUERY = '''
+engine = create_engine('sqlite://')
+if os.environ.get('SCHEMA_ALL'):
+    # процессу нужна вся схема (например, create_all или reconcile)
+    {metadata}.create_all(engine)
+else:
+    {model}.__table__.create(engine)
+with Session(engine) as session:
+    session.execute(select({model})).all()
+print(time.perf_counter() - start)
+'''
+
+
+def fk(i):
+    return f",\n    Column('parent_id', ForeignKey('t{i - 1:04d}.id'))" if i else ''
+
+
+def rel(i, indent):
+    return f"{indent}parent = relationship('M{i - 1:04d}')" if i else ''
+
+
+def write_modules(directory, count):
+    eager = [HEADER, 'from sqlalchemy import MetaData\nfrom sqlalchemy.ext.declarative import declarative_base\n'
+                     'metadata = MetaData()\nBase = declarative_base(metadata=metadata)\n']
+    for i in range(count):
+        eager.append(EAGER_TABLE.format(i=i, columns=COLUMNS, fk=fk(i), rel=rel(i, '    ')))
+    eager.append(QUERY.format(model='M0000', metadata='metadata'))
+
+    lazy = [HEADER, 'from lazy_registry import LazyRegistry\n'
+                    "registry = LazyRegistry(cache_path=os.environ.get('SCHEMA_CACHE') or None)\n"]
+    for i in range(count):
+        requires = f"(requires=('M{i - 1:04d}',))" if i else ''
+        lazy.append(LAZY_TABLE.format(i=i, columns=COLUMNS, fk=fk(i), rel=rel(i, ''), requires=requires))
+    lazy.append(QUERY.format(model="registry.models['M0000']", metadata='registry.metadata'))
+
+    paths = {}
+    for name, parts in (('eager', eager), ('lazy', lazy)):
+        paths[name] = os.path.join(directory, f'schema_{name}.py')
+        with open(paths[name], 'w') as f:
+            f.write(''.join(parts))
+    return paths
+
+
+def run(path, env, repeats):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), **env)
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, path], env=env, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip()))
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_modules(directory, args.models)
+        cache = os.path.join(directory, 'schema.pickle')
+        # первый запуск собирает кэш
+        run(paths['lazy'], {'SCHEMA_CACHE': cache}, 1)
+        print(f'{args.models} tables and models, import-to-first-query, median of {args.repeats}, ms')
+        print(f"{'':8}{'one model':>12}{'all tables':>12}")
+        for label, path, env in (('eager', paths['eager'], {}),
+                                 ('lazy', paths['lazy'], {}),
+                                 ('cached', paths['lazy'], {'SCHEMA_CACHE': cache})):
+            one = run(path, env, args.repeats)
+            full = run(path, dict(env, SCHEMA_ALL='1'), args.repeats)
+            print(f'{label:<8}{one:12.1f}{full:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
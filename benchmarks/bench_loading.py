@@ -0,0 +1,68 @@
+# число запросов и время обхода Author.books для разных стратегий загрузки
+# python -m benchmarks.bench_loading --url sqlite:///bench_loading.db --authors 2000
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import Session
+
+from library_models import Base, Author, Book, author_book
+from loading_strategies import STRATEGIES, load_options, detect_n_plus_one, NPlusOneError
+
+
+def seed(engine, authors, books_per_author):
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    books = authors * books_per_author
+    with engine.begin() as conn:
+        conn.execute(insert(Author), [{'id': i, 'first_name': f'A{i}', 'last_name': f'L{i}'}
+                                      for i in range(1, authors + 1)])
+        conn.execute(insert(Book), [{'id': i, 'title': f'Book {i}', 'copyright': 2000 + i % 20}
+                                    for i in range(1, books + 1)])
+        # у каждой книги один-два автора
+        links = {(random.randint(1, authors), book) for book in range(1, books + 1) for _ in range(2)}
+        conn.execute(insert(author_book), [{'author_id': a, 'book_id': b} for a, b in links])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='sqlite:///bench_loading.db')
+    parser.add_argument('--authors', type=int, default=2000)
+    parser.add_argument('--books-per-author', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    seed(engine, args.authors, args.books_per_author)
+    queries = []
+    event.listen(engine, 'before_cursor_execute', lambda *a: queries.append(1))
+
+    for strategy in STRATEGIES:
+        queries.clear()
+        start = time.perf_counter()
+        books = 0
+        with Session(engine) as session, detect_n_plus_one(session, threshold=50) as detector:
+            try:
+                stmt = select(Author).options(*load_options(Author, strategy, 'books'))
+                for author in session.execute(stmt).unique().scalars():
+                    books += len(author.books)
+            except Exception as exc:
+                print(f"{strategy:<10} {type(exc).__name__}: lazy load is forbidden")
+                continue
+        elapsed = time.perf_counter() - start
+        print(f"{strategy:<10} queries={len(queries):<6} lazy_loads={detector.lazy_loads:<6} "
+              f"books={books:<7} {elapsed * 1000:8.1f} ms")
+
+    # детектор в режиме raise останавливает обход на пороге
+    with Session(engine) as session, detect_n_plus_one(session, threshold=10, action='raise'):
+        try:
+            for author in session.execute(select(Author)).scalars():
+                author.books
+        except NPlusOneError as exc:
+            print('detector:', exc)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
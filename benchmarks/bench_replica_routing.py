@@ -0,0 +1,135 @@
+# пропускная способность чтения при росте числа реплик и проверки маршрутизации.
+# Реплики - копии файла SQLite; пропускную способность каждого "сервера"
+# ограничивает пул (--pool соединений), как ограничивают ее ядра настоящего сервера.
+# Когда все "серверы" делят одну машину (и одно ядро), их независимость можно
+# смоделировать задержкой --latency: время обслуживания запроса на сервере
+# python -m benchmarks.bench_replica_routing --replicas 4 --threads 16 --latency 5
+import argparse
+import os
+import random
+import shutil
+import threading
+import time
+
+from sqlalchemy import event, select, func
+
+from bulk_load import bulk_load
+from engine_factory import get_engine, dispose_all
+from routing import ReplicaSet, routing_sessionmaker
+from sales_models import Customer
+from sales_schema import metadata, customers, items, orders, order_lines
+from benchmarks.sales_data import customer_rows, item_rows, order_rows, order_line_rows
+
+
+LATENCY = 0.0
+
+
+def _service_time(*args):
+    time.sleep(LATENCY)
+
+
+def engine_for(path, pool):
+    engine = get_engine(url=f'sqlite:///{path}', pool_size=pool, max_overflow=0)
+    if LATENCY and not event.contains(engine, 'before_cursor_execute', _service_time):
+        event.listen(engine, 'before_cursor_execute', _service_time)
+    return engine
+
+
+def item_sales(item_id):
+    return select(func.count(), func.sum(order_lines.c.quantity)).where(order_lines.c.item_id == item_id)
+
+
+def throughput(replica_set, threads, duration):
+    done = [0] * threads
+    stop = time.monotonic() + duration
+
+    def worker(slot):
+        while time.monotonic() < stop:
+            replica_set.execute(item_sales(random.randint(1, 100))).all()
+            done[slot] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(done) / duration
+
+
+def check_routing(primary, replica_path, pool):
+    # запись видна сразу после commit (чтение с primary), а после окна
+    # read_your_writes чтение уходит на реплику, где этой строки нет
+    replica_set = ReplicaSet(primary, [engine_for(replica_path, pool)])
+    Session = routing_sessionmaker(replica_set, read_your_writes=0.2)
+    with Session() as session:
+        session.add(Customer(**next(customer_rows(1, start=10 ** 6))))
+        session.commit()
+        query = select(func.count()).select_from(Customer).where(Customer.username == f'user{10 ** 6}')
+        assert session.execute(query).scalar() == 1
+        time.sleep(0.25)
+        # новая транзакция: предыдущая так и читает с primary, с которым начала
+        session.rollback()
+        assert session.execute(query).scalar() == 0
+        with session.primary():
+            assert session.execute(query).scalar() == 1
+    replica_set.close()
+
+    # недоступная реплика исключается, чтение переходит на остальные
+    broken = get_engine(url='sqlite:////nonexistent/replica.db')
+    replica_set = ReplicaSet(primary, [broken, engine_for(replica_path, pool)], cooldown=60)
+    for _ in range(4):
+        replica_set.execute(item_sales(1)).all()
+    assert replica_set.healthy() == replica_set.replicas[1:]
+    print('routing checks passed:', replica_set.stats())
+    replica_set.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--pool', type=int, default=2)
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--latency', type=float, default=0, help='ms')
+    parser.add_argument('--dir', default='.')
+    args = parser.parse_args()
+    global LATENCY
+    LATENCY = args.latency / 1000
+
+    primary_path = os.path.join(args.dir, 'bench_routing_primary.db')
+    if os.path.exists(primary_path):
+        os.remove(primary_path)
+    primary = engine_for(primary_path, args.pool)
+    metadata.create_all(primary)
+    n_customers, n_orders = max(args.lines // 50, 1), max(args.lines // 5, 1)
+    bulk_load(primary, {
+        customers: customer_rows(n_customers),
+        items: item_rows(100),
+        orders: order_rows(n_orders, n_customers),
+        order_lines: order_line_rows(args.lines, n_orders, 100),
+    })
+    primary.dispose()
+    replica_paths = []
+    for i in range(args.replicas):
+        path = os.path.join(args.dir, f'bench_routing_replica{i}.db')
+        shutil.copyfile(primary_path, path)
+        replica_paths.append(path)
+
+    baseline = None
+    for count in range(args.replicas + 1):
+        replica_set = ReplicaSet(primary, [engine_for(path, args.pool) for path in replica_paths[:count]])
+        qps = throughput(replica_set, args.threads, args.duration)
+        baseline = baseline or qps
+        print(f'replicas={count}  {qps:8.1f} reads/s  x{qps / baseline:.2f}')
+        replica_set.close()
+
+    if replica_paths:
+        check_routing(primary, replica_paths[0], args.pool)
+    dispose_all()
+    for path in [primary_path] + replica_paths:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
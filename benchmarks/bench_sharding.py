@@ -0,0 +1,104 @@
+# шардирование sales по customer_id: результаты scatter-gather сверяются с одной БД,
+# замеряется время точечных запросов и запросов по всем шардам
+# python -m benchmarks.bench_sharding --shards 4 --customers 20000
+# (или --urls postgresql+psycopg2://.../shard0 postgresql+psycopg2://.../shard1 ...)
+import argparse
+import os
+import time
+
+from sqlalchemy import create_engine, select, func
+
+from engine_factory import percentile
+from sharding import ShardSet
+from sales_schema import metadata, customers, items, orders, order_lines
+from benchmarks.sales_data import customer_rows, item_rows, order_rows, order_line_rows
+
+QUERIES = {
+    'top customers by orders': lambda: select(orders.c.customer_id, func.count().label('orders'))
+        .group_by(orders.c.customer_id).order_by(func.count().desc(), orders.c.customer_id).limit(10),
+    'quantity per customer (join)': lambda: select(orders.c.customer_id, func.sum(order_lines.c.quantity))
+        .join(order_lines, order_lines.c.order_id == orders.c.id)
+        .group_by(orders.c.customer_id).order_by(func.sum(order_lines.c.quantity).desc(), orders.c.customer_id)
+        .limit(10),
+    'customers page': lambda: select(customers.c.id, customers.c.username)
+        .order_by(customers.c.username).limit(20).offset(100),
+    'totals': lambda: select(func.count(), func.sum(order_lines.c.quantity), func.max(order_lines.c.quantity)),
+}
+
+
+def timed(func, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        latencies.append(time.perf_counter() - start)
+    return result, percentile(latencies, 50) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--urls', nargs='*')
+    parser.add_argument('--reference', default='sqlite:///bench_sharding_all.db')
+    parser.add_argument('--customers', type=int, default=20000)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    urls = args.urls or [f'sqlite:///bench_sharding_{i}.db' for i in range(args.shards)]
+    shards = ShardSet([create_engine(url) for url in urls])
+    reference = create_engine(args.reference)
+    shards.drop_all(metadata)
+    shards.create_all(metadata)
+    metadata.drop_all(reference)
+    metadata.create_all(reference)
+
+    n_orders, n_lines = args.customers * 5, args.customers * 25
+    start = time.perf_counter()
+    loaded = {}
+    for table, rows in ((items, item_rows(100)),
+                        (customers, customer_rows(args.customers)),
+                        (orders, order_rows(n_orders, args.customers)),
+                        (order_lines, order_line_rows(n_lines, 1, 100))):
+        if table is order_lines:
+            # строки заказа ссылаются на id, которые выдал ShardSet
+            order_ids = [row['id'] for row in loaded[orders]]
+            rows = [dict(row, order_id=order_ids[i % len(order_ids)]) for i, row in enumerate(rows)]
+        loaded[table] = shards.insert(table, rows)
+    print(f'sharded load: {time.perf_counter() - start:.1f} s')
+    with reference.begin() as conn:
+        for table in metadata.sorted_tables:
+            conn.execute(table.insert(), loaded[table])
+
+    for name, build in QUERIES.items():
+        expected, single = timed(lambda: _all(reference, build()), args.repeats)
+        merged, sharded = timed(lambda: shards.select(build()).all(), args.repeats)
+        assert [tuple(r) for r in merged] == [tuple(r) for r in expected], name
+        print(f'{name:<30} single {single:8.2f} ms   {len(urls)} shards {sharded:8.2f} ms')
+
+    ids = [row['id'] for row in loaded[orders][::max(n_orders // 1000, 1)]]
+    _, lookup = timed(lambda: [shards.get(orders, id_) for id_ in ids], 1)
+    assert all(shards.get(orders, id_).id == id_ for id_ in ids[:50])
+    print(f'point lookups (orders by id): {lookup / len(ids) * 1000:.1f} us each')
+
+    customer_id = loaded[customers][0]['id']
+    lines = select(order_lines.c.quantity).join(orders, orders.c.id == order_lines.c.order_id) \
+        .where(orders.c.customer_id == customer_id)
+    assert sorted(shards.execute(lines, key=customer_id).scalars()) == sorted(
+        r[0] for r in _all(reference, lines))
+    print('sharded results match the single database')
+
+    shards.drop_all(metadata)
+    shards.close()
+    metadata.drop_all(reference)
+    for url in urls + [args.reference]:
+        if url.startswith('sqlite:///') and os.path.exists(url[10:]):
+            os.remove(url[10:])
+
+
+def _all(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+
+if __name__ == '__main__':
+    main()
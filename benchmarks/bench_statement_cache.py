@@ -0,0 +1,65 @@
+# время, которое уходит на компиляцию SQL, с кэшем StatementRegistry и без него
+# python -m benchmarks.bench_statement_cache --url sqlite:// --iterations 5000
+import argparse
+import time
+
+from sqlalchemy import create_engine
+
+from sales_schema import metadata
+from statement_cache import StatementRegistry, sales_statements
+from benchmarks.sales_data import customer_rows, item_rows
+
+PARAMETERS = {
+    'insert_customer': lambda i: next(customer_rows(1, start=i)),
+    'insert_item': lambda i: next(item_rows(1, start=i)),
+    'update_item_by_name': lambda i: {'item_name': f'Item{i}', 'selling_price': 30, 'quantity': 60},
+    'delete_customers_like': lambda i: {'pattern': f'user{i}%'},
+}
+
+
+def run(conn, name, iterations, compiled_cache):
+    stmt = sales_statements.statement(name)
+    make = PARAMETERS[name]
+    options = conn.execution_options(compiled_cache=compiled_cache)
+    start = time.perf_counter()
+    for i in range(iterations):
+        options.execute(stmt, make(i))
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='sqlite://')
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    print(f"{'statement':<24} {'compile':>10} {'cached':>10} {'exec no cache':>14} {'exec cache':>11}")
+    with engine.begin() as conn:
+        for name in PARAMETERS:
+            stmt = sales_statements.statement(name)
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                stmt.compile(dialect=engine.dialect)
+            compile_time = (time.perf_counter() - start) / args.iterations
+
+            registry = StatementRegistry()
+            registry.register(name, lambda: stmt)
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                registry.compiled(name, engine.dialect)
+            cached_time = (time.perf_counter() - start) / args.iterations
+
+            uncached = run(conn, name, args.iterations, None)
+            cached = run(conn, name, args.iterations, sales_statements.cache)
+            print(f"{name:<24} {compile_time * 1e6:8.1f}us {cached_time * 1e6:8.1f}us "
+                  f"{uncached * 1e6:12.1f}us {cached * 1e6:9.1f}us")
+    print(sales_statements.cache.stats())
+    metadata.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# генераторы синтетических строк для таблиц схемы sales
+import random
+
+
+def customer_rows(n, start=1):
+    for i in range(start, start + n):
+        yield {
+            "first_name": f"First{i}",
+            "last_name": f"Last{i}",
+            "username": f"user{i}",
+            "email": f"user{i}@mail.com",
+            "address": f"Street {i % 1000}, bld. {i % 97}",
+            "town": random.choice(["Ufa", "Irkutsk", "Vladivostok", "Kazan"]),
+        }
+
+
+def item_rows(n, start=1):
+    for i in range(start, start + n):
+        cost = round(random.uniform(1, 200), 2)
+        yield {
+            "name": f"Item{i}",
+            "cost_price": cost,
+            "selling_price": round(cost * 1.2, 2),
+            "quantity": random.randint(1, 100),
+        }
+
+
+def order_rows(n, customers_count):
+    for _ in range(n):
+        yield {"customer_id": random.randint(1, customers_count)}
+
+
+def order_line_rows(n, orders_count, items_count):
+    for _ in range(n):
+        yield {
+            "order_id": random.randint(1, orders_count),
+            "item_id": random.randint(1, items_count),
+            "quantity": random.randint(1, 10),
+        }
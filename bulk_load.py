@@ -0,0 +1,161 @@
+# Массовая загрузка строк в таблицы схемы sales.
+# conn.execute(insert(table), list_of_dicts) под psycopg2 превращается в executemany,
+# то есть в отдельный запрос на каждую строку. Здесь строки на PostgreSQL
+# отправляются через COPY FROM STDIN (psycopg2 или psycopg 3) порциями, собранными в буфере в памяти,
+# а на остальных СУБД (например, SQLite в тестах) - через executemany
+# большими порциями внутри одной транзакции.
+import csv
+import io
+from itertools import chain, islice
+
+DEFAULT_CHUNK_SIZE = 10000
+# драйверы PostgreSQL, через которые можно отправить COPY FROM STDIN
+COPY_DRIVERS = ('psycopg2', 'psycopg')
+
+
+def chunked(rows, size):
+    # разбивает любой итерируемый объект на списки длиной не больше size
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _python_defaults(table, names):
+    # значения по умолчанию на стороне python (например, created_on=datetime.now)
+    # для колонок, которых нет во входных строках; COPY их сам не подставит
+    defaults = {}
+    for column in table.columns:
+        if column.name in names or column.default is None:
+            continue
+        default = column.default
+        if default.is_callable:
+            # sqlalchemy оборачивает функцию без аргументов в функцию от контекста
+            defaults[column.name] = lambda arg=default.arg: arg(None)
+        elif default.is_scalar:
+            defaults[column.name] = lambda arg=default.arg: arg
+    return defaults
+
+
+def same_keys(rows):
+    # набор колонок запроса берется из первой строки (и в COPY, и в executemany):
+    # колонка, которой нет в первой строке, в следующих молча стала бы NULL или пропала,
+    # поэтому строка с другим набором ключей - ошибка
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    keys = first.keys()
+    yield first
+    for number, row in enumerate(rows, 1):
+        if row.keys() != keys:
+            raise ValueError(f'row {number} has keys {sorted(row)}, but the first row has {sorted(keys)}')
+        yield row
+
+
+def prepare_rows(table, rows):
+    # превращает словари в кортежи с фиксированным порядком колонок,
+    # дописывая значения по умолчанию; возвращает (имена колонок, итератор кортежей)
+    rows = same_keys(rows)
+    first = next(rows, None)
+    if first is None:
+        return [], iter(())
+    names = [column.name for column in table.columns if column.name in first]
+    defaults = _python_defaults(table, names)
+    columns = names + list(defaults)
+    makers = list(defaults.values())
+    tuples = (tuple(row.get(name) for name in names) + tuple(make() for make in makers)
+              for row in chain([first], rows))
+    return columns, tuples
+
+
+def _copy_value(value):
+    # текстовый формат COPY: NULL записывается как \N,
+    # обратный слэш, табуляция и переводы строк экранируются
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea в шестнадцатеричном виде \x..., обратный слэш в COPY удваивается
+        return '\\\\x' + bytes(value).hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_from(cursor, sql, buffer):
+    # COPY ... FROM STDIN из текстового буфера: у psycopg2 - copy_expert, у psycopg 3 - cursor.copy()
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, buffer)
+        return
+    with cursor.copy(sql) as copy:
+        copy.write(buffer.getvalue())
+
+
+def copy_tuples(connection, table_name, columns, tuples, chunk_size=DEFAULT_CHUNK_SIZE):
+    # отправляет кортежи через COPY FROM STDIN, по chunk_size строк за раз;
+    # table_name - уже экранированное имя (preparer.format_table(table))
+    quote = connection.dialect.identifier_preparer.quote
+    sql = 'COPY {} ({}) FROM STDIN'.format(table_name, ', '.join(quote(name) for name in columns))
+    cursor = connection.connection.cursor()
+    count = 0
+    try:
+        for chunk in chunked(tuples, chunk_size):
+            buffer = io.StringIO()
+            buffer.writelines('\t'.join(_copy_value(v) for v in row) + '\n' for row in chunk)
+            buffer.seek(0)
+            copy_from(cursor, sql, buffer)
+            count += len(chunk)
+    finally:
+        cursor.close()
+    return count
+
+
+def supports_copy(connection):
+    return connection.dialect.name == 'postgresql' and connection.dialect.driver in COPY_DRIVERS
+
+
+def load_rows(connection, table, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    # загружает итерируемый объект словарей в таблицу, возвращает число строк
+    if supports_copy(connection):
+        columns, tuples = prepare_rows(table, rows)
+        if not columns:
+            return 0
+        target = connection.dialect.identifier_preparer.format_table(table)
+        return copy_tuples(connection, target, columns, tuples, chunk_size)
+    count = 0
+    for chunk in chunked(same_keys(rows), chunk_size):
+        connection.execute(table.insert(), chunk)
+        count += len(chunk)
+    return count
+
+
+def read_csv(path, encoding='utf-8'):
+    # строки csv-файла с заголовком; пустые ячейки считаются NULL
+    with open(path, newline='', encoding=encoding) as f:
+        for row in csv.DictReader(f):
+            yield {key: (value if value != '' else None) for key, value in row.items()}
+
+
+def load_csv(connection, table, path, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+    return load_rows(connection, table, read_csv(path, encoding), chunk_size)
+
+
+def bulk_load(engine, data, chunk_size=DEFAULT_CHUNK_SIZE):
+    # data - словарь {таблица: строки или путь к csv-файлу}.
+    # Таблицы грузятся в порядке зависимостей внешних ключей
+    # (customers -> orders -> order_lines) в одной транзакции
+    if not data:
+        return {}
+    metadata = next(iter(data)).metadata
+    loaded = {}
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if table not in data:
+                continue
+            source = data[table]
+            if isinstance(source, str):
+                loaded[table.name] = load_csv(connection, table, source, chunk_size)
+            else:
+                loaded[table.name] = load_rows(connection, table, source, chunk_size)
+    return loaded
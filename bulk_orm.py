@@ -0,0 +1,111 @@
+# Массовое сохранение объектов декларативных моделей.
+# session.add_all() проводит каждый объект через unit of work, identity map
+# и события сессии. Для импорта это лишнее: здесь строки (словари или простые
+# объекты с атрибутами) вставляются порциями через executemany, а если нужны
+# сгенерированные ключи - одной инструкцией с RETURNING на порцию.
+# На PostgreSQL значения порции передаются массивами одной инструкцией:
+#   INSERT INTO t (...) SELECT ... FROM unnest(:a, :b, ...) RETURNING id
+# такая инструкция компилируется один раз, в отличие от INSERT ... VALUES
+# (...), (...), у которого SQL меняется с каждой порцией.
+# В identity map ничего не попадает.
+from sqlalchemy import inspect, insert, select, func, bindparam, cast
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from bulk_load import chunked
+
+DEFAULT_BATCH_SIZE = 5000
+# ограничение sqlite на число параметров в одной инструкции
+MAX_PARAMETERS = 30000
+
+
+def _mapping(row, columns):
+    # словарь {имя колонки: значение} для словаря или объекта; у объекта
+    # берутся только заданные атрибуты, чтобы сработали значения по умолчанию
+    values = row if isinstance(row, dict) else vars(row)
+    return {columns[key]: value for key, value in values.items() if key in columns}
+
+
+def _supports_returning(dialect):
+    # многострочный INSERT ... RETURNING; в sqlalchemy 1.4 признак называется full_returning
+    returning = getattr(dialect, 'insert_returning', None)
+    if returning is None:
+        returning = getattr(dialect, 'full_returning', False)
+    return returning and dialect.supports_multivalues_insert
+
+
+def _unnest_insert(table, names, returning):
+    # порядок RETURNING совпадает с порядком строк благодаря WITH ORDINALITY
+    arrays = [cast(bindparam(name), ARRAY(table.c[name].type)) for name in names]
+    source = func.unnest(*arrays).table_valued(*names, with_ordinality='ordinality') \
+        .render_derived()
+    rows = select(*[source.c[name] for name in names]).order_by(source.c.ordinality)
+    stmt = insert(table).from_select(names, rows)
+    return stmt.returning(*table.primary_key.columns) if returning else stmt
+
+
+def bulk_insert(session, model, rows, batch_size=DEFAULT_BATCH_SIZE, return_defaults=False):
+    # rows - словари или объекты с атрибутами модели (например, Customer(...) до add).
+    # return_defaults=True записывает сгенерированные первичные ключи обратно в строки.
+    # Возвращает число вставленных строк
+    mapper = inspect(model)
+    table = mapper.local_table
+    columns = {key: column.name for key, column in mapper.columns.items()}
+    pk_keys = [key for key, column in mapper.columns.items() if column.primary_key]
+    dialect = session.get_bind(mapper).dialect
+    unnest = dialect.name == 'postgresql'
+    returning = return_defaults and _supports_returning(dialect)
+    if returning and not unnest:
+        batch_size = max(min(batch_size, MAX_PARAMETERS // len(columns)), 1)
+
+    count = 0
+    statements = {}
+    for batch in chunked(rows, batch_size):
+        for group, mappings in _by_columns(batch, [_mapping(row, columns) for row in batch]):
+            _insert_group(session, table, pk_keys, group, mappings, unnest, returning, return_defaults,
+                          statements)
+        count += len(batch)
+    return count
+
+
+def _by_columns(batch, mappings):
+    # инструкция строится по набору колонок первой строки, поэтому строки порции
+    # с другим набором (например, объекты с разными заданными атрибутами) идут отдельной
+    # группой - иначе их лишние колонки пропали бы или стали NULL
+    groups = {}
+    for row, mapping in zip(batch, mappings):
+        rows, group_mappings = groups.setdefault(frozenset(mapping), ([], []))
+        rows.append(row)
+        group_mappings.append(mapping)
+    return groups.values()
+
+
+def _insert_group(session, table, pk_keys, batch, mappings, unnest, returning, return_defaults, statements):
+    if unnest:
+        names = tuple(mappings[0])
+        stmt = statements.get(names)
+        if stmt is None:
+            stmt = statements[names] = _unnest_insert(table, names, return_defaults)
+        arrays = {name: [m[name] for m in mappings] for name in names}
+        result = session.execute(stmt, arrays)
+        if return_defaults:
+            for row, pk in zip(batch, result):
+                _assign(row, pk_keys, pk)
+    elif returning:
+        stmt = insert(table).values(mappings).returning(*table.primary_key.columns)
+        for row, pk in zip(batch, session.execute(stmt)):
+            _assign(row, pk_keys, pk)
+    elif return_defaults:
+        # без RETURNING ключи можно получить только построчной вставкой
+        for row, mapping in zip(batch, mappings):
+            pk = session.execute(insert(table), mapping).inserted_primary_key
+            _assign(row, pk_keys, pk)
+    else:
+        session.execute(insert(table), mappings)
+
+
+def _assign(row, keys, values):
+    for key, value in zip(keys, values):
+        if isinstance(row, dict):
+            row[key] = value
+        else:
+            setattr(row, key, value)
@@ -0,0 +1,166 @@
+# Массовые UPDATE/DELETE порциями по диапазонам первичного ключа.
+# delete(customers).where(customers.c.username.like('Vladim%')) из first_db.py
+# на большой таблице одной транзакцией держит блокировки все время выполнения
+# и пишет весь объем изменений в WAL разом. Здесь изменение разбивается на порции:
+#   1. выбираются следующие chunk_size ключей, подходящих под условие (по порядку id)
+#   2. изменение выполняется для диапазона first <= id <= last с тем же условием
+#   3. порция фиксируется, после нее - пауза (throttle) и вызов progress
+# Блокировки держатся только на время одной порции.
+#
+#   chunked_delete(engine, customers, customers.c.username.like('Vladim%'),
+#                  progress=lambda p: print(p.done, p.rate))
+#
+# update_rows() выполняет N разных построчных изменений одной инструкцией:
+#   PostgreSQL - UPDATE ... FROM unnest(:id, :quantity, ...) AS v WHERE t.id = v.id
+#                (массивы вместо VALUES-списка: SQL один и тот же для любой порции)
+#   SQLite     - executemany одной подготовленной UPDATE ... WHERE id = ? (без сети
+#                это дешевле; UPDATE ... FROM sqlalchemy 1.4 для SQLite не компилирует)
+#   остальные  - UPDATE ... SET col = CASE id WHEN ... END WHERE id IN (...)
+import time
+from itertools import chain
+
+from sqlalchemy import and_, bindparam, case, cast, func, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from bulk_load import DEFAULT_CHUNK_SIZE, chunked
+from bulk_orm import MAX_PARAMETERS
+
+
+class Progress:
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.chunks = 0
+        self.last_key = None
+        self.started = time.perf_counter()
+        # самая долгая порция - столько другие транзакции могли ждать блокировку
+        self.max_chunk_time = 0.0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed else None
+
+    def __repr__(self):
+        total = f'/{self.total}' if self.total is not None else ''
+        return f'<Progress {self.done}{total} rows, {self.chunks} chunks, last id {self.last_key}>'
+
+
+def _key(table):
+    columns = list(table.primary_key.columns)
+    if len(columns) != 1:
+        raise ValueError(f'{table.name}: chunked mutations need a single-column primary key')
+    return columns[0]
+
+
+def _chunks(engine, table, where, chunk_size, pause, progress, mutate, estimate):
+    key = _key(table)
+    state = Progress()
+    if estimate:
+        stmt = select(func.count()).select_from(table)
+        with engine.connect() as conn:
+            state.total = conn.execute(stmt.where(where) if where is not None else stmt).scalar()
+    last = None
+    while True:
+        keys = select(key).order_by(key).limit(chunk_size)
+        if where is not None:
+            keys = keys.where(where)
+        if last is not None:
+            keys = keys.where(key > last)
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            found = conn.execute(keys).scalars().all()
+            if not found:
+                break
+            condition = and_(key >= found[0], key <= found[-1])
+            if where is not None:
+                condition = and_(condition, where)
+            state.done += mutate(conn, condition)
+        chunk_time = time.perf_counter() - start
+        state.max_chunk_time = max(state.max_chunk_time, chunk_time)
+        state.chunks += 1
+        state.last_key = last = found[-1]
+        if progress is not None:
+            progress(state)
+        if len(found) < chunk_size:
+            break
+        if pause:
+            # pause < 1 - доля от времени порции (0.5 - половину времени отдыхаем),
+            # иначе - фиксированная пауза в секундах
+            time.sleep(chunk_time * pause if pause < 1 else pause)
+    return state
+
+
+def chunked_delete(engine, table, where=None, chunk_size=DEFAULT_CHUNK_SIZE, pause=0.0,
+                   progress=None, estimate=False):
+    # удаляет строки порциями, каждая в своей транзакции; возвращает Progress
+    return _chunks(engine, table, where, chunk_size, pause, progress,
+                   lambda conn, condition: conn.execute(table.delete().where(condition)).rowcount,
+                   estimate)
+
+
+def chunked_update(engine, table, values, where=None, chunk_size=DEFAULT_CHUNK_SIZE, pause=0.0,
+                   progress=None, estimate=False):
+    # values - как в update().values(...): словарь значений или выражений
+    return _chunks(engine, table, where, chunk_size, pause, progress,
+                   lambda conn, condition: conn.execute(
+                       table.update().where(condition).values(values)).rowcount,
+                   estimate)
+
+
+def _unnest_update(table, key, names):
+    arrays = [cast(bindparam(f'v_{name}'), ARRAY(table.c[name].type)) for name in [key.name] + names]
+    source = func.unnest(*arrays).table_valued(key.name, *names).render_derived(name='v')
+    return table.update().where(key == source.c[key.name]) \
+        .values({name: source.c[name] for name in names})
+
+
+def _case_update(table, key, names, rows):
+    ids = [row[key.name] for row in rows]
+    values = {}
+    for name in names:
+        values[name] = case(
+            *[(key == row[key.name], row[name]) for row in rows],
+            else_=table.c[name])
+    return table.update().where(key.in_(ids)).values(values)
+
+
+def _executemany_update(table, key, names):
+    return table.update().where(key == bindparam(f'v_{key.name}')) \
+        .values({name: bindparam(f'v_{name}') for name in names})
+
+
+def update_rows(connection, table, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    # rows - словари {первичный ключ: ..., колонка: новое значение, ...} с одинаковыми
+    # ключами; каждая порция обновляется одной инструкцией. Возвращает число строк
+    key = _key(table)
+    dialect = connection.dialect.name
+    statement = None
+    count = 0
+    rows = iter(rows)
+    if dialect not in ('postgresql', 'sqlite'):
+        # в CASE на каждую строку и колонку приходится по два параметра
+        first = next(rows, None)
+        if first is None:
+            return 0
+        chunk_size = max(min(chunk_size, MAX_PARAMETERS // (2 * len(first) - 1)), 1)
+        rows = chain([first], rows)
+    for chunk in chunked(rows, chunk_size):
+        names = [name for name in chunk[0] if name != key.name]
+        if dialect == 'postgresql':
+            if statement is None:
+                statement = _unnest_update(table, key, names)
+            parameters = {f'v_{name}': [row[name] for row in chunk] for name in [key.name] + names}
+            count += connection.execute(statement, parameters).rowcount
+        elif dialect == 'sqlite':
+            if statement is None:
+                statement = _executemany_update(table, key, names)
+            parameters = [{f'v_{name}': value for name, value in row.items()} for row in chunk]
+            count += connection.execute(statement, parameters).rowcount
+        else:
+            count += connection.execute(_case_update(table, key, names, chunk)).rowcount
+    return count
@@ -0,0 +1,299 @@
+# Колоночная загрузка и выгрузка для таблиц Core (numpy / pandas).
+# Вместо списка словарей вроде items_list из first_db.py на вход подаются
+# массивы колонок: {'name': array, 'cost_price': array, ...} или DataFrame.
+# Типы проверяются векторно по типам колонок таблицы (Integer, Numeric(p, s), String(n),
+# DateTime, Boolean) и обязательности (nullable=False), после чего:
+#   PostgreSQL + psycopg2 - текст COPY собирается операциями numpy над целыми колонками
+#   остальные СУБД        - executemany кортежей (словари на каждую строку не создаются)
+# NULL во входных данных: NaN/NaT, None в массивах object или маска numpy.ma.
+# Выгрузка select_arrays() возвращает результат select() как массивы numpy по колонкам.
+import io
+
+import numpy
+from sqlalchemy import cast, type_coerce, types
+
+from bulk_load import DEFAULT_CHUNK_SIZE, _python_defaults, supports_copy, copy_from
+
+INTEGER_RANGES = {
+    types.SmallInteger: (-2 ** 15, 2 ** 15 - 1),
+    types.BigInteger: (-2 ** 63, 2 ** 63 - 1),
+    types.Integer: (-2 ** 31, 2 ** 31 - 1),
+}
+
+
+def _integer_range(type_):
+    for type_class, bounds in INTEGER_RANGES.items():
+        if isinstance(type_, type_class):
+            return bounds
+    return None
+
+
+def _nulls(values):
+    # маска NULL для массива любого dtype
+    if isinstance(values, numpy.ma.MaskedArray):
+        return numpy.ma.getmaskarray(values)
+    if values.dtype.kind == 'f':
+        return numpy.isnan(values)
+    if values.dtype.kind in 'mM':
+        return numpy.isnat(values)
+    if values.dtype.kind == 'O':
+        return numpy.array([value is None for value in values], dtype=bool) \
+            if len(values) else numpy.zeros(0, dtype=bool)
+    return numpy.zeros(len(values), dtype=bool)
+
+
+def _fail(column, bad, message):
+    positions = numpy.flatnonzero(bad)
+    raise ValueError(f'{column.table.name}.{column.name}: {message} '
+                     f'in {len(positions)} rows (first at row {positions[0]})')
+
+
+def validate(column, values):
+    # проверяет и приводит массив к типу колонки; возвращает (значения, маска NULL)
+    if isinstance(values, numpy.ma.MaskedArray):
+        nulls = numpy.ma.getmaskarray(values)
+        values = values.filled(0 if values.dtype.kind in 'iufb' else values.fill_value)
+    else:
+        values = numpy.asarray(values)
+        nulls = _nulls(values)
+    if not column.nullable and nulls.any():
+        _fail(column, nulls, 'NULL in NOT NULL column')
+    type_ = column.type
+    kind = values.dtype.kind
+
+    if isinstance(type_, types.Integer):
+        if kind == 'f':
+            present = numpy.where(nulls, 0, values)
+            fractional = present != numpy.floor(present)
+            if fractional.any():
+                _fail(column, fractional, 'non-integer value')
+            values = present.astype(numpy.int64)
+        elif kind == 'b':
+            values = values.astype(numpy.int64)
+        elif kind not in 'iu':
+            raise ValueError(f'{column.table.name}.{column.name}: dtype {values.dtype} is not integer')
+        bounds = _integer_range(type_)
+        if bounds is not None:
+            outside = ((values < bounds[0]) | (values > bounds[1])) & ~nulls
+            if outside.any():
+                _fail(column, outside, f'value outside {type(type_).__name__} range')
+        return values, nulls
+
+    if isinstance(type_, types.Numeric):
+        if kind not in 'iufb':
+            raise ValueError(f'{column.table.name}.{column.name}: dtype {values.dtype} is not numeric')
+        values = values.astype(numpy.float64)
+        if type_.scale is not None:
+            values = numpy.round(values, type_.scale)
+        if type_.precision is not None:
+            limit = 10.0 ** (type_.precision - (type_.scale or 0))
+            outside = ~nulls & ~(numpy.abs(numpy.where(nulls, 0, values)) < limit)
+            if outside.any():
+                _fail(column, outside, f'value does not fit Numeric({type_.precision}, {type_.scale})')
+        return values, nulls
+
+    if isinstance(type_, types.String):
+        if kind == 'O':
+            values = numpy.where(nulls, '', values).astype(str)
+        elif kind not in 'UT':
+            raise ValueError(f'{column.table.name}.{column.name}: dtype {values.dtype} is not a string')
+        if type_.length is not None:
+            too_long = numpy.strings.str_len(values) > type_.length
+            if too_long.any():
+                _fail(column, too_long, f'string longer than {type_.length}')
+        return values, nulls
+
+    if isinstance(type_, types.DateTime):
+        if kind != 'M':
+            raise ValueError(f'{column.table.name}.{column.name}: dtype {values.dtype} is not datetime64')
+        return values.astype('datetime64[us]'), nulls
+
+    if isinstance(type_, types.Boolean):
+        if kind != 'b':
+            raise ValueError(f'{column.table.name}.{column.name}: dtype {values.dtype} is not bool')
+        return values, nulls
+
+    return values, nulls
+
+
+def prepare_columns(table, data):
+    # data - словарь {имя колонки: массив} или DataFrame; возвращает
+    # (имена колонок, [(значения, маска NULL)], число строк)
+    arrays = dict(data.items())
+    names = [column.name for column in table.columns if column.name in arrays]
+    unknown = set(arrays) - set(names)
+    if unknown:
+        raise ValueError(f'{table.name}: unknown columns {sorted(unknown)}')
+    lengths = {len(arrays[name]) for name in names}
+    if len(lengths) > 1:
+        raise ValueError(f'{table.name}: columns have different lengths {sorted(lengths)}')
+    count = lengths.pop() if lengths else 0
+    prepared = [validate(table.c[name], arrays[name]) for name in names]
+    # значения по умолчанию на стороне python вычисляются один раз на всю загрузку
+    for name, make in _python_defaults(table, names).items():
+        value = make()
+        if isinstance(table.c[name].type, types.DateTime):
+            column = numpy.full(count, numpy.datetime64(value, 'us'))
+        else:
+            column = numpy.full(count, value)
+        prepared.append(validate(table.c[name], column))
+        names.append(name)
+    missing = [column.name for column in table.columns
+               if column.name not in names and not column.nullable and column.server_default is None
+               and not (column.primary_key and column.autoincrement in ('auto', True))]
+    if missing:
+        raise ValueError(f'{table.name}: missing NOT NULL columns {missing}')
+    return names, prepared, count
+
+
+def _copy_text(values, nulls):
+    # колонка -> массив строк в текстовом формате COPY
+    kind = values.dtype.kind
+    if kind == 'b':
+        text = numpy.where(values, 't', 'f')
+    elif kind in 'UT':
+        text = values
+        for char, escaped in (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')):
+            text = numpy.strings.replace(text, char, escaped)
+    else:
+        text = values.astype(str)
+    if nulls.any():
+        text = numpy.where(nulls, '\\N', text)
+    return text
+
+
+def _copy_chunk(cursor, sql, prepared, start, stop):
+    lines = None
+    for values, nulls in prepared:
+        text = _copy_text(values[start:stop], nulls[start:stop])
+        lines = text if lines is None else numpy.strings.add(numpy.strings.add(lines, '\t'), text)
+    buffer = io.StringIO('\n'.join(lines.tolist()) + '\n')
+    copy_from(cursor, sql, buffer)
+
+
+def _python_values(values, nulls):
+    # колонка -> список значений python с None вместо NULL
+    if values.dtype.kind in 'UT':
+        values = values.astype(object)
+    result = values.tolist()
+    if nulls.any():
+        for position in numpy.flatnonzero(nulls).tolist():
+            result[position] = None
+    return result
+
+
+def _placeholders(dialect, count):
+    style = dialect.paramstyle
+    if style == 'qmark':
+        return ['?'] * count
+    if style == 'numeric':
+        return [f':{i}' for i in range(1, count + 1)]
+    if style in ('format', 'pyformat'):
+        return ['%s'] * count
+    raise ValueError(f'unsupported paramstyle {style}')
+
+
+def insert_columns(connection, table, data, chunk_size=DEFAULT_CHUNK_SIZE * 10):
+    # загружает колонки в таблицу; возвращает число строк
+    names, prepared, count = prepare_columns(table, data)
+    if not count:
+        return 0
+    preparer = connection.dialect.identifier_preparer
+    columns = ', '.join(preparer.quote(name) for name in names)
+    if supports_copy(connection):
+        sql = f'COPY {preparer.format_table(table)} ({columns}) FROM STDIN'
+        cursor = connection.connection.cursor()
+        try:
+            for start in range(0, count, chunk_size):
+                _copy_chunk(cursor, sql, prepared, start, min(start + chunk_size, count))
+        finally:
+            cursor.close()
+        return count
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        preparer.format_table(table), columns, ', '.join(_placeholders(connection.dialect, len(names))))
+    for start in range(0, count, chunk_size):
+        stop = min(start + chunk_size, count)
+        lists = [_python_values(values[start:stop], nulls[start:stop]) for values, nulls in prepared]
+        connection.exec_driver_sql(sql, list(zip(*lists)))
+    return count
+
+
+def _dtype(type_, has_nulls):
+    if isinstance(type_, types.Integer):
+        return numpy.float64 if has_nulls else numpy.int64
+    if isinstance(type_, (types.Numeric, types.Float)):
+        return numpy.float64
+    if isinstance(type_, types.DateTime):
+        return 'datetime64[us]'
+    if isinstance(type_, types.Boolean) and not has_nulls:
+        return bool
+    return object
+
+
+def _to_array(values, type_):
+    has_nulls = None in values
+    dtype = _dtype(type_, has_nulls)
+    if has_nulls and dtype is numpy.float64:
+        values = [numpy.nan if value is None else value for value in values]
+    elif has_nulls and dtype == 'datetime64[us]':
+        values = [numpy.datetime64('NaT') if value is None else value for value in values]
+    return numpy.array(values, dtype=dtype)
+
+
+def _float_columns(stmt, dialect):
+    # Numeric читается сразу как float: без этого драйвер или sqlalchemy
+    # создают Decimal на каждое значение, которые потом все равно станут float64
+    columns = []
+    changed = False
+    for column in stmt.selected_columns:
+        if isinstance(column.type, types.Numeric) and not isinstance(column.type, types.Float):
+            convert = cast if dialect.name == 'postgresql' else type_coerce
+            column = convert(column, types.Float()).label(column.key)
+            changed = True
+        columns.append(column)
+    return stmt.with_only_columns(*columns) if changed else stmt
+
+
+def _partitions(connection, stmt, partition_size):
+    # порции строк через серверный курсор (stream_results): запрос выполняет sqlalchemy,
+    # так что параметры проходят bind-процессоры и раскрытие списков IN, а имя курсора
+    # у каждого запроса свое
+    result = connection.execution_options(stream_results=True).execute(stmt)
+    try:
+        if not supports_copy(connection):
+            yield from result.partitions(partition_size)
+            return
+        # psycopg2 и psycopg 3 сами возвращают готовые типы python: после первой порции
+        # (sqlalchemy уже держит начало выборки в своем буфере) строки читаются прямо
+        # из курсора драйвера, без объектов Row
+        partition = result.fetchmany(partition_size)
+        while partition:
+            yield partition
+            if len(partition) < partition_size:
+                return
+            partition = result.cursor.fetchmany(partition_size)
+    finally:
+        result.close()
+
+
+def select_arrays(connection, stmt, partition_size=DEFAULT_CHUNK_SIZE * 10):
+    # результат select() как {колонка: numpy-массив}; целые колонки с NULL
+    # становятся float64 с NaN, Numeric - float64, строки - массивы object
+    stmt = _float_columns(stmt, connection.dialect)
+    columns = list(stmt.selected_columns)
+    parts = [[] for _ in columns]
+    for partition in _partitions(connection, stmt, partition_size):
+        for position, values in enumerate(zip(*partition)):
+            parts[position].append(_to_array(values, columns[position].type))
+    result = {}
+    for column, chunks in zip(columns, parts):
+        if not chunks:
+            result[column.key] = numpy.array([], dtype=_dtype(column.type, False))
+        elif len(chunks) == 1:
+            result[column.key] = chunks[0]
+        else:
+            # при NULL только в части порций dtype порций может различаться
+            dtypes = {chunk.dtype for chunk in chunks}
+            result[column.key] = numpy.concatenate(chunks) if len(dtypes) == 1 else \
+                numpy.concatenate([chunk.astype(numpy.result_type(*dtypes)) for chunk in chunks])
+    return result
@@ -0,0 +1,163 @@
+# Общая фабрика движков (Engine) вместо create_engine(conn_string) в каждом скрипте.
+# Строка подключения собирается из credentials.py, а параметры пула
+# выбираются по имени профиля:
+#   default     - QueuePool для обычных приложений
+#   service     - QueuePool побольше для сервисов с конкурентными запросами
+#   script      - NullPool: соединение закрывается сразу после использования,
+#                 удобно для одноразовых скриптов вроде first_db.py
+#   sqlite_test - StaticPool: одно соединение на весь процесс, нужно для sqlite://
+#                 в памяти, иначе каждое соединение видит свою пустую БД
+# Драйвер PostgreSQL выбирается параметром driver (по умолчанию DRIVER):
+#   psycopg2 - как раньше
+#   psycopg  - psycopg 3 с подготовленными на сервере инструкциями и конвейером
+#              (см. psycopg_backend.py), например get_engine('sales', driver='psycopg',
+#              prepare_threshold=0)
+# Для каждого движка собирается статистика пула: время ожидания соединения
+# и насыщенность (сколько соединений выдано от максимально возможного).
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, NullPool, StaticPool
+
+from credentials import user, password
+import psycopg_backend  # noqa: F401 - регистрирует postgresql+psycopg в SQLAlchemy 1.4
+
+HOST = 'localhost'
+DRIVER = 'psycopg2'
+
+PROFILES = {
+    'default': dict(poolclass=QueuePool, pool_size=5, max_overflow=10,
+                    pool_pre_ping=True, pool_recycle=1800),
+    'service': dict(poolclass=QueuePool, pool_size=20, max_overflow=20,
+                    pool_pre_ping=True, pool_recycle=1800, pool_timeout=10),
+    'script': dict(poolclass=NullPool),
+    'sqlite_test': dict(poolclass=StaticPool, connect_args={'check_same_thread': False}),
+}
+
+_engines = {}
+_stats = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def postgres_url(db_name=None, host=HOST, driver=None):
+    url = f"postgresql+{driver or DRIVER}://{user}:{password}@{host}"
+    return f"{url}/{db_name}" if db_name else url
+
+
+def percentile(values, q):
+    # q от 0 до 100; для пустого набора возвращает None
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class PoolStats:
+    # статистика пула одного движка; время ожидания хранится
+    # для последних window выдач соединения
+    def __init__(self, capacity, window=10000):
+        self.capacity = capacity
+        self.checkouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.waits = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def record_wait(self, seconds):
+        self.waits.append(seconds)
+
+    def saturation(self):
+        # доля занятых соединений; для NullPool ограничения нет - None
+        if not self.capacity:
+            return None
+        return self.checked_out / self.capacity
+
+    def snapshot(self):
+        waits = list(self.waits)
+        return {
+            'checkouts': self.checkouts,
+            'checked_out': self.checked_out,
+            'max_checked_out': self.max_checked_out,
+            'capacity': self.capacity,
+            'saturation': self.saturation(),
+            'wait_p50': percentile(waits, 50),
+            'wait_p99': percentile(waits, 99),
+            'wait_max': max(waits) if waits else None,
+        }
+
+
+def _capacity(options):
+    poolclass = options.get('poolclass')
+    if poolclass is QueuePool:
+        return options.get('pool_size', 5) + max(options.get('max_overflow', 10), 0)
+    if poolclass is StaticPool:
+        return 1
+    return None
+
+
+def get_engine(db_name=None, profile='default', url=None, driver=None, **kwargs):
+    # один движок на пару (строка подключения, профиль); повторные вызовы
+    # возвращают уже созданный движок вместе с его пулом
+    if url is None:
+        url = 'sqlite://' if profile == 'sqlite_test' else postgres_url(db_name, driver=driver)
+    key = (str(url), profile, repr(sorted(kwargs.items())))
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            options = dict(PROFILES[profile], **kwargs)
+            if str(url).startswith('sqlite'):
+                # соединения sqlite из пула могут попадать в разные потоки
+                options.setdefault('connect_args', {'check_same_thread': False})
+            engine = create_engine(url, **options)
+            stats = PoolStats(_capacity(options))
+            event.listen(engine, 'checkout', stats.on_checkout)
+            event.listen(engine, 'checkin', stats.on_checkin)
+            _stats[engine] = stats
+            _engines[key] = engine
+    return engine
+
+
+def pool_stats(engine):
+    return _stats.get(engine)
+
+
+@contextmanager
+def connection(engine):
+    # соединение, которое гарантированно вернется в пул после блока with;
+    # время его получения попадает в статистику пула
+    start = time.perf_counter()
+    conn = engine.connect()
+    stats = _stats.get(engine)
+    if stats is not None:
+        stats.record_wait(time.perf_counter() - start)
+    with conn:
+        yield conn
+
+
+@contextmanager
+def transaction(engine):
+    # то же самое, но внутри транзакции: commit при выходе, rollback при ошибке
+    with connection(engine) as conn, conn.begin():
+        yield conn
+
+
+def dispose_all():
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
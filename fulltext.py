@@ -0,0 +1,234 @@
+# Полнотекстовый поиск по текстовым колонкам (blog.content, posts.post_title, ...).
+# Без него поиск сводится к LIKE '%...%' - последовательному чтению всей таблицы.
+# searchable() объявляет поиск для таблицы, а нужные объекты создаются вместе с ней
+# (событие after_create) или для уже существующей таблицы через install():
+#   PostgreSQL - вычисляемая колонка search_vector tsvector GENERATED ALWAYS AS
+#                (setweight(to_tsvector(...), 'A') || ...) STORED и GIN-индекс по ней;
+#                для trigram-колонок - GIN-индексы gin_trgm_ops (pg_trgm) под LIKE/ILIKE
+#   SQLite     - теневая таблица FTS5 <таблица>_fts (external content) и, для
+#                trigram-колонок, <таблица>_trgm с tokenize='trigram'; их синхронизируют триггеры
+# search() строит запрос с ранжированием (ts_rank на PostgreSQL, bm25 на SQLite),
+# like() - условие LIKE, которое использует trigram-индекс. Во время массовой загрузки
+# индексы поддерживать дороже, чем построить заново, - для этого bulk_loading().
+#
+#   searchable(posts, ['post_title', 'content'], weights={'post_title': 'A'}, trigram=['post_title'])
+#   conn.execute(search(posts, 'sqlalchemy orm', conn.dialect.name, limit=20))
+#   conn.execute(select(posts).where(like(posts, 'post_title', '%alchemy%', conn.dialect.name)))
+#   with bulk_loading(conn, posts):
+#       load_rows(conn, posts, rows)
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event, false, func, literal_column, select, table as table_clause, column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from schema_reconcile import raw_ddl
+
+FULLTEXT = 'fulltext'
+VECTOR_COLUMN = 'search_vector'
+# веса ts_rank по умолчанию для A, B, C, D - те же множители используются в bm25
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+# DDL ниже собирается текстом, поэтому имена таблиц и колонок (в смешанном регистре,
+# зарезервированные слова) экранируются так же, как их экранирует sqlalchemy
+_PG = postgresql.dialect().identifier_preparer
+_SQLITE = sqlite.dialect().identifier_preparer
+
+
+def _literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+class FullText:
+    def __init__(self, table, columns, weights=None, config='simple', trigram=()):
+        key = list(table.primary_key.columns)
+        if len(key) != 1:
+            raise ValueError(f'{table.name}: full-text search needs a single-column primary key')
+        self.table = table
+        self.key = key[0].name
+        self.columns = list(columns)
+        self.weights = {name: (weights or {}).get(name, 'D' if weights else 'A') for name in self.columns}
+        self.config = config
+        self.trigram = list(trigram)
+        self.fts = f'{table.name}_fts'
+        self.trgm = f'{table.name}_trgm'
+
+    # PostgreSQL
+    def _vector_sql(self):
+        parts = [f"setweight(to_tsvector({_literal(self.config)}, coalesce({_PG.quote(name)}, '')), "
+                 f"'{self.weights[name]}')" for name in self.columns]
+        return ' || '.join(parts)
+
+    def _postgresql_index_names(self):
+        # {имя индекса: выражение}
+        names = {f'ix_{self.table.name}_{VECTOR_COLUMN}': _PG.quote(VECTOR_COLUMN)}
+        names.update((f'ix_{self.table.name}_{name}_trgm', f'{_PG.quote(name)} gin_trgm_ops')
+                     for name in self.trigram)
+        return names
+
+    def postgresql_indexes(self):
+        table = _PG.format_table(self.table)
+        return [f'CREATE INDEX IF NOT EXISTS {_PG.quote(name)} ON {table} USING gin ({expression})'
+                for name, expression in self._postgresql_index_names().items()]
+
+    def postgresql_drop_indexes(self):
+        # индекс лежит в схеме своей таблицы
+        schema = f'{_PG.quote_schema(self.table.schema)}.' if self.table.schema else ''
+        return [f'DROP INDEX IF EXISTS {schema}{_PG.quote(name)}' for name in self._postgresql_index_names()]
+
+    def postgresql(self):
+        statements = ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] if self.trigram else []
+        statements.append(f'ALTER TABLE {_PG.format_table(self.table)} ADD COLUMN IF NOT EXISTS '
+                          f'{_PG.quote(VECTOR_COLUMN)} tsvector GENERATED ALWAYS AS ({self._vector_sql()}) STORED')
+        return statements + self.postgresql_indexes()
+
+    # SQLite
+    def _shadow_tables(self):
+        # (теневая таблица, ее колонки, параметры fts5)
+        tables = [(self.fts, self.columns, '')]
+        if self.trigram:
+            tables.append((self.trgm, self.trigram, ", tokenize='trigram'"))
+        return tables
+
+    def sqlite_triggers(self):
+        quote = _SQLITE.quote
+        key = quote(self.key)
+        insert, delete = [], []
+        for name, columns, _ in self._shadow_tables():
+            name = quote(name)
+            listed = ', '.join(quote(c) for c in columns)
+            insert.append(f'INSERT INTO {name} (rowid, {listed}) VALUES '
+                          f'(new.{key}, {", ".join(f"new.{quote(c)}" for c in columns)});')
+            delete.append(f"INSERT INTO {name} ({name}, rowid, {listed}) VALUES "
+                          f"('delete', old.{key}, {', '.join(f'old.{quote(c)}' for c in columns)});")
+        table = _SQLITE.format_table(self.table)
+        trigger = self._sqlite_trigger
+        return [
+            f'CREATE TRIGGER IF NOT EXISTS {trigger("insert")} AFTER INSERT ON {table} BEGIN\n'
+            + '\n'.join(insert) + '\nEND',
+            f'CREATE TRIGGER IF NOT EXISTS {trigger("delete")} AFTER DELETE ON {table} BEGIN\n'
+            + '\n'.join(delete) + '\nEND',
+            f'CREATE TRIGGER IF NOT EXISTS {trigger("update")} AFTER UPDATE ON {table} BEGIN\n'
+            + '\n'.join(delete + insert) + '\nEND',
+        ]
+
+    def _sqlite_trigger(self, event_):
+        return _SQLITE.quote(f'{self.table.name}_fts_{event_}')
+
+    def sqlite_drop_triggers(self):
+        return [f'DROP TRIGGER IF EXISTS {self._sqlite_trigger(event_)}' for event_ in ('insert', 'delete', 'update')]
+
+    def sqlite_rebuild(self):
+        # external content: индекс FTS5 пересобирается из исходной таблицы
+        return [f"INSERT INTO {_SQLITE.quote(name)} ({_SQLITE.quote(name)}) VALUES ('rebuild')"
+                for name, _, _ in self._shadow_tables()]
+
+    def sqlite(self):
+        statements = [f"CREATE VIRTUAL TABLE IF NOT EXISTS {_SQLITE.quote(name)} "
+                      f"USING fts5({', '.join(_SQLITE.quote(c) for c in columns)}, "
+                      f"content={_literal(self.table.name)}, content_rowid={_literal(self.key)}{options})"
+                      for name, columns, options in self._shadow_tables()]
+        return statements + self.sqlite_triggers()
+
+    def sqlite_drop(self):
+        return [f'DROP TABLE IF EXISTS {_SQLITE.quote(name)}' for name, _, _ in self._shadow_tables()]
+
+
+def searchable(table, columns, weights=None, config='simple', trigram=()):
+    # weights - {колонка: 'A'..'D'} (без weights все колонки равны);
+    # config - конфигурация текстового поиска PostgreSQL ('simple', 'english', 'russian', ...)
+    spec = FullText(table, columns, weights, config, trigram)
+    table.info[FULLTEXT] = spec
+    for statement in spec.postgresql():
+        event.listen(table, 'after_create', raw_ddl(statement).execute_if(dialect='postgresql'))
+    for statement in spec.sqlite():
+        event.listen(table, 'after_create', raw_ddl(statement).execute_if(dialect='sqlite'))
+    for statement in spec.sqlite_drop():
+        event.listen(table, 'after_drop', raw_ddl(statement).execute_if(dialect='sqlite'))
+    return spec
+
+
+def _spec(table):
+    try:
+        return table.info[FULLTEXT]
+    except KeyError:
+        raise ValueError(f'{table.name} is not searchable, see searchable()') from None
+
+
+def install(connection, table):
+    # объекты поиска для уже существующей таблицы (с заполнением по текущим строкам)
+    spec = _spec(table)
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        statements = spec.postgresql()
+    elif dialect == 'sqlite':
+        statements = spec.sqlite() + spec.sqlite_rebuild()
+    else:
+        raise ValueError(f'full-text search is not generated for {dialect}')
+    for statement in statements:
+        connection.execute(raw_ddl(statement))
+
+
+@contextmanager
+def bulk_loading(connection, table):
+    # на время загрузки индексы поиска (PostgreSQL) или триггеры синхронизации (SQLite)
+    # снимаются, после нее - строятся заново по всем строкам за один проход
+    spec = _spec(table)
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        before, after = spec.postgresql_drop_indexes(), spec.postgresql_indexes()
+    elif dialect == 'sqlite':
+        before, after = spec.sqlite_drop_triggers(), spec.sqlite_rebuild() + spec.sqlite_triggers()
+    else:
+        before, after = [], []
+    # в точке сохранения: если загрузка упадет, откат к ней вернет и снятые
+    # триггеры/индексы, и поиск останется согласован с данными таблицы. Без начатой
+    # транзакции блок выполняется в своей: фиксируется в конце, откатывается при ошибке
+    scope = connection.begin_nested() if connection.in_transaction() else connection.begin()
+    with scope:
+        for statement in before:
+            connection.execute(raw_ddl(statement))
+        yield connection
+        for statement in after:
+            connection.execute(raw_ddl(statement))
+
+
+def _fts_query(terms):
+    # пользовательский ввод -> запрос FTS5: слова в кавычках, все должны встретиться
+    words = re.findall(r'\w+', terms)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def search(table, terms, dialect, limit=None, rank=True):
+    # select(таблица, rank) по словам terms, лучшие совпадения первыми;
+    # rank=False - без ранжирования (первые найденные, не читая все совпадения)
+    spec = _spec(table)
+    if dialect == 'postgresql':
+        vector = literal_column(f'{_PG.format_table(table)}.{_PG.quote(VECTOR_COLUMN)}', TSVECTOR)
+        query = func.websearch_to_tsquery(spec.config, terms)
+        score = func.ts_rank(vector, query).label('rank')
+        stmt = select(table, score).where(vector.op('@@')(query))
+    elif dialect == 'sqlite':
+        fts = table_clause(spec.fts, column('rowid'))
+        weights = [WEIGHTS[spec.weights[name]] for name in spec.columns]
+        score = (-func.bm25(literal_column(_SQLITE.quote(spec.fts)), *weights)).label('rank')
+        match = _fts_query(terms)
+        stmt = select(table, score).join(fts, fts.c.rowid == table.c[spec.key])
+        stmt = stmt.where(literal_column(_SQLITE.quote(spec.fts)).op('MATCH')(match)) if match \
+            else stmt.where(false())
+    else:
+        raise ValueError(f'full-text search is not generated for {dialect}')
+    if rank:
+        stmt = stmt.order_by(score.desc())
+    return stmt.limit(limit) if limit is not None else stmt
+
+
+def like(table, name, pattern, dialect):
+    # условие "колонка LIKE pattern" без учета регистра, через trigram-индекс:
+    # на PostgreSQL его использует сам ILIKE, на SQLite - поиск в таблице <таблица>_trgm
+    spec = table.info.get(FULLTEXT)
+    target = table.c[name]
+    if dialect == 'sqlite' and spec is not None and name in spec.trigram:
+        trgm = table_clause(spec.trgm, column('rowid'), column(name))
+        return table.c[spec.key].in_(select(trgm.c.rowid).where(trgm.c[name].like(pattern)))
+    return target.ilike(pattern)
@@ -0,0 +1,212 @@
+# Советник по индексам для MetaData.
+# Во всех схемах репозитория внешние ключи (posts.user_id, orders.customer_id,
+# order_lines.order_id/item_id, post_tags.post_id/tag_id) объявлены без индексов,
+# а в orm_schema_crud.py есть Index('title_content_index' 'title', 'content'):
+# без запятой python склеивает строки, и получается индекс с именем
+# 'title_content_indextitle' только по колонке content.
+# Здесь:
+#   check_metadata(metadata)  - внешние ключи без индексов и подозрительные Index
+#   WorkloadAdvisor           - по журналу запросов (select-инструкциям) предлагает
+#                               составные индексы: сначала колонки из равенств,
+#                               затем из диапазонов и сортировки
+# Предложения можно получить как DDL или применить как объекты Index.
+from collections import Counter, OrderedDict
+from itertools import chain
+
+from sqlalchemy import Index, Column, UniqueConstraint
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression
+
+EQUALITY = {operators.eq, operators.in_op}
+RANGE = {operators.lt, operators.le, operators.gt, operators.ge, operators.between_op,
+         operators.like_op}
+
+
+def _covered(table, columns):
+    # колонки покрыты, если они - начало первичного ключа, уникального ограничения или индекса
+    names = [c.name if isinstance(c, Column) else c for c in columns]
+    candidates = [list(table.primary_key.columns.keys())]
+    candidates += [[c.name for c in index.columns] for index in table.indexes]
+    candidates += [[c.name for c in constraint.columns] for constraint in table.constraints
+                   if isinstance(constraint, UniqueConstraint)]
+    return any(candidate[:len(names)] == names for candidate in candidates)
+
+
+class Suggestion:
+    def __init__(self, table, columns, reason, include=(), unique=False):
+        self.table = table
+        self.columns = list(columns)
+        self.include = [c for c in include if c not in self.columns]
+        self.reason = reason
+        self.unique = unique
+
+    @property
+    def name(self):
+        return 'ix_{}_{}'.format(self.table.name, '_'.join(self.columns))
+
+    def ddl(self, dialect):
+        preparer = dialect.identifier_preparer
+        quote = preparer.quote
+        # format_table добавляет схему таблицы (table.schema), если она задана
+        sql = 'CREATE {}INDEX {} ON {} ({})'.format(
+            'UNIQUE ' if self.unique else '', quote(self.name), preparer.format_table(self.table),
+            ', '.join(quote(c) for c in self.columns))
+        if self.include and dialect.name == 'postgresql':
+            sql += ' INCLUDE ({})'.format(', '.join(quote(c) for c in self.include))
+        return sql
+
+    def index(self):
+        # создает Index и добавляет его в таблицу (и в metadata.create_all); повторный
+        # вызов (в том числе у другого предложения с тем же именем) возвращает тот же Index
+        for index in self.table.indexes:
+            if index.name == self.name:
+                return index
+        kwargs = {'postgresql_include': self.include} if self.include else {}
+        return Index(self.name, *(self.table.c[c] for c in self.columns), unique=self.unique, **kwargs)
+
+    def __repr__(self):
+        return f'<Suggestion {self.name}: {self.reason}>'
+
+
+def unindexed_foreign_keys(metadata):
+    suggestions = []
+    for table in metadata.sorted_tables:
+        for constraint in table.foreign_key_constraints:
+            columns = [c.name for c in constraint.columns]
+            if not _covered(table, columns):
+                suggestions.append(Suggestion(
+                    table, columns, f'foreign key to {constraint.referred_table.name} without index'))
+    return suggestions
+
+
+def malformed_indexes(metadata):
+    # список (index, описание проблемы)
+    problems = []
+    for table in metadata.sorted_tables:
+        seen = {}
+        for index in sorted(table.indexes, key=lambda i: i.name or ''):
+            columns = tuple(c.name for c in index.columns)
+            if not columns and not index.expressions:
+                problems.append((index, 'index has no columns'))
+                continue
+            name = index.name or ''
+            glued = _glued_column(table, name, columns)
+            if glued is not None:
+                problems.append((index, f'name ends with column {glued!r} that is not '
+                                        f'indexed - probably a missing comma between strings'))
+            if columns in seen:
+                problems.append((index, f'duplicates index {seen[columns]}'))
+            seen.setdefault(columns, name)
+            if columns and not index.unique and _prefix_of_other(table, index, columns):
+                problems.append((index, 'redundant: a prefix of a wider index'))
+    return problems
+
+
+def _glued_column(table, name, columns):
+    # 'title_content_index' 'title' -> 'title_content_indextitle': имя склеено с колонкой
+    # без разделителя, а сама основа имени перечисляет и эту колонку, и индексированные.
+    # Простого совпадения окончания мало: у 'ix_users_username' окончание 'name' - тоже колонка
+    for column in table.columns:
+        if column.name in columns or not name.endswith(column.name) or len(name) <= len(column.name):
+            continue
+        stem = name[:-len(column.name)]
+        if not stem[-1].isalnum():
+            continue
+        words = f'_{stem}_'
+        if all(f'_{word}_' in words for word in (column.name,) + columns):
+            return column.name
+    return None
+
+
+def _prefix_of_other(table, index, columns):
+    for other in table.indexes:
+        other_columns = tuple(c.name for c in other.columns)
+        if other is not index and len(other_columns) > len(columns) \
+                and other_columns[:len(columns)] == columns:
+            return True
+    return False
+
+
+def check_metadata(metadata):
+    return {
+        'unindexed_foreign_keys': unindexed_foreign_keys(metadata),
+        'malformed_indexes': malformed_indexes(metadata),
+    }
+
+
+def _column(element):
+    # колонка таблицы (в том числе аннотированная колонка ORM-модели) или None
+    table = getattr(element, 'table', None)
+    if isinstance(element, Column) and table is not None and hasattr(table, 'name'):
+        return table.name, element.name
+    return None
+
+
+class WorkloadAdvisor:
+    # журнал запросов: record(stmt, count) для каждого выполненного select()
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.patterns = Counter()
+
+    def record(self, stmt, count=1):
+        for pattern in self._patterns(stmt):
+            self.patterns[pattern] += count
+
+    def _patterns(self, stmt):
+        # для каждой таблицы: (таблица, колонки равенств, колонки диапазонов/сортировки, выбранные колонки)
+        equality, ranges, selected = {}, {}, {}
+        # select().join() хранит соединения отдельно; условия ON видны только в итоговых FROM
+        froms = stmt.get_final_froms() if hasattr(stmt, 'get_final_froms') else stmt.froms
+        elements = chain(visitors.iterate(stmt), *(visitors.iterate(f) for f in froms))
+        for element in elements:
+            if isinstance(element, BinaryExpression):
+                left, right = _column(element.left), _column(element.right)
+                if left and right and element.operator is operators.eq:
+                    # условие соединения: индекс нужен той стороне, где его еще нет
+                    # (обычно это внешний ключ, а не первичный)
+                    for table, column in (left, right):
+                        known = self.metadata.tables.get(table)
+                        if known is None or not _covered(known, [column]):
+                            equality.setdefault(table, OrderedDict())[column] = None
+                elif left and element.operator in EQUALITY:
+                    equality.setdefault(left[0], OrderedDict())[left[1]] = None
+                elif left and element.operator in RANGE:
+                    ranges.setdefault(left[0], OrderedDict())[left[1]] = None
+        for clause in getattr(stmt, '_order_by_clauses', ()):
+            column = _column(getattr(clause, 'element', clause))
+            if column:
+                ranges.setdefault(column[0], OrderedDict())[column[1]] = None
+        for element in getattr(stmt, 'selected_columns', ()):
+            column = _column(element)
+            if column:
+                selected.setdefault(column[0], OrderedDict())[column[1]] = None
+        for table in set(equality) | set(ranges):
+            eq = tuple(equality.get(table, ()))
+            rng = tuple(c for c in ranges.get(table, ()) if c not in eq)
+            yield table, eq, rng, tuple(selected.get(table, ()))
+
+    def suggest(self, min_count=1, covering=True, max_include=3):
+        suggestions = OrderedDict()
+        for (table_name, eq, rng, selected), count in self.patterns.most_common():
+            if count < min_count or table_name not in self.metadata.tables:
+                continue
+            table = self.metadata.tables[table_name]
+            # в индекс идет только одна колонка диапазона: после нее остальные не используются
+            columns = list(eq) + list(rng[:1])
+            if not columns or _covered(table, columns):
+                continue
+            include = ()
+            if covering:
+                rest = [c for c in selected if c not in columns]
+                if len(rest) <= max_include:
+                    include = rest
+            key = (table_name, tuple(columns))
+            if key not in suggestions:
+                suggestions[key] = Suggestion(table, columns, f'{count} queries', include)
+        return list(suggestions.values())
+
+
+def apply(suggestions, connection):
+    # создает индексы в БД и добавляет их в metadata
+    for suggestion in suggestions:
+        suggestion.index().create(connection)
@@ -0,0 +1,285 @@
+# Легковесная инструментация выполнения SQL вместо echo=True.
+# echo пишет в лог текст каждой инструкции и заметно замедляет горячий путь.
+# Здесь события before/after_cursor_execute только засекают время и обновляют
+# счетчики по "форме" инструкции (тексту SQL с параметрами-заполнителями):
+# гистограмму задержек, число строк и размеры пакетов executemany.
+# Инструкции дольше порога сохраняются вместе с планом выполнения (EXPLAIN); план
+# получается не в горячем пути, а при snapshot(), на отдельном соединении из пула.
+# События пула checkout/checkin дают число выданных соединений и насыщенность пула,
+# время получения соединения замеряется вокруг выдачи из пула (после engine.dispose()
+# замер переустанавливается на новый пул).
+# Данные доступны через snapshot() и могут периодически сбрасываться в JSON-файл.
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from engine_factory import PoolStats, pool_stats
+
+_START = 'instrumentation_start'
+
+# границы корзин гистограммы задержек в секундах
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        # верхняя граница корзины, в которую попадает q-й процентиль
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': dict(zip([str(b) for b in self.bounds] + ['inf'], self.counts)),
+        }
+
+
+class StatementStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.executemany_calls = 0
+        self.executemany_rows = 0
+        self.max_batch = 0
+
+    def snapshot(self):
+        return {
+            'latency': self.latency.snapshot(),
+            'rows': self.rows,
+            'executemany_calls': self.executemany_calls,
+            'mean_batch': self.executemany_rows / self.executemany_calls if self.executemany_calls else None,
+            'max_batch': self.max_batch,
+        }
+
+
+def _capacity(engine):
+    # емкость пула: у движков из engine_factory.get_engine она известна из их параметров;
+    # у остальных QueuePool публично сообщает только pool_size (без max_overflow)
+    stats = pool_stats(engine)
+    if stats is not None:
+        return stats.capacity
+    if isinstance(engine.pool, QueuePool):
+        return engine.pool.size()
+    if isinstance(engine.pool, StaticPool):
+        return 1
+    return None
+
+
+def explain(dbapi_connection, dialect, statement, parameters, analyze=False):
+    # план выполнения на "сыром" курсоре, чтобы не вызывать события sqlalchemy повторно.
+    # EXPLAIN ANALYZE выполняет инструкцию, поэтому применяется только к простому SELECT:
+    # WITH ... может содержать DELETE/UPDATE, которые выполнились бы второй раз
+    if dialect.name == 'postgresql':
+        is_select = statement.lstrip()[:6].lower() == 'select'
+        options = 'ANALYZE, FORMAT JSON' if analyze and is_select else 'FORMAT JSON'
+        sql = f'EXPLAIN ({options}) {statement}'
+    elif dialect.name == 'sqlite':
+        sql = f'EXPLAIN QUERY PLAN {statement}'
+    else:
+        sql = f'EXPLAIN {statement}'
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(sql, parameters)
+        return [list(row) for row in cursor.fetchall()]
+    except Exception as exc:
+        return f'explain failed: {exc}'
+    finally:
+        cursor.close()
+
+
+class Instrumentation:
+    def __init__(self, engine, slow_threshold=0.5, explain_slow=True, analyze=False, keep_slow=100,
+                 pool_capacity=None):
+        # pool_capacity - pool_size + max_overflow, если движок создан не через get_engine
+        self.engine = engine
+        self.slow_threshold = slow_threshold
+        self.explain_slow = explain_slow
+        self.analyze = analyze
+        self.statements = {}
+        self.slow = deque(maxlen=keep_slow)
+        self.errors = 0
+        self.pool = PoolStats(pool_capacity or _capacity(engine))
+        # медленные инструкции, для которых еще нет плана
+        self._unexplained = deque(maxlen=keep_slow)
+        self._lock = threading.Lock()
+        self._dumper = None
+        self._stop = threading.Event()
+
+    def install(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+        event.listen(self.engine, 'handle_error', self._error)
+        event.listen(self.engine, 'checkout', self.pool.on_checkout)
+        event.listen(self.engine, 'checkin', self.pool.on_checkin)
+        event.listen(self.engine, 'engine_disposed', self._time_pool_waits)
+        self._time_pool_waits()
+        return self
+
+    def uninstall(self):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+        event.remove(self.engine, 'handle_error', self._error)
+        event.remove(self.engine, 'checkout', self.pool.on_checkout)
+        event.remove(self.engine, 'checkin', self.pool.on_checkin)
+        event.remove(self.engine, 'engine_disposed', self._time_pool_waits)
+        self.engine.pool.__dict__.pop('_do_get', None)
+        self.stop_dump()
+
+    def _time_pool_waits(self, engine=None):
+        # у пула нет события "соединение запрошено", поэтому ожидание замеряется
+        # вокруг _do_get этого пула: очередь QueuePool или открытие нового соединения.
+        # engine.dispose() заменяет пул (события пула переходят в новый сами, а замена
+        # _do_get - нет), поэтому метод вызывается и из события engine_disposed
+        pool = self.engine.pool
+        if '_do_get' in pool.__dict__:
+            return
+        do_get = pool._do_get
+        record_wait = self.pool.record_wait
+
+        def timed_do_get():
+            start = time.perf_counter()
+            try:
+                return do_get()
+            finally:
+                record_wait(time.perf_counter() - start)
+
+        pool._do_get = timed_do_get
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(_START, []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info[_START].pop()
+        with self._lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = StatementStats()
+            stats.latency.add(elapsed)
+            if cursor.rowcount > 0:
+                stats.rows += cursor.rowcount
+            if executemany:
+                stats.executemany_calls += 1
+                stats.executemany_rows += len(parameters)
+                stats.max_batch = max(stats.max_batch, len(parameters))
+        if elapsed >= self.slow_threshold:
+            entry = {
+                'statement': statement,
+                'parameters': None if executemany else parameters,
+                'duration': elapsed,
+                'plan': None,
+                'at': time.time(),
+            }
+            self.slow.append(entry)
+            if self.explain_slow and not executemany:
+                self._unexplained.append(entry)
+
+    def _explain_pending(self):
+        # планы медленных инструкций, накопленных с прошлого snapshot()
+        if not self._unexplained:
+            return
+        dbapi_connection = self.engine.raw_connection()
+        try:
+            while True:
+                try:
+                    entry = self._unexplained.popleft()
+                except IndexError:
+                    break
+                entry['plan'] = explain(dbapi_connection, self.engine.dialect, entry['statement'],
+                                        entry['parameters'], self.analyze)
+        finally:
+            dbapi_connection.close()
+
+    def _error(self, context):
+        starts = context.connection.info.get(_START) if context.connection is not None else None
+        if starts:
+            starts.pop()
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        if self.explain_slow:
+            self._explain_pending()
+        with self._lock:
+            statements = {sql: stats.snapshot() for sql, stats in self.statements.items()}
+        return {
+            'statements': statements,
+            'slow': list(self.slow),
+            'errors': self.errors,
+            'pool': self.pool.snapshot(),
+        }
+
+    def top(self, n=10, by='total'):
+        # самые "дорогие" формы инструкций: by = 'total', 'p99' или 'count'
+        def key(item):
+            latency = item[1].latency
+            if by == 'count':
+                return latency.count
+            if by == 'p99':
+                return latency.percentile(99) or 0
+            return latency.total
+        with self._lock:
+            return sorted(self.statements.items(), key=key, reverse=True)[:n]
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.slow.clear()
+            self._unexplained.clear()
+            self.errors = 0
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2, default=str)
+
+    def start_dump(self, path, interval=60):
+        # фоновый поток пишет snapshot() в path каждые interval секунд
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.dump(path)
+
+        self._dumper = threading.Thread(target=run, name='sql-stats-dump', daemon=True)
+        self._dumper.start()
+
+    def stop_dump(self):
+        if self._dumper is not None:
+            self._stop.set()
+            self._dumper.join()
+            self._dumper = None
+
+
+def instrument(engine, **kwargs):
+    return Instrumentation(engine, **kwargs).install()
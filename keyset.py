@@ -0,0 +1,246 @@
+# Постраничный вывод по ключу (keyset / seek) вместо OFFSET/LIMIT.
+# select(posts).order_by(posts.c.created_on).offset(20 * page).limit(20) читает
+# и отбрасывает все строки предыдущих страниц, поэтому чем дальше страница, тем
+# медленнее запрос. Здесь следующая страница выбирается условием "строго после
+# последней строки предыдущей страницы":
+#   (created_on, id) > (:created_on, :id)  ORDER BY created_on, id  LIMIT 20
+# и при подходящем индексе начинается сразу с нужного места индекса.
+# Порядок задается колонками (или col.desc()); если среди них нет первичного ключа
+# таблицы, он добавляется в конец, чтобы порядок был однозначным. Страница возвращает
+# непрозрачные курсоры на следующую и предыдущую страницы (base64 от JSON значений ключа).
+# Строки с NULL в колонках порядка в выдачу по курсору не попадают: сравнение с NULL ложно.
+#
+#   page = paginate(conn, select(customers), [customers.c.id], per_page=50)
+#   page = paginate(conn, select(customers), [customers.c.id], per_page=50, cursor=page.next_cursor)
+#   page = paginate(session, select(Post), [Post.created_on.desc()], cursor=request_cursor)
+import base64
+import hashlib
+import json
+import warnings
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import and_, or_, tuple_, literal, inspect
+from sqlalchemy.orm import Mapper, Session
+from sqlalchemy.sql import operators
+
+from stacklevel import caller_stacklevel
+
+DEFAULT_PER_PAGE = 20
+# диалекты, где (a, b) > (x, y) использует индекс по (a, b)
+ROW_VALUE_DIALECTS = ('postgresql', 'sqlite', 'mysql')
+
+_checked_indexes = {}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class MissingIndexWarning(UserWarning):
+    pass
+
+
+class Page:
+    def __init__(self, rows, next_cursor=None, previous_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return f'<Page {len(self.rows)} rows, next={self.next_cursor is not None}, ' \
+               f'previous={self.previous_cursor is not None}>'
+
+
+def _ordering(order_by):
+    # [колонка или col.desc(), ...] -> [(колонка, по убыванию)], с первичным ключом в конце
+    ordering = []
+    for element in order_by:
+        descending = getattr(element, 'modifier', None) is operators.desc_op
+        if getattr(element, 'modifier', None) in (operators.desc_op, operators.asc_op):
+            element = element.element
+        if hasattr(element, '__clause_element__'):
+            element = element.__clause_element__()
+        ordering.append((element, descending))
+    table = getattr(ordering[0][0], 'table', None)
+    if table is not None:
+        present = {getattr(column, 'key', None) for column, _ in ordering
+                   if getattr(column, 'table', None) is table}
+        ordering += [(column, ordering[-1][1]) for column in table.primary_key.columns
+                     if column.key not in present]
+    return ordering
+
+
+def _signature(ordering):
+    # курсор годится только для того порядка, для которого он выдан
+    text = ','.join(f'{getattr(column, "table", None) is not None and column.table.name}.'
+                    f'{column.key}:{int(descending)}' for column, descending in ordering)
+    return hashlib.sha1(text.encode()).hexdigest()[:8]
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, date):
+        return ['d', value.isoformat()]
+    if isinstance(value, time):
+        return ['t', value.isoformat()]
+    if isinstance(value, Decimal):
+        return ['n', str(value)]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        kind, text = value
+        return {'dt': datetime.fromisoformat, 'd': date.fromisoformat,
+                't': time.fromisoformat, 'n': Decimal}[kind](text)
+    return value
+
+
+def encode_cursor(direction, values, signature):
+    payload = {'d': direction, 'k': signature, 'v': [_encode_value(value) for value in values]}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, signature):
+    # -> (направление, значения ключа)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        direction, values = payload['d'], [_decode_value(value) for value in payload['v']]
+    except (ValueError, KeyError, TypeError, InvalidOperation) as exc:
+        raise InvalidCursor(f'malformed cursor: {cursor!r}') from exc
+    if payload.get('k') != signature or direction not in ('next', 'prev'):
+        raise InvalidCursor('cursor was issued for a different ordering')
+    return direction, values
+
+
+def cursor_after(order_by, values):
+    # курсор на страницу, начинающуюся сразу после заданных значений ключа,
+    # например чтобы перейти к дате: cursor_after([posts.c.created_on], [day, 0])
+    ordering = _ordering(order_by)
+    return encode_cursor('next', values, _signature(ordering))
+
+
+def seek(ordering, values, dialect_name, backwards=False):
+    # условие "строго после values" (или "строго до", если backwards) в порядке ordering
+    after = lambda column, value, descending: \
+        column < value if descending != backwards else column > value
+    values = [literal(value, column.type) for (column, _), value in zip(ordering, values)]
+    if len(ordering) == 1:
+        return after(ordering[0][0], values[0], ordering[0][1])
+    if len({descending for _, descending in ordering}) == 1 and dialect_name in ROW_VALUE_DIALECTS:
+        return after(tuple_(*[column for column, _ in ordering]), tuple_(*values), ordering[0][1])
+    # разные направления или нет сравнения кортежей: a > x OR (a = x AND b > y) OR ...
+    clauses = []
+    for i, (column, descending) in enumerate(ordering):
+        equal = [ordering[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, after(column, values[i], descending)))
+    return or_(*clauses)
+
+
+def _connection(executor):
+    return executor.connection() if isinstance(executor, Session) else executor
+
+
+def _entity(stmt):
+    descriptions = stmt.column_descriptions
+    if len(descriptions) == 1 and isinstance(inspect(descriptions[0]['expr'], False), Mapper):
+        return inspect(descriptions[0]['expr'])
+    return None
+
+
+def _values(row, ordering, mapper):
+    if mapper is not None:
+        return [getattr(row, mapper.get_property_by_column(column).key) for column, _ in ordering]
+    mapping = row._mapping
+    values = []
+    for column, _ in ordering:
+        try:
+            values.append(mapping[column])
+        except KeyError:
+            raise ValueError(f'ordering column {column.name} is not in the select list') from None
+    return values
+
+
+def index_for(connection, ordering):
+    # имя индекса (или первичного ключа), столбцы которого начинаются с колонок порядка;
+    # None - такого индекса нет. Порядок по колонкам нескольких таблиц не проверяется
+    tables = {getattr(column, 'table', None) for column, _ in ordering}
+    if len(tables) != 1 or None in tables:
+        return ''
+    table = tables.pop()
+    names = [column.name for column, _ in ordering]
+    inspector = inspect(connection)
+    primary_key = inspector.get_pk_constraint(table.name, schema=table.schema)
+    candidates = [(primary_key.get('name') or 'primary key', primary_key['constrained_columns'])]
+    candidates += [(index['name'], index['column_names'])
+                   for index in inspector.get_indexes(table.name, schema=table.schema)]
+    for name, columns in candidates:
+        # индекс по (a, b, id) годится и для порядка (a, b): id - уже первичный ключ
+        if columns[:len(names)] == names or names[:len(columns)] == columns and \
+                set(names[len(columns):]) <= set(primary_key['constrained_columns']):
+            return name
+    return None
+
+
+def _check_index(connection, ordering):
+    key = (str(connection.engine.url), _signature(ordering))
+    if key not in _checked_indexes:
+        _checked_indexes[key] = index_for(connection, ordering)
+        if _checked_indexes[key] is None:
+            warnings.warn('no index on ({}) - keyset pagination will sort the whole table'.format(
+                ', '.join(column.name for column, _ in ordering)), MissingIndexWarning, stacklevel=caller_stacklevel(__file__))
+    return _checked_indexes[key]
+
+
+def paginate(executor, stmt, order_by, per_page=DEFAULT_PER_PAGE, cursor=None, check_index=True):
+    # executor - Connection или Session; stmt - select() таблицы или модели (select(Post)).
+    # Прежний order_by у stmt заменяется; возвращает Page
+    ordering = _ordering(order_by)
+    signature = _signature(ordering)
+    connection = _connection(executor)
+    if check_index:
+        _check_index(connection, ordering)
+    direction, values = decode_cursor(cursor, signature) if cursor else ('next', None)
+    backwards = direction == 'prev'
+
+    clauses = [column.desc() if descending != backwards else column.asc() for column, descending in ordering]
+    query = stmt.order_by(None).order_by(*clauses).limit(per_page + 1)
+    if values is not None:
+        query = query.where(seek(ordering, values, connection.dialect.name, backwards))
+    mapper = _entity(stmt)
+    result = executor.execute(query)
+    rows = result.scalars().all() if mapper is not None else result.all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        # за пределами выдачи: вернуться можно только назад (или вперед) от курсора
+        back = encode_cursor('next' if backwards else 'prev', values, signature) if values else None
+        return Page([], back if backwards else None, None if backwards else back)
+    first = _values(rows[0], ordering, mapper)
+    last = _values(rows[-1], ordering, mapper)
+    has_next = more if not backwards else True
+    has_previous = more if backwards else values is not None
+    return Page(rows,
+                encode_cursor('next', last, signature) if has_next else None,
+                encode_cursor('prev', first, signature) if has_previous else None)
+
+
+def pages(executor, stmt, order_by, per_page=DEFAULT_PER_PAGE):
+    # все страницы подряд, например для выгрузки
+    page = paginate(executor, stmt, order_by, per_page)
+    while True:
+        yield page
+        if page.next_cursor is None:
+            return
+        page = paginate(executor, stmt, order_by, per_page, page.next_cursor, check_index=False)
@@ -0,0 +1,224 @@
+# Ленивый реестр таблиц и моделей для быстрого старта процессов.
+# Модуль схемы с сотнями Table и декларативных классов выполняет все объявления
+# при импорте, даже если процессу нужна пара таблиц. Здесь объявления
+# регистрируются как функции-фабрики и выполняются при первом обращении:
+#
+#   registry = LazyRegistry(cache_path='sales_schema.pickle')
+#
+#   @registry.table
+#   def customers(metadata):
+#       return Table('customers', metadata, Column('id', Integer(), primary_key=True), ...)
+#
+#   @registry.model(requires=('Order',))
+#   def Customer(Base, tables):
+#       class Customer(Base):
+#           __table__ = tables['customers']
+#           orders = relationship('Order')
+#       return Customer
+#
+#   registry.tables['customers'], registry.models['Customer']
+#
+# Таблица собирается вместе с таблицами, на которые ссылаются ее внешние ключи,
+# модель - вместе с моделями из requires (на них ссылаются строки в relationship).
+# Мапперы настраиваются самой sqlalchemy при первом запросе или явно через configure().
+# Если задан cache_path, полная MetaData (registry.metadata - для create_all, reconcile
+# и т.п.) сохраняется в pickle-файл и при следующем старте загружается из него
+# целиком; файл пересобирается, когда меняются исходники из sources (по умолчанию -
+# файлы, в которых объявлены зарегистрированные фабрики), набор фабрик или версия sqlalchemy.
+import hashlib
+import inspect
+import os
+import io
+import pickle
+from collections import OrderedDict
+
+import sqlalchemy
+from sqlalchemy import MetaData, util
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import configure_mappers
+
+
+def _wrap_default(fn):
+    # так же, как ColumnDefault оборачивает default=datetime.now и т.п.
+    return util.wrap_callable(lambda ctx: fn(), fn)
+
+
+class _MetadataPickler(pickle.Pickler):
+    # ColumnDefault хранит для функций без аргументов обертку-lambda, которую
+    # pickle не сериализует; сохраняется исходная функция, обертка создается заново
+    def reducer_override(self, obj):
+        wrapped = getattr(obj, '__wrapped__', None)
+        if wrapped is not None and getattr(obj, '__code__', None) is not None \
+                and obj.__code__.co_name == '<lambda>':
+            return _wrap_default, (wrapped,)
+        return NotImplemented
+
+
+class _LazyMapping:
+    # словарь только для чтения, значения которого создаются при первом обращении
+    def __init__(self, names, build):
+        self._names = names
+        self._build = build
+
+    def __getitem__(self, name):
+        return self._build(name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._build(name)
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def keys(self):
+        return list(self._names)
+
+
+class LazyRegistry:
+    def __init__(self, cache_path=None, sources=None):
+        self.cache_path = cache_path
+        self.sources = None if sources is None else list(sources)
+        self._table_factories = OrderedDict()
+        self._model_factories = OrderedDict()
+        self._metadata = None
+        self._complete = False
+        self._base = None
+        self._models = {}
+        self.tables = _LazyMapping(self._table_factories, self._get_table)
+        self.models = _LazyMapping(self._model_factories, self._get_model)
+
+    # регистрация
+
+    def table(self, factory=None, name=None):
+        # @registry.table или @registry.table(name='...'); по умолчанию имя фабрики
+        def register(func):
+            self._table_factories[name or func.__name__] = func
+            return func
+        return register(factory) if factory is not None else register
+
+    def model(self, factory=None, name=None, requires=()):
+        def register(func):
+            self._model_factories[name or func.__name__] = (func, tuple(requires))
+            return func
+        return register(factory) if factory is not None else register
+
+    # таблицы
+
+    @property
+    def metadata(self):
+        # MetaData со всеми зарегистрированными таблицами: из кэша, если он актуален
+        # и ни одна таблица еще не собрана, иначе сборкой недостающих таблиц
+        if self._metadata is None:
+            self._metadata = self._load_cache()
+            if self._metadata is not None:
+                self._complete = True
+        if not self._complete:
+            self._ensure_metadata()
+            for name in self._table_factories:
+                self._get_table(name)
+            self._complete = True
+            self._save_cache()
+        return self._metadata
+
+    def _ensure_metadata(self):
+        if self._metadata is None:
+            self._metadata = MetaData()
+
+    def _get_table(self, name):
+        self._ensure_metadata()
+        table = self._metadata.tables.get(name)
+        if table is not None:
+            return table
+        table = self._table_factories[name](self._metadata)
+        # таблицы, на которые ссылаются внешние ключи, нужны для create_all и соединений
+        for fk in table.foreign_keys:
+            referred = fk.target_fullname.rsplit('.', 1)[0]
+            if referred in self._table_factories and referred not in self._metadata.tables:
+                self._get_table(referred)
+        return table
+
+    # модели
+
+    @property
+    def Base(self):
+        if self._base is None:
+            self._ensure_metadata()
+            self._base = declarative_base(metadata=self._metadata)
+        return self._base
+
+    def _get_model(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        factory, requires = self._model_factories[name]
+        model = self._models[name] = factory(self.Base, self.tables)
+        for required in requires:
+            self._get_model(required)
+        return model
+
+    def configure(self):
+        # объявляет все модели и настраивает мапперы заранее (например, до fork воркеров)
+        for name in self._model_factories:
+            self._get_model(name)
+        configure_mappers()
+        return self._models
+
+    # кэш metadata
+
+    def fingerprint(self):
+        digest = hashlib.sha256(sqlalchemy.__version__.encode())
+        for name in self._table_factories:
+            digest.update(name.encode())
+        for path in self._source_paths():
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def _source_paths(self):
+        if self.sources is not None:
+            return self.sources
+        # изменение колонок в фабрике меняет файл, где она объявлена
+        factories = list(self._table_factories.values())
+        factories += [factory for factory, _ in self._model_factories.values()]
+        paths = []
+        for factory in factories:
+            path = inspect.getsourcefile(factory)
+            if path is not None and path not in paths:
+                paths.append(path)
+        return paths
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'rb') as f:
+                fingerprint, metadata = pickle.load(f)
+        except Exception:
+            # поврежденный или несовместимый файл просто пересобирается
+            return None
+        return metadata if fingerprint == self.fingerprint() else None
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        buffer = io.BytesIO()
+        try:
+            _MetadataPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump((self.fingerprint(), self._metadata))
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # например, default=lambda: ... из модуля схемы не сериализуется - работаем без кэша
+            return
+        # запись через временный файл, чтобы параллельно стартующие воркеры не прочитали половину
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, self.cache_path)
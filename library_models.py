@@ -0,0 +1,48 @@
+# модели Author/Book/Person/DriverLicense из orm_schema_crud.py
+# (в их итоговом виде), вынесенные в модуль, который можно импортировать
+from sqlalchemy import Table, Column, Integer, String, Date, SmallInteger, ForeignKey
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+
+Base = declarative_base()
+
+# many-to-many: один автор пишет несколько книг, у книги может быть несколько авторов
+author_book = Table('author_book', Base.metadata,
+    Column('author_id', Integer(), ForeignKey("authors.id")),
+    Column('book_id', Integer(), ForeignKey("books.id"))
+)
+
+
+class Author(Base):
+    __tablename__ = 'authors'
+    id = Column(Integer, primary_key=True)
+    first_name = Column(String(100), nullable=False)
+    last_name = Column(String(100), nullable=False)
+
+
+class Book(Base):
+    __tablename__ = 'books'
+    id = Column(Integer, primary_key=True)
+    title = Column(String(100), nullable=False)
+    copyright = Column(SmallInteger, nullable=False)
+    author_id = Column(Integer, ForeignKey('authors.id'))
+    author = relationship("Author", secondary=author_book, backref="books")
+
+
+# one-to-one
+class Person(Base):
+    __tablename__ = 'persons'
+    id = Column(Integer(), primary_key=True)
+    name = Column(String(255), nullable=False)
+    designation = Column(String(255), nullable=False)
+    doj = Column(Date(), nullable=False)
+    dl = relationship('DriverLicense', backref='person', uselist=False)
+
+
+class DriverLicense(Base):
+    __tablename__ = 'driverlicense'
+    id = Column(Integer(), primary_key=True)
+    license_number = Column(String(255), nullable=False)
+    renewed_on = Column(Date(), nullable=False)
+    expiry_date = Column(Date(), nullable=False)
+    person_id = Column(Integer(), ForeignKey('persons.id'))
@@ -0,0 +1,100 @@
+# Стратегии загрузки связей и поиск проблемы N+1.
+# По умолчанию relationship() загружается лениво: перебор авторов с обращением
+# к author.books выполняет по отдельному запросу на каждого автора (N+1 запрос).
+# Здесь стратегию можно выбрать на уровне конкретного запроса:
+#   stmt = select(Author).options(*load_options(Author, 'selectin'))
+# а NPlusOneDetector считает ленивые загрузки после каждого запроса-родителя
+# и предупреждает (или бросает исключение), если их больше порога.
+import warnings
+from contextlib import contextmanager
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import selectinload, joinedload, subqueryload, raiseload, lazyload
+
+from stacklevel import SQLALCHEMY, caller_stacklevel
+
+STRATEGIES = {
+    'selectin': selectinload,
+    'joined': joinedload,
+    'subquery': subqueryload,
+    'raise': raiseload,
+    'lazy': lazyload,
+}
+
+# стратегии по умолчанию для связей моделей из library_models.py:
+# коллекции - отдельным SELECT ... IN, один-к-одному - через JOIN
+PRESETS = {
+    ('Author', 'books'): 'selectin',
+    ('Book', 'author'): 'selectin',
+    ('Person', 'dl'): 'joined',
+    ('DriverLicense', 'person'): 'joined',
+}
+
+
+def load_options(model, strategy=None, *relationships):
+    # опции загрузки для перечисленных связей модели (по умолчанию - всех).
+    # Если strategy не задана, берется пресет из PRESETS, иначе ленивая загрузка
+    mapper = inspect(model)
+    # mapper.relationships заодно настраивает мапперы, иначе связей из backref еще нет
+    available = mapper.relationships
+    names = relationships or list(available.keys())
+    options = []
+    for name in names:
+        chosen = strategy or PRESETS.get((mapper.class_.__name__, name), 'lazy')
+        options.append(STRATEGIES[chosen](available[name].class_attribute))
+    return options
+
+
+class NPlusOneError(RuntimeError):
+    pass
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class NPlusOneDetector:
+    # считает ленивые загрузки связей, выполненные после каждого запроса верхнего уровня
+    def __init__(self, threshold=10, action='warn'):
+        self.threshold = threshold
+        self.action = action
+        self.parent = None
+        self.lazy_loads = 0
+        self.report = {}
+
+    def install(self, target):
+        # target - сессия, класс Session или sessionmaker
+        event.listen(target, 'do_orm_execute', self.on_execute)
+
+    def uninstall(self, target):
+        event.remove(target, 'do_orm_execute', self.on_execute)
+
+    def on_execute(self, state):
+        if state.lazy_loaded_from is not None:
+            self.lazy_loads += 1
+            if self.parent is not None:
+                self.report[self.parent] = self.lazy_loads
+            if self.lazy_loads == self.threshold + 1:
+                self._alert(state)
+        elif state.is_select and not state.is_relationship_load and not state.is_column_load:
+            self.parent = str(state.statement)
+            self.lazy_loads = 0
+
+    def _alert(self, state):
+        parent_class = state.lazy_loaded_from.mapper.class_.__name__
+        message = (f'more than {self.threshold} lazy loads from {parent_class} '
+                   f'after query: {self.parent}')
+        if self.action == 'raise':
+            raise NPlusOneError(message)
+        # предупреждение показывается там, где код обратился к связи
+        warnings.warn(message, NPlusOneWarning, stacklevel=caller_stacklevel(SQLALCHEMY, __file__))
+
+
+@contextmanager
+def detect_n_plus_one(session, threshold=10, action='warn'):
+    detector = NPlusOneDetector(threshold, action)
+    detector.install(session)
+    try:
+        yield detector
+    finally:
+        detector.uninstall(session)
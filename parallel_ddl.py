@@ -0,0 +1,231 @@
+# Параллельное создание схемы по графу внешних ключей.
+# metadata.create_all(engine) создает таблицы по одной в порядке sorted_tables
+# на одном соединении. Здесь таблицы раскладываются по уровням зависимостей
+# (уровень таблицы = 1 + максимальный уровень таблиц, на которые она ссылается),
+# и таблицы одного уровня создаются параллельно на нескольких соединениях пула.
+#
+# defer=True откладывает индексы и внешние ключи, например до конца массовой загрузки:
+# таблицы создаются без них (все сразу, уровни не нужны), а create_all возвращает
+# DeferredDDL, который потом досоздает их параллельно:
+#   deferred = create_all(engine, metadata, defer=True)
+#   bulk_load(engine, {...})
+#   deferred.run()
+# На PostgreSQL внешние ключи добавляются как NOT VALID одной транзакцией (это только
+# запись в каталоге), а проверка существующих строк (VALIDATE CONSTRAINT) идет
+# параллельно по таблицам: она не блокирует запись и не конфликтует между таблицами.
+# SQLite пишет в файл последовательно и не умеет ALTER TABLE ... ADD CONSTRAINT:
+# там используется одно соединение, а внешние ключи всегда создаются вместе с таблицей.
+# Параллельные задачи фиксируются каждая отдельно, поэтому при ошибке create_all удаляет
+# таблицы, которые успел создать; DeferredDDL.run() так не делает - после его ошибки
+# часть индексов и внешних ключей может уже существовать.
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from contextlib import contextmanager
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateTable, AddConstraint
+
+from schema_reconcile import Operation, execute_operation, raw_ddl
+
+DEFAULT_WORKERS = 4
+
+
+def _foreign_keys(table, tables):
+    # внешние ключи на другие таблицы из того же набора
+    return [fk for fk in table.foreign_key_constraints
+            if fk.referred_table is not table and fk.referred_table in tables]
+
+
+def dependency_levels(tables):
+    # -> (уровни таблиц, внешние ключи, которые придется добавить после создания:
+    #     use_alter и ключи, замыкающие циклы)
+    tables = list(tables)
+    pending = set(tables)
+    after = [fk for table in tables for fk in _foreign_keys(table, pending) if fk.use_alter]
+    levels = []
+    while pending:
+        level = [table for table in tables if table in pending and not any(
+            fk.referred_table in pending for fk in _foreign_keys(table, pending) if fk not in after)]
+        if not level:
+            # цикл: ключи между оставшимися таблицами откладываются, и граф распадается
+            after += [fk for table in tables if table in pending
+                      for fk in _foreign_keys(table, pending) if fk not in after]
+            continue
+        levels.append(level)
+        pending.difference_update(level)
+    return levels, after
+
+
+def _parallel(engine, tasks, workers, autocommit=False):
+    # tasks - функции от соединения; при параллельном выполнении каждая - в своей транзакции
+    def run(task):
+        if autocommit:
+            with engine.connect() as conn:
+                task(conn.execution_options(isolation_level='AUTOCOMMIT'))
+        else:
+            with engine.begin() as conn:
+                task(conn)
+
+    if workers <= 1 or len(tasks) <= 1:
+        # последовательно - все в одной транзакции, как metadata.create_all
+        run(lambda conn: [task(conn) for task in tasks])
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, task) for task in tasks]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            future.result()
+
+
+def _split(groups, workers):
+    # группы элементов -> не больше workers задач, каждая в одной транзакции
+    tasks = [[] for _ in range(min(workers, len(groups)))]
+    for i, group in enumerate(groups):
+        tasks[i % len(tasks)].extend(group)
+    return tasks
+
+
+@contextmanager
+def _named(foreign_keys):
+    # VALIDATE CONSTRAINT нужно имя ключа: безымянные на время получают то, которое
+    # им дал бы PostgreSQL, - <таблица>_<колонки>_fkey; MetaData вызывающего не меняется
+    unnamed = [fk for fk in foreign_keys if fk.name is None]
+    for fk in unnamed:
+        fk.name = '{}_{}_fkey'.format(fk.table.name, '_'.join(fk.column_keys))
+    try:
+        yield
+    finally:
+        for fk in unnamed:
+            fk.name = None
+
+
+def _create_table(table, foreign_keys):
+    # CREATE TABLE с внешними ключами берет SHARE ROW EXCLUSIVE на каждую родительскую
+    # таблицу по очереди; две параллельные транзакции с родителями (a, b) и (b, a)
+    # взаимно блокируются. Поэтому на PostgreSQL родители блокируются заранее,
+    # одной командой в порядке имен
+    def task(conn):
+        parents = sorted({fk.referred_table.name: fk.referred_table for fk in foreign_keys
+                          if fk.referred_table is not table}.items())
+        if parents and conn.dialect.name == 'postgresql':
+            preparer = conn.dialect.identifier_preparer
+            conn.execute(raw_ddl('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(
+                ', '.join(preparer.format_table(parent) for _, parent in parents))))
+        conn.execute(CreateTable(table, include_foreign_key_constraints=foreign_keys))
+    return task
+
+
+def _create_indexes(indexes, concurrent):
+    ops = [Operation('create_index', index.table, index, concurrent) for index in indexes]
+    return lambda conn: [execute_operation(conn, op) for op in ops]
+
+
+class DeferredDDL:
+    # отложенные индексы и внешние ключи; run() создает их и очищает список
+    def __init__(self, engine, indexes=(), foreign_keys=(), workers=DEFAULT_WORKERS):
+        self.engine = engine
+        self.indexes = list(indexes)
+        self.foreign_keys = list(foreign_keys)
+        self.workers = workers
+
+    def __len__(self):
+        return len(self.indexes) + len(self.foreign_keys)
+
+    def __repr__(self):
+        return f'<DeferredDDL {len(self.indexes)} indexes, {len(self.foreign_keys)} foreign keys>'
+
+    def run(self, workers=None, concurrently=False):
+        # concurrently - CREATE INDEX CONCURRENTLY на PostgreSQL (если таблицы уже в работе)
+        workers = _workers(self.engine, workers or self.workers)
+        dialect = self.engine.dialect
+        concurrent = concurrently and dialect.name == 'postgresql'
+        if self.foreign_keys:
+            self._foreign_keys(dialect, workers)
+        if concurrent:
+            # CONCURRENTLY выполняется вне транзакции - по индексу на задачу
+            tasks = [_create_indexes([index], True) for index in self.indexes]
+        else:
+            # индексы одной таблицы строятся в одной задаче, по очереди
+            by_table = {}
+            for index in self.indexes:
+                by_table.setdefault(index.table, []).append(index)
+            tasks = [_create_indexes(indexes, False) for indexes in _split(list(by_table.values()), workers)]
+        _parallel(self.engine, tasks, workers, autocommit=concurrent)
+        self.indexes = []
+
+    def _foreign_keys(self, dialect, workers):
+        if dialect.name != 'postgresql':
+            # ALTER TABLE ... ADD CONSTRAINT блокирует обе таблицы - по очереди
+            _parallel(self.engine, [lambda conn: [conn.execute(AddConstraint(fk))
+                                                  for fk in self.foreign_keys]], 1)
+        else:
+            preparer = dialect.identifier_preparer
+
+            def add_not_valid(conn):
+                for fk in self.foreign_keys:
+                    conn.execute(raw_ddl(str(AddConstraint(fk).compile(dialect=dialect)) + ' NOT VALID'))
+
+            def validate(fks):
+                return lambda conn: [conn.execute(raw_ddl('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(
+                    preparer.format_table(fk.table), preparer.quote(fk.name)))) for fk in fks]
+
+            with _named(self.foreign_keys):
+                _parallel(self.engine, [add_not_valid], 1)
+                by_table = {}
+                for fk in self.foreign_keys:
+                    by_table.setdefault(fk.table, []).append(fk)
+                _parallel(self.engine, [validate(fks) for fks in _split(list(by_table.values()), workers)],
+                          workers)
+        self.foreign_keys = []
+
+
+def _workers(engine, workers):
+    return 1 if engine.dialect.name == 'sqlite' else workers
+
+
+def create_all(engine, metadata, tables=None, workers=DEFAULT_WORKERS, defer=False, checkfirst=True):
+    # аналог metadata.create_all(engine); возвращает DeferredDDL (пустой, если defer=False)
+    workers = _workers(engine, workers)
+    # порядок задают уровни зависимостей, sorted_tables не нужен
+    tables = list(tables if tables is not None else metadata.tables.values())
+    if checkfirst:
+        existing = set(inspect(engine).get_table_names())
+        tables = [table for table in tables if table.name not in existing]
+    levels, after = dependency_levels(tables)
+    alter = engine.dialect.name != 'sqlite'
+    deferred = DeferredDDL(engine, [index for table in tables for index in table.indexes], workers=workers)
+    if not alter:
+        after = []
+    elif defer:
+        after = [fk for table in tables for fk in table.foreign_key_constraints]
+        # без внешних ключей таблицы не зависят друг от друга
+        levels = [tables]
+    deferred.foreign_keys = after
+
+    skipped = set(after)
+    created = []
+    lock = threading.Lock()
+
+    def create(table):
+        task = _create_table(table, [fk for fk in table.foreign_key_constraints if fk not in skipped])
+
+        def run(conn):
+            task(conn)
+            with lock:
+                created.append(table)
+        return run
+
+    try:
+        for level in levels:
+            _parallel(engine, [create(table) for table in level], workers)
+        if not defer:
+            # индексы - тоже параллельно, после всех таблиц
+            deferred.run()
+    except Exception:
+        # не оставлять половину схемы: таблицы, созданные этим вызовом, удаляются
+        # (checkfirst - транзакция последней задачи могла и не зафиксироваться)
+        metadata.drop_all(engine, tables=created, checkfirst=True)
+        raise
+    return deferred
@@ -0,0 +1,272 @@
+# Декларативное секционирование таблиц PostgreSQL (PARTITION BY RANGE/HASH).
+# orders.date_placed, а также created_on/updated_on у customers и blog растут
+# бесконечно, и запросы по диапазонам дат деградируют. Секционированная таблица
+# состоит из родителя и дочерних секций; metadata.create_all создает родителя,
+# а событие after_create - секции.
+#
+# У секционированной таблицы первичный ключ обязан включать ключ секционирования,
+# поэтому partitioned_metadata() строит копию схемы: первичный ключ расширяется
+# колонкой секционирования, а внешние ключи, ссылающиеся на такую таблицу
+# (order_lines.order_id -> orders.id), убираются - внешний ключ должен ссылаться
+# на уникальный ключ, а orders.id без date_placed больше не уникален.
+# Такая копия схемы предназначена только для PostgreSQL: SQLite, например,
+# не поддерживает автоинкремент в составном первичном ключе. Для тестов на
+# SQLite используется исходная metadata, а load_partitioned и maintain_partitions
+# на других СУБД работают как обычная загрузка и ничего не делают соответственно.
+#
+#   md = partitioned_metadata(sales_schema.metadata, {
+#       'orders': RangePartitioning('date_placed', 'month', start=date(2022, 1, 1)),
+#       'order_lines': HashPartitioning('order_id', 8),
+#   })
+#   md.create_all(engine)
+#   maintain_partitions(conn, md.tables['orders'], ahead=3, retain=24)
+#
+# Значения колонки секционирования в load_partitioned - date/datetime или строки
+# ISO 8601 ('2022-03-01', '2022-03-01 10:00:00'), как в csv-файлах.
+from datetime import date, datetime
+
+from sqlalchemy import DDL, MetaData, PrimaryKeyConstraint, event, text
+
+from bulk_load import prepare_rows, copy_tuples, supports_copy, load_rows, DEFAULT_CHUNK_SIZE
+
+SCHEMES = 'partition_scheme'
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+class RangePartitioning:
+    # секции по интервалам 'day', 'month' или 'year' начиная со start;
+    # строки вне созданных секций попадают в секцию DEFAULT
+    FORMATS = {'day': '%Y%m%d', 'month': '%Y%m', 'year': '%Y'}
+
+    def __init__(self, column, interval='month', start=None, ahead=3):
+        if interval not in self.FORMATS:
+            raise ValueError(f'unsupported interval: {interval}')
+        self.column = column
+        self.interval = interval
+        self.start = start
+        self.ahead = ahead
+
+    @property
+    def clause(self):
+        return f'RANGE ({self.column})'
+
+    def floor(self, value):
+        if isinstance(value, str):
+            # строки из csv (read_csv) - в формате ISO 8601
+            value = datetime.fromisoformat(value)
+        if isinstance(value, datetime):
+            value = value.date()
+        if not isinstance(value, date):
+            raise TypeError(f'{self.column} must be a date, datetime or ISO 8601 string, not {value!r}')
+        if self.interval == 'day':
+            return value
+        if self.interval == 'month':
+            return _month_start(value)
+        return date(value.year, 1, 1)
+
+    def next(self, value):
+        if self.interval == 'day':
+            return date.fromordinal(value.toordinal() + 1)
+        return _add_months(value, 1 if self.interval == 'month' else 12)
+
+    def name(self, table_name, lower):
+        return f'{table_name}_p{lower.strftime(self.FORMATS[self.interval])}'
+
+    def bounds(self, start, end):
+        # границы секций (нижняя, верхняя), покрывающих [start, end]
+        lower = self.floor(start)
+        while lower <= end:
+            upper = self.next(lower)
+            yield lower, upper
+            lower = upper
+
+    def initial(self, today=None):
+        today = today or date.today()
+        end = today
+        for _ in range(self.ahead):
+            end = self.next(self.floor(end))
+        return self.bounds(self.start or today, end)
+
+
+class HashPartitioning:
+    def __init__(self, column, modulus):
+        self.column = column
+        self.modulus = modulus
+
+    @property
+    def clause(self):
+        return f'HASH ({self.column})'
+
+
+def _create_partitions_ddl(table, scheme):
+    quote = '"{}"'.format
+    statements = []
+    if isinstance(scheme, HashPartitioning):
+        for remainder in range(scheme.modulus):
+            statements.append(
+                f'CREATE TABLE IF NOT EXISTS {quote(f"{table.name}_h{remainder}")} PARTITION OF '
+                f'{quote(table.name)} FOR VALUES WITH (MODULUS {scheme.modulus}, REMAINDER {remainder})')
+        return statements
+    for lower, upper in scheme.initial():
+        statements.append(_range_partition_sql(table.name, scheme, lower, upper))
+    statements.append(f'CREATE TABLE IF NOT EXISTS {quote(table.name + "_default")} '
+                      f'PARTITION OF {quote(table.name)} DEFAULT')
+    return statements
+
+
+def _range_partition_sql(table_name, scheme, lower, upper):
+    return (f'CREATE TABLE IF NOT EXISTS "{scheme.name(table_name, lower)}" PARTITION OF "{table_name}" '
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')")
+
+
+def partition_table(table, scheme):
+    # делает уже скопированную таблицу секционированной: PARTITION BY в CREATE TABLE,
+    # ключ секционирования в первичном ключе и создание секций после CREATE TABLE
+    column = table.c[scheme.column]
+    if not table.primary_key.columns.contains_column(column):
+        columns = list(table.primary_key.columns) + [column]
+        for pk_column in columns:
+            pk_column.primary_key = True
+            pk_column.nullable = False
+        table.append_constraint(PrimaryKeyConstraint(*columns))
+    table.dialect_kwargs['postgresql_partition_by'] = scheme.clause
+    table.info[SCHEMES] = scheme
+    for statement in _create_partitions_ddl(table, scheme):
+        event.listen(table, 'after_create', DDL(statement.replace('%', '%%')).execute_if(dialect='postgresql'))
+    return table
+
+
+def partitioned_metadata(metadata, schemes):
+    # копия metadata, где таблицы из schemes ({имя: схема секционирования}) секционированы
+    target = MetaData()
+    for table in metadata.sorted_tables:
+        copy = table.to_metadata(target)
+        if table.name in schemes:
+            # автоинкремент id сохраняется и в составном первичном ключе
+            for column in copy.primary_key.columns:
+                if column.autoincrement == 'auto':
+                    column.autoincrement = True
+            partition_table(copy, schemes[table.name])
+    for table in target.sorted_tables:
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.referred_table.name in schemes:
+                table.constraints.discard(constraint)
+                for column in constraint.columns:
+                    column.foreign_keys.difference_update(constraint.elements)
+                table.foreign_keys.difference_update(constraint.elements)
+    return target
+
+
+def existing_partitions(connection, table):
+    # имена дочерних секций из системного каталога
+    rows = connection.execute(text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        'WHERE p.relname = :name'), {'name': table.name})
+    return {row[0] for row in rows}
+
+
+def maintain_partitions(connection, table, ahead=3, retain=None, drop=False, today=None):
+    # создает секции на ahead интервалов вперед и отсоединяет секции старше
+    # retain интервалов (drop=True - удаляет их). Возвращает (созданные, отсоединенные)
+    scheme = table.info.get(SCHEMES)
+    if scheme is None:
+        raise ValueError(f'{table.name} is not partitioned, see partition_table()')
+    if connection.dialect.name != 'postgresql' or not isinstance(scheme, RangePartitioning):
+        return [], []
+    today = today or date.today()
+    existing = existing_partitions(connection, table)
+    end = today
+    for _ in range(ahead):
+        end = scheme.next(scheme.floor(end))
+    created = []
+    for lower, upper in scheme.bounds(today, end):
+        name = scheme.name(table.name, lower)
+        if name not in existing:
+            _create_range_partition(connection, table, scheme, lower, upper, existing)
+            created.append(name)
+
+    detached = []
+    if retain is not None:
+        cutoff = scheme.floor(today)
+        for _ in range(retain):
+            cutoff = _previous(scheme, cutoff)
+        cutoff_name = scheme.name(table.name, cutoff)
+        prefix = f'{table.name}_p'
+        for name in sorted(existing):
+            # имена секций упорядочены так же, как их границы
+            if name.startswith(prefix) and name < cutoff_name:
+                connection.execute(text(f'ALTER TABLE "{table.name}" DETACH PARTITION "{name}"'))
+                if drop:
+                    connection.execute(text(f'DROP TABLE "{name}"'))
+                detached.append(name)
+    return created, detached
+
+
+def _create_range_partition(connection, table, scheme, lower, upper, existing):
+    # если в DEFAULT уже есть строки этого диапазона, PostgreSQL не даст создать секцию
+    # ("updated partition constraint for default partition would be violated"):
+    # тогда секция создается отдельной таблицей, строки переносятся в нее из DEFAULT,
+    # и она присоединяется к родителю
+    default = f'{table.name}_default'
+    bounds = {'lower': lower, 'upper': upper}
+    where = f'"{scheme.column}" >= :lower AND "{scheme.column}" < :upper'
+    if default not in existing or connection.execute(
+            text(f'SELECT 1 FROM "{default}" WHERE {where} LIMIT 1'), bounds).first() is None:
+        connection.execute(text(_range_partition_sql(table.name, scheme, lower, upper)))
+        return
+    name = scheme.name(table.name, lower)
+    connection.execute(text(f'CREATE TABLE "{name}" (LIKE "{table.name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    connection.execute(text(f'WITH moved AS (DELETE FROM "{default}" WHERE {where} RETURNING *) '
+                            f'INSERT INTO "{name}" SELECT * FROM moved'), bounds)
+    connection.execute(text(f'ALTER TABLE "{table.name}" ATTACH PARTITION "{name}" '
+                            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"))
+
+
+def _previous(scheme, lower):
+    if scheme.interval == 'day':
+        return date.fromordinal(lower.toordinal() - 1)
+    return _add_months(lower, -1 if scheme.interval == 'month' else -12)
+
+
+def load_partitioned(connection, table, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    # массовая загрузка с маршрутизацией по секциям: на PostgreSQL строки
+    # раскладываются по дочерним таблицам и грузятся через COPY напрямую в них,
+    # минуя маршрутизацию строк через родителя. Секции HASH вычисляет сам
+    # PostgreSQL, поэтому такие строки идут в родительскую таблицу
+    scheme = table.info.get(SCHEMES)
+    if not isinstance(scheme, RangePartitioning) or not supports_copy(connection):
+        return load_rows(connection, table, rows, chunk_size)
+    columns, tuples = prepare_rows(table, rows)
+    if not columns:
+        return 0
+    position = columns.index(scheme.column)
+    existing = existing_partitions(connection, table)
+    default = f'{table.name}_default'
+    # в памяти не больше chunk_size строк на секцию: полная порция сразу уходит в COPY
+    quote = connection.dialect.identifier_preparer.quote
+    groups = {}
+    count = 0
+    for row in tuples:
+        value = row[position]
+        name = scheme.name(table.name, scheme.floor(value)) if value is not None else default
+        if name not in existing:
+            name = default if default in existing else table.name
+        group = groups.setdefault(name, [])
+        group.append(row)
+        if len(group) >= chunk_size:
+            count += copy_tuples(connection, quote(name), columns, group, chunk_size)
+            group.clear()
+    for name, group in groups.items():
+        if group:
+            count += copy_tuples(connection, quote(name), columns, group, chunk_size)
+    return count
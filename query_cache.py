@@ -0,0 +1,241 @@
+# Кэш результатов запросов с инвалидацией по таблицам.
+# Кэширование включается явно: вместо conn.execute(stmt) вызывается
+# cache.execute(conn, stmt) (или cache.execute(session, stmt) для ORM).
+# Ключ - структура скомпилированной инструкции (cache key sqlalchemy, тот же,
+# что использует compiled_cache) плюс значения связанных параметров.
+# Для каждого результата запоминаются таблицы, из которых он прочитан.
+# Любой insert/update/delete, прошедший через тот же движок (например,
+# из first_db.py), сбрасывает результаты по затронутым таблицам: сразу после
+# выполнения, а затем еще раз при commit/rollback - чтобы в кэш не осталось
+# данных, прочитанных другим соединением до фиксации транзакции.
+# У каждой таблицы есть номер версии, который растет при каждой инвалидации:
+# результат, во время чтения которого таблицу успели изменить, в кэш не попадает.
+# Для text() и других инструкций, где таблицы не видны, их нужно передать явно
+# (tables=[items]) - без этого такие инструкции не кэшируются.
+import pickle
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.loading import merge_frozen_result
+from sqlalchemy.sql.util import find_tables
+
+# имя таблицы для инструкций, переданных текстом (exec_driver_sql, text())
+_DML_TABLE = re.compile(r'^\s*(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?)\s+"?([\w.]+)"?',
+                        re.IGNORECASE)
+_DIRTY = 'query_cache_dirty_tables'
+
+
+class CacheBackend:
+    # интерфейс хранилища; value - замороженный результат (FrozenResult)
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, tables):
+        raise NotImplementedError
+
+    def invalidate(self, tables):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def memory_usage(self):
+        return None
+
+
+def _sizeof(frozen):
+    # приблизительный размер замороженного результата в байтах
+    if isinstance(frozen, bytes):
+        return len(frozen)
+    size = sys.getsizeof(frozen.data)
+    for row in frozen.data:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class MemoryBackend(CacheBackend):
+    # LRU в памяти процесса с временем жизни записей ttl секунд
+    def __init__(self, maxsize=1000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._by_table = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value, tables, size = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, tables):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            size = _sizeof(value)
+            self._data[key] = (time.monotonic() + self.ttl, value, tables, size)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        expires, value, tables, size = self._data.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def invalidate(self, tables):
+        with self._lock:
+            for table in tables:
+                for key in list(self._by_table.pop(table, ())):
+                    if key in self._data:
+                        self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def memory_usage(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._data)
+
+
+def statement_tables(stmt):
+    return frozenset(table.fullname for table in find_tables(stmt) if hasattr(table, 'fullname'))
+
+
+def _dml_tables(statement, context):
+    compiled = context.compiled
+    if compiled is not None and (context.isinsert or context.isupdate or context.isdelete):
+        return {compiled.statement.table.fullname}
+    match = _DML_TABLE.match(statement)
+    return {match.group(1)} if match else set()
+
+
+def _table_names(tables):
+    return frozenset(getattr(table, 'fullname', table) for table in tables)
+
+
+def _params_key(params):
+    # словарь параметров или список словарей (executemany) -> хэшируемое значение
+    if not params:
+        return ()
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(tuple(sorted(item.items())) for item in params)
+
+
+class QueryCache:
+    def __init__(self, engine, backend=None):
+        self.engine = engine
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'commit', self._end_transaction)
+        event.listen(engine, 'rollback', self._end_transaction)
+
+    def close(self):
+        event.remove(self.engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.remove(self.engine, 'commit', self._end_transaction)
+        event.remove(self.engine, 'rollback', self._end_transaction)
+        self.backend.clear()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        tables = _dml_tables(statement, context)
+        if tables:
+            self._invalidate(tables)
+            conn.info.setdefault(_DIRTY, set()).update(tables)
+
+    def _end_transaction(self, conn):
+        tables = conn.info.pop(_DIRTY, None)
+        if tables:
+            self._invalidate(tables)
+
+    def _invalidate(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            self.backend.invalidate(tables)
+
+    def _snapshot(self, tables):
+        with self._lock:
+            return [self._versions.get(table, 0) for table in tables]
+
+    def _store(self, key, value, tables, versions):
+        # сохраняет результат, только если таблицы не менялись, пока он читался
+        with self._lock:
+            if [self._versions.get(table, 0) for table in tables] == versions:
+                self.backend.set(key, value, tables)
+
+    def _key(self, dialect, stmt, params):
+        cache_key = stmt._generate_cache_key()
+        if cache_key is None:
+            # инструкция, которую sqlalchemy не умеет кэшировать - ключ по тексту SQL
+            compiled = stmt.compile(dialect=dialect)
+            return (dialect.name, str(compiled), tuple(sorted(compiled.params.items(), key=str)),
+                    _params_key(params))
+        values = tuple(bind.effective_value for bind in cache_key.bindparams)
+        return (dialect.name, cache_key.key, values, _params_key(params))
+
+    def execute(self, executor, stmt, params=None, tables=None):
+        # executor - Connection или Session; возвращает Result.
+        # tables - таблицы, от которых зависит результат, если sqlalchemy их не видит (text())
+        is_session = isinstance(executor, Session)
+        connection = executor.connection() if is_session else executor
+        tables = _table_names(tables) if tables is not None else statement_tables(stmt)
+        dirty = connection.info.get(_DIRTY, ())
+
+        # без известных таблиц результат нечем инвалидировать; внутри транзакции
+        # с незафиксированными изменениями этих таблиц кэш тоже не используется
+        cacheable = bool(tables) and not tables.intersection(dirty)
+        key = self._key(connection.dialect, stmt, params) if cacheable else None
+        cached = self.backend.get(key) if cacheable else None
+        if cached is None:
+            self.misses += 1
+            versions = self._snapshot(tables)
+            result = executor.execute(stmt, params) if params else executor.execute(stmt)
+            frozen = result.freeze()
+            if cacheable:
+                # объекты ORM сохраняются снимком: сессия потом может их изменить или expire
+                self._store(key, pickle.dumps(frozen) if is_session else frozen, tables, versions)
+            return frozen()
+        self.hits += 1
+        if is_session:
+            # объекты из снимка привязываются к текущей сессии без повторного запроса
+            return merge_frozen_result(executor, stmt, pickle.loads(cached), load=False)()
+        return cached()
+
+    def invalidate(self, *tables):
+        self._invalidate(_table_names(tables))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'memory_bytes': self.backend.memory_usage(),
+        }
@@ -0,0 +1,196 @@
+# Разделение чтения и записи между основным сервером и репликами.
+# ReplicaSet хранит движки основного сервера (primary) и реплик, по кругу
+# выдает здоровые реплики для чтения и временно исключает реплику после обрыва
+# соединения (cooldown секунд), после чего снова пробует ее. Прочие ошибки (таймаут
+# инструкции, блокировки, сериализации) реплику не исключают.
+# RoutingSession направляет на primary flush, insert/update/delete, SELECT ... FOR UPDATE,
+# текстовые инструкции и все внутри session.begin() и session.primary(); остальные select()
+# (в транзакциях, начатых автоматически) идут на реплики,
+# причем одна транзакция сессии читает с одной и той же реплики.
+# Чтение своих записей: после flush и до конца транзакции вся сессия работает
+# с primary, а после фиксации записи (сессией или replicas.execute) еще read_your_writes
+# секунд все чтения этого ReplicaSet, из любой сессии, идут на primary, пока реплики догоняют.
+#
+#   replicas = ReplicaSet(get_engine('sales'), [get_engine('sales', url=replica_url)])
+#   Session = routing_sessionmaker(replicas)
+#   with Session() as session:
+#       session.execute(select(Item)).scalars().all()   # реплика
+#
+# Для Core: replicas.execute(stmt) или replicas.connect(readonly=True).
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session, sessionmaker
+
+
+def _is_read(clause):
+    # только select() без FOR UPDATE считается чтением; text() и DML - запись
+    return clause is not None and getattr(clause, 'is_select', False) \
+        and getattr(clause, '_for_update_arg', None) is None
+
+
+class ReplicaSet:
+    def __init__(self, primary, replicas, cooldown=30, read_your_writes=1.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.cooldown = cooldown
+        self.read_your_writes = read_your_writes
+        self.reads = {engine: 0 for engine in [primary] + self.replicas}
+        self.ejections = 0
+        self._ejected_until = {}
+        self._primary_until = 0.0
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+        self._lock = threading.Lock()
+        self._listeners = [(engine, self._on_error(engine)) for engine in self.replicas]
+        for engine, listener in self._listeners:
+            event.listen(engine, 'handle_error', listener)
+
+    def close(self):
+        # снимает обработчики ошибок (движки из engine_factory живут дольше ReplicaSet)
+        for engine, listener in self._listeners:
+            event.remove(engine, 'handle_error', listener)
+
+    def _on_error(self, engine):
+        def handle_error(context):
+            # только обрыв соединения или неудачное подключение (connection is None) исключают
+            # реплику: медленный запрос или конфликт блокировок - не повод сбрасывать ее пул
+            if context.is_disconnect or context.connection is None:
+                self.eject(engine)
+        return handle_error
+
+    def eject(self, engine):
+        with self._lock:
+            self._ejected_until[engine] = time.monotonic() + self.cooldown
+            self.ejections += 1
+        # соединения в пуле, скорее всего, тоже мертвы
+        engine.dispose()
+
+    def wrote(self, read_your_writes=None):
+        # запись зафиксирована на primary: ближайшие read_your_writes секунд реплики
+        # могут ее еще не видеть, поэтому чтения идут на primary
+        window = self.read_your_writes if read_your_writes is None else read_your_writes
+        with self._lock:
+            self._primary_until = max(self._primary_until, time.monotonic() + window)
+
+    def healthy(self):
+        now = time.monotonic()
+        return [engine for engine in self.replicas if self._ejected_until.get(engine, 0) <= now]
+
+    def ejected(self, engine):
+        return self._ejected_until.get(engine, 0) > time.monotonic()
+
+    def replica(self):
+        # следующая здоровая реплика по кругу; если здоровых нет
+        # или недавно была запись - primary
+        with self._lock:
+            now = time.monotonic()
+            for _ in range(len(self.replicas) if now >= self._primary_until else 0):
+                engine = next(self._cycle)
+                if self._ejected_until.get(engine, 0) <= now:
+                    self.reads[engine] += 1
+                    return engine
+            self.reads[self.primary] += 1
+            return self.primary
+
+    def connect(self, readonly=False):
+        return (self.replica() if readonly else self.primary).connect()
+
+    def execute(self, stmt, params=None):
+        # Core: select() - на реплику (если она исключена из-за ошибки соединения - на следующую),
+        # остальное - на primary в отдельной транзакции. Возвращает буферизованный Result
+        if not _is_read(stmt):
+            with self.primary.begin() as conn:
+                result = conn.execute(stmt, params) if params else conn.execute(stmt)
+                result = result.freeze()() if result.returns_rows else result
+            self.wrote()
+            return result
+        for _ in range(len(self.replicas) + 1):
+            engine = self.replica()
+            try:
+                with engine.connect() as conn:
+                    result = conn.execute(stmt, params) if params else conn.execute(stmt)
+                    return result.freeze()()
+            except exc.DBAPIError:
+                # ошибку самой инструкции повторять на другой реплике незачем
+                if engine is self.primary or not self.ejected(engine):
+                    raise
+        with self.primary.connect() as conn:
+            return (conn.execute(stmt, params) if params else conn.execute(stmt)).freeze()()
+
+    def stats(self):
+        return {
+            'reads': {str(engine.url): count for engine, count in self.reads.items()},
+            'healthy': len(self.healthy()),
+            'replicas': len(self.replicas),
+            'ejections': self.ejections,
+        }
+
+
+class RoutingSession(Session):
+    def __init__(self, replica_set, read_your_writes=None, **kwargs):
+        # read_your_writes=None - окно из replica_set
+        kwargs.pop('bind', None)
+        super().__init__(**kwargs)
+        self.replica_set = replica_set
+        self.read_your_writes = read_your_writes
+        self._force_primary = 0
+        self._wrote = False
+        # транзакция начата явно (session.begin()): вся она идет на primary
+        self._explicit = False
+        # реплика текущей транзакции: иначе каждый select брал бы соединение
+        # у следующей реплики и транзакция держала бы их все
+        self._replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or (clause is not None and not _is_read(clause)):
+            self._wrote = True
+            return self.replica_set.primary
+        # session.connection() без инструкции - тоже primary
+        if clause is None or self._force_primary or self._wrote or self._explicit:
+            return self.replica_set.primary
+        if self._replica is None:
+            self._replica = self.replica_set.replica()
+        return self._replica
+
+    def begin(self, *args, **kwargs):
+        # автоматически начатые транзакции (autobegin) сюда не заходят
+        transaction = super().begin(*args, **kwargs)
+        if not transaction.nested:
+            self._explicit = True
+        return transaction
+
+    @contextmanager
+    def primary(self):
+        # явная работа с primary, например транзакция "прочитать и изменить"
+        self._force_primary += 1
+        try:
+            yield self
+        finally:
+            self._force_primary -= 1
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session._wrote:
+        session.replica_set.wrote(session.read_your_writes)
+        session._wrote = False
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session._wrote = False
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session._replica = None
+        session._explicit = False
+
+
+def routing_sessionmaker(replica_set, read_your_writes=None, **kwargs):
+    return sessionmaker(class_=RoutingSession, replica_set=replica_set,
+                        read_your_writes=read_your_writes, **kwargs)
@@ -0,0 +1,24 @@
+# декларативные модели поверх таблиц sales_schema.py:
+# классы получают уже готовые Table через __table__, поэтому
+# Core-код и ORM работают с одними и теми же таблицами
+from sqlalchemy.ext.declarative import declarative_base
+
+from sales_schema import metadata, customers, orders, items, order_lines
+
+Base = declarative_base(metadata=metadata)
+
+
+class Customer(Base):
+    __table__ = customers
+
+
+class Order(Base):
+    __table__ = orders
+
+
+class Item(Base):
+    __table__ = items
+
+
+class OrderLine(Base):
+    __table__ = order_lines
@@ -0,0 +1,42 @@
+# схема базы данных sales из first_db.py, вынесенная в отдельный модуль,
+# чтобы ее таблицы можно было импортировать, не выполняя сам скрипт
+from sqlalchemy import MetaData, Table, Integer, String, Column, DateTime, \
+    ForeignKey, Numeric, CheckConstraint
+from datetime import datetime
+
+metadata = MetaData()
+
+customers = Table('customers', metadata,
+                  Column('id', Integer(), primary_key=True),
+                  Column('first_name', String(100), nullable=False),
+                  Column('last_name', String(100), nullable=False),
+                  Column('username', String(50), nullable=False),
+                  Column('email', String(200), nullable=False),
+                  Column('address', String(200), nullable=False),
+                  Column('town', String(50), nullable=False),
+                  Column('created_on', DateTime(), default=datetime.now),
+                  Column('updated_on', DateTime(), default=datetime.now, onupdate=datetime.now)
+                  )
+
+orders = Table('orders', metadata,
+               Column('id', Integer(), primary_key=True),
+               Column('customer_id', ForeignKey('customers.id'), nullable=False),
+               Column('date_placed', DateTime(), default=datetime.now),
+               Column('date_shipped', DateTime()),
+               )
+
+items = Table('items', metadata,
+              Column('id', Integer(), primary_key=True),
+              Column('name', String(), nullable=False),
+              Column('cost_price', Numeric(10, 2), nullable=False),
+              Column('selling_price', Numeric(10, 2), nullable=False),
+              Column('quantity', Integer(), nullable=False),
+              CheckConstraint('quantity > 0', name='quantity_check')
+              )
+
+order_lines = Table('order_lines', metadata,
+                    Column('id', Integer(), primary_key=True),
+                    Column('order_id', ForeignKey('orders.id')),
+                    Column('item_id', ForeignKey('items.id')),
+                    Column('quantity', Integer()),
+                    )
@@ -0,0 +1,195 @@
+# Сверка схемы вместо "drop database / create database / create_all" на каждом запуске.
+# reconcile() отражает (reflect) живую БД, сравнивает ее с metadata.sorted_tables
+# и выполняет минимальный упорядоченный набор операций:
+#   1. CREATE TABLE для отсутствующих таблиц (в порядке зависимостей) вместе с их индексами
+#   2. ALTER TABLE ... ADD COLUMN (NOT NULL колонку без server_default в существующую
+#      таблицу добавить нельзя - строкам нечем ее заполнить, diff() выбрасывает ValueError)
+#   3. ALTER TABLE ... ADD CONSTRAINT (уникальные, затем внешние ключи; не на SQLite)
+#   4. CREATE INDEX (на PostgreSQL - CONCURRENTLY, вне транзакции). Неудачный
+#      CREATE INDEX CONCURRENTLY оставляет недействительный (INVALID) индекс с тем же
+#      именем - такой индекс удаляется и строится заново
+# Колонки и ограничения, которых нет в metadata, не удаляются. Таблицы ищутся в своей
+# схеме (table.schema). dry_run=True только возвращает план и ничего не пишет.
+# Отпечаток metadata после успешной сверки сохраняется в таблице schema_state,
+# поэтому повторный запуск без изменений схемы стоит одного SELECT.
+import hashlib
+
+from sqlalchemy import DDL, MetaData, Table, Column, String, DateTime, inspect, select, text
+from sqlalchemy.schema import CreateTable, CreateIndex, DropIndex, CreateColumn, AddConstraint
+from sqlalchemy.sql.schema import UniqueConstraint, ForeignKeyConstraint
+from datetime import datetime
+
+state_metadata = MetaData()
+schema_state = Table('schema_state', state_metadata,
+                     Column('name', String(100), primary_key=True),
+                     Column('fingerprint', String(64), nullable=False),
+                     Column('updated_on', DateTime(), default=datetime.now, onupdate=datetime.now))
+
+
+class Operation:
+    def __init__(self, kind, table, element=None, concurrent=False):
+        self.kind = kind
+        self.table = table
+        self.element = element
+        self.concurrent = concurrent
+
+    def ddl(self, dialect):
+        if self.kind == 'create_table':
+            return str(CreateTable(self.table).compile(dialect=dialect)).strip()
+        if self.kind == 'add_column':
+            column = str(CreateColumn(self.element).compile(dialect=dialect))
+            return 'ALTER TABLE {} ADD COLUMN {}'.format(
+                dialect.identifier_preparer.format_table(self.table), column)
+        if self.kind == 'add_constraint':
+            return str(AddConstraint(self.element).compile(dialect=dialect))
+        ddl = DropIndex(self.element) if self.kind == 'drop_index' else CreateIndex(self.element)
+        if not self.concurrent:
+            return str(ddl.compile(dialect=dialect))
+        # postgresql_concurrently на время компиляции: индекс в metadata не меняется
+        options = self.element.dialect_options['postgresql']
+        previous = options['concurrently']
+        options['concurrently'] = True
+        try:
+            return str(ddl.compile(dialect=dialect))
+        finally:
+            options['concurrently'] = previous
+
+    def __repr__(self):
+        name = getattr(self.element, 'name', None)
+        return f'<{self.kind} {self.table.name}{"." + name if name else ""}>'
+
+
+def fingerprint(metadata, dialect):
+    digest = hashlib.sha256()
+    for table in metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=dialect)).encode())
+        for index in sorted(table.indexes, key=lambda i: i.name or ''):
+            digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode())
+    return digest.hexdigest()
+
+
+def _columns_key(columns):
+    return tuple(sorted(columns))
+
+
+def _invalid_indexes(connection):
+    # {(схема, таблица, индекс)} индексов, оставшихся от прерванного CREATE INDEX CONCURRENTLY;
+    # для схемы по умолчанию - еще и с None вместо имени схемы, как в table.schema
+    if connection.dialect.name != 'postgresql':
+        return set()
+    invalid = set()
+    for default, schema, table, index in connection.execute(text(
+            'SELECT n.nspname = current_schema(), n.nspname, t.relname, c.relname FROM pg_index i '
+            'JOIN pg_class c ON c.oid = i.indexrelid '
+            'JOIN pg_class t ON t.oid = i.indrelid '
+            'JOIN pg_namespace n ON n.oid = t.relnamespace '
+            'WHERE NOT i.indisvalid')):
+        invalid.add((schema, table, index))
+        if default:
+            invalid.add((None, table, index))
+    return invalid
+
+
+def diff(connection, metadata, concurrently=True):
+    # список операций, приводящих живую БД к metadata
+    dialect = connection.dialect
+    inspector = inspect(connection)
+    existing = {}
+    invalid = _invalid_indexes(connection)
+    concurrent = concurrently and dialect.name == 'postgresql'
+    # SQLite не умеет ALTER TABLE ... ADD CONSTRAINT
+    alter_constraints = dialect.name != 'sqlite'
+
+    creates, columns, uniques, foreign_keys, indexes = [], [], [], [], []
+    for table in metadata.sorted_tables:
+        if table.schema not in existing:
+            existing[table.schema] = set(inspector.get_table_names(schema=table.schema))
+        if table.name not in existing[table.schema]:
+            creates.append(Operation('create_table', table))
+            # таблица пустая, поэтому ее индексы создаются сразу, без CONCURRENTLY
+            creates += [Operation('create_index', table, index)
+                        for index in sorted(table.indexes, key=lambda i: i.name or '')]
+            continue
+        live_columns = {c['name'] for c in inspector.get_columns(table.name, schema=table.schema)}
+        for column in table.columns:
+            if column.name not in live_columns:
+                if not column.nullable and column.server_default is None:
+                    raise ValueError(f'cannot add NOT NULL column {table.name}.{column.name} '
+                                     f'without a server_default to an existing table')
+                columns.append(Operation('add_column', table, column))
+        if alter_constraints:
+            live_uniques = {_columns_key(u['column_names'])
+                            for u in inspector.get_unique_constraints(table.name, schema=table.schema)}
+            live_fks = {(_columns_key(fk['constrained_columns']), fk['referred_table'])
+                        for fk in inspector.get_foreign_keys(table.name, schema=table.schema)}
+            for constraint in table.constraints:
+                names = _columns_key(c.name for c in constraint.columns)
+                if isinstance(constraint, UniqueConstraint) and names not in live_uniques:
+                    uniques.append(Operation('add_constraint', table, constraint))
+                elif isinstance(constraint, ForeignKeyConstraint) and \
+                        (names, constraint.referred_table.name) not in live_fks:
+                    foreign_keys.append(Operation('add_constraint', table, constraint))
+        live_indexes = {i['name'] for i in inspector.get_indexes(table.name, schema=table.schema)}
+        for index in table.indexes:
+            rebuild = (table.schema, table.name, index.name) in invalid
+            if rebuild:
+                indexes.append(Operation('drop_index', table, index, concurrent))
+            if index.name not in live_indexes or rebuild:
+                indexes.append(Operation('create_index', table, index, concurrent))
+    return creates + columns + uniques + foreign_keys + indexes
+
+
+def raw_ddl(sql):
+    # готовый текст DDL как инструкция: DDL() подставляет %(table)s и т.п.,
+    # поэтому знаки % экранируются
+    return DDL(sql.replace('%', '%%'))
+
+
+def execute_operation(connection, op):
+    connection.execute(raw_ddl(op.ddl(connection.dialect)))
+
+
+def reconcile(engine, metadata, name='default', concurrently=True, force=False, dry_run=False):
+    # возвращает список выполненных (или, при dry_run, запланированных) операций
+    current = fingerprint(metadata, engine.dialect)
+    with engine.begin() as conn:
+        stored = None
+        if inspect(conn).has_table(schema_state.name):
+            stored = conn.execute(select(schema_state.c.fingerprint)
+                                  .where(schema_state.c.name == name)).scalar()
+        if stored == current and not force:
+            return []
+        operations = diff(conn, metadata, concurrently)
+        if dry_run:
+            return operations
+        state_metadata.create_all(conn)
+        deferred = [op for op in operations if op.concurrent]
+        for op in operations:
+            if not op.concurrent:
+                execute_operation(conn, op)
+
+    if deferred:
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            for op in deferred:
+                execute_operation(conn, op)
+
+    with engine.begin() as conn:
+        updated = conn.execute(schema_state.update().where(schema_state.c.name == name)
+                               .values(fingerprint=current)).rowcount
+        if not updated:
+            conn.execute(schema_state.insert().values(name=name, fingerprint=current))
+    return operations
+
+
+def ensure_database(db_name, engine):
+    # создает базу данных, только если ее еще нет (вместо drop/create на каждом запуске).
+    # engine - подключение к служебной БД (например, postgres)
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        exists = conn.execute(text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                              {'name': db_name}).scalar()
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{db_name}"'))
+    return not exists
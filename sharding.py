@@ -0,0 +1,346 @@
+# Горизонтальное шардирование схемы sales по customer_id.
+# Каждый шард - отдельная БД с полной схемой sales_schema; строки распределяются так:
+#   customers    - по shard_function(id)
+#   orders       - по shard_function(customer_id): заказы лежат рядом со своим покупателем
+#   order_lines  - в шарде своего заказа (co-located), соединение orders/order_lines локально
+#   items        - справочник, копия в каждом шарде
+# Чтобы по id заказа (и строки заказа) находить шард без справочной таблицы,
+# ShardSet сам выдает им первичные ключи вида id % число_шардов == номер_шарда.
+# Счетчики ключей живут в процессе; нескольким процессам-писателям нужны
+# последовательности PostgreSQL с INCREMENT BY <число шардов>.
+#
+#   shards = ShardSet([get_engine(url=u) for u in urls])
+#   shards.create_all(metadata)
+#   shards.insert(orders, [{'customer_id': 7}])
+#   shards.get(orders, 12)
+#   shards.select(select(orders.c.customer_id, func.count()).group_by(orders.c.customer_id))
+#
+# select() без ключа шарда выполняется на всех шардах параллельно (scatter-gather):
+# результаты с ORDER BY сливаются с сохранением порядка, count/sum/min/max с GROUP BY
+# объединяются по выражениям GROUP BY (они должны быть в списке select, а HAVING
+# не поддерживается: шард отфильтровал бы группу по своей части сумм), LIMIT/OFFSET
+# применяются после слияния. Без GROUP BY
+# и агрегатов каждому шарду достаточно первых offset + limit строк; с ними LIMIT
+# в шарды не передается - до слияния групп неизвестно, какие из них попадут в выдачу.
+# Явный id заказа или строки заказа при вставке должен попадать в тот же шард
+# (id % число_шардов == номер_шарда), иначе get() его не найдет.
+# Транзакции между шардами не атомарны: каждая вставка фиксируется в своем шарде.
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cmp_to_key
+
+from sqlalchemy import exc, func, select
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import Label, UnaryExpression, _label_reference
+from sqlalchemy.sql.functions import FunctionElement
+
+
+def modulo_shard(key, shards_count):
+    return key % shards_count
+
+
+class ShardKey:
+    # строка попадает в шард shard_function(row[column])
+    def __init__(self, column):
+        self.column = column
+
+
+class CoLocated:
+    # строка попадает в шард родительской строки parent_table с id = row[column]
+    def __init__(self, column, parent_table):
+        self.column = column
+        self.parent_table = parent_table
+
+
+class Replicated:
+    # справочная таблица: копия в каждом шарде
+    pass
+
+
+SALES_PLACEMENT = {
+    'customers': ShardKey('id'),
+    'orders': ShardKey('customer_id'),
+    'order_lines': CoLocated('order_id', 'orders'),
+    'items': Replicated(),
+}
+
+# агрегаты, которые нельзя собрать из частичных результатов шардов
+UNCOMBINABLE = {'avg', 'array_agg', 'string_agg', 'group_concat', 'json_agg', 'jsonb_agg',
+                'stddev', 'stddev_pop', 'stddev_samp', 'variance', 'var_pop', 'var_samp',
+                'percentile_cont', 'percentile_disc', 'mode', 'bool_and', 'bool_or', 'every'}
+
+COMBINERS = {
+    'count': lambda a, b: a + b,
+    'sum': lambda a, b: b if a is None else a if b is None else a + b,
+    'min': lambda a, b: b if a is None else a if b is None else min(a, b),
+    'max': lambda a, b: b if a is None else a if b is None else max(a, b),
+}
+
+
+class _IdAllocator:
+    # ключи id % count == shard, начиная после наибольшего существующего
+    def __init__(self, shard, count, current_max):
+        self.shard = shard
+        self.count = count
+        start = (current_max or 0) + 1
+        self.next = start + (shard - start) % count
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        with self._lock:
+            value = self.next
+            self.next += self.count
+            return value
+
+    def skip(self, value):
+        # явно заданный id: следующие выданные ключи должны быть больше него
+        with self._lock:
+            if value >= self.next:
+                self.next = value + 1 + (self.shard - value - 1) % self.count
+
+
+class ShardSet:
+    def __init__(self, engines, shard_function=modulo_shard, placement=SALES_PLACEMENT, max_workers=None):
+        self.engines = list(engines)
+        self.shard_function = shard_function
+        self.placement = placement
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.engines),
+                                            thread_name_prefix='shard')
+        self._allocators = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._executor.shutdown()
+
+    def create_all(self, metadata):
+        self._map(lambda engine: metadata.create_all(engine))
+
+    def drop_all(self, metadata):
+        self._map(lambda engine: metadata.drop_all(engine))
+
+    def _map(self, func, engines=None):
+        return list(self._executor.map(func, engines or self.engines))
+
+    # маршрутизация
+
+    def shard_for_key(self, key):
+        return self.shard_function(key, len(self.engines))
+
+    def shard_of_id(self, table, id_):
+        # шард строки по первичному ключу
+        rule = self.placement[table.name]
+        if isinstance(rule, ShardKey) and rule.column == 'id':
+            return self.shard_for_key(id_)
+        return id_ % len(self.engines)
+
+    def shard_for_row(self, table, row):
+        rule = self.placement[table.name]
+        if isinstance(rule, ShardKey):
+            return self.shard_for_key(row[rule.column])
+        parent = table.metadata.tables[rule.parent_table]
+        return self.shard_of_id(parent, row[rule.column])
+
+    def _allocate_id(self, table, shard):
+        key = (table.name, shard)
+        with self._lock:
+            allocator = self._allocators.get(key)
+            if allocator is None:
+                with self.engines[shard].connect() as conn:
+                    current = conn.execute(select(func.max(table.c.id))).scalar()
+                allocator = self._allocators[key] = _IdAllocator(shard, len(self.engines), current)
+        return allocator.allocate()
+
+    def _allocate_key(self, table):
+        # id нового покупателя: следующий после наибольшего во всех шардах
+        with self._lock:
+            allocator = self._allocators.get(table.name)
+            if allocator is None:
+                current = max((value or 0) for value in self._map(
+                    lambda engine: _scalar(engine, select(func.max(table.c.id)))))
+                allocator = self._allocators[table.name] = _IdAllocator(0, 1, current)
+        return allocator.allocate()
+
+    # запись
+
+    def insert(self, table, rows):
+        # раскладывает строки по шардам; возвращает строки с назначенными id
+        rule = self.placement[table.name]
+        rows = [dict(row) for row in rows]
+        if isinstance(rule, Replicated):
+            self._map(lambda engine: _insert(engine, table, rows))
+            return rows
+        groups = {}
+        by_id = isinstance(rule, ShardKey) and rule.column == 'id'
+        for row in rows:
+            if by_id and row.get('id') is None:
+                row['id'] = self._allocate_key(table)
+            shard = self.shard_for_row(table, row)
+            if row.get('id') is None:
+                row['id'] = self._allocate_id(table, shard)
+            else:
+                self._check_id(table, row['id'], shard, by_id)
+            groups.setdefault(shard, []).append(row)
+        list(self._executor.map(lambda item: _insert(self.engines[item[0]], table, item[1]), groups.items()))
+        return rows
+
+    def _check_id(self, table, id_, shard, by_id):
+        # get() ищет строку в шарде shard_of_id(id): явный id должен туда и указывать
+        if not by_id and self.shard_of_id(table, id_) != shard:
+            raise ValueError(f'{table.name}.id={id_} belongs to shard {self.shard_of_id(table, id_)}, '
+                             f'but the row is placed on shard {shard}; leave id out to have one assigned')
+        with self._lock:
+            allocator = self._allocators.get(table.name if by_id else (table.name, shard))
+        if allocator is not None:
+            allocator.skip(id_)
+
+    # чтение
+
+    def get(self, table, id_):
+        with self.engines[self.shard_of_id(table, id_)].connect() as conn:
+            return conn.execute(select(table).where(table.c.id == id_)).first()
+
+    def execute(self, stmt, key=None, shard=None):
+        # инструкция в шарде покупателя key (или в шарде с номером shard)
+        if shard is None:
+            if key is None:
+                raise exc.ArgumentError('execute() needs a shard key or a shard number; '
+                                        'use select() to run a query on all shards')
+            shard = self.shard_for_key(key)
+        with self.engines[shard].begin() as conn:
+            result = conn.execute(stmt)
+            return result.freeze()() if result.returns_rows else result
+
+    def scatter(self, stmt):
+        # результаты инструкции со всех шардов: список списков строк
+        return self._map(lambda engine: _all(engine, stmt))
+
+    def select(self, stmt):
+        # scatter-gather: выполняет stmt на всех шардах и объединяет результаты в один Result
+        limit, offset = stmt._limit, stmt._offset
+        columns = list(stmt.selected_columns)
+        aggregates = _aggregates(columns)
+        grouped = bool(aggregates) or bool(stmt._group_by_clauses)
+        if stmt._having_criteria:
+            raise ValueError('HAVING cannot be applied on shards before their groups are combined; '
+                             'filter the combined rows instead')
+        group_keys = [_position(columns, element, 'GROUP BY') for element in stmt._group_by_clauses]
+        per_shard = stmt
+        if grouped:
+            per_shard = stmt.offset(None).limit(None)
+        elif limit is not None or offset is not None:
+            # каждому шарду нужны первые offset + limit строк
+            per_shard = stmt.offset(None).limit(None if limit is None else limit + (offset or 0))
+        order = _order_keys(stmt, columns)
+        results = self.scatter(per_shard)
+        compare = _comparator(order, self.engines[0].dialect)
+
+        if grouped:
+            # одна и та же группа может прийти из нескольких шардов
+            rows = _combine(results, aggregates, group_keys)
+            if order:
+                rows.sort(key=cmp_to_key(compare))
+        elif order:
+            rows = list(heapq.merge(*results, key=cmp_to_key(compare)))
+        else:
+            rows = [row for result in results for row in result]
+        start = offset or 0
+        rows = rows[start:start + limit] if limit is not None else rows[start:]
+        return IteratorResult(SimpleResultMetaData([c.key for c in columns]), iter([tuple(r) for r in rows]))
+
+
+def _scalar(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).scalar()
+
+
+def _all(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+
+def _insert(engine, table, rows):
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+
+
+def _aggregates(columns):
+    # {позиция: имя агрегата}; пустой словарь - запрос без агрегатов
+    found = {}
+    for position, column in enumerate(columns):
+        element = column.element if isinstance(column, Label) else column
+        if not isinstance(element, FunctionElement):
+            continue
+        name = element.name.lower()
+        if name in UNCOMBINABLE:
+            raise ValueError(f'{name}() cannot be combined across shards; '
+                             f'select sum() and count() and divide instead')
+        if name not in COMBINERS:
+            # обычная функция над значениями строки, например lower()
+            continue
+        if any(isinstance(argument, UnaryExpression) and argument.operator is operators.distinct_op
+               for argument in element.clauses.clauses):
+            # одно значение может встретиться в нескольких шардах
+            raise ValueError(f'{name}(DISTINCT ...) cannot be combined across shards')
+        found[position] = name
+    return found
+
+
+def _combine(results, aggregates, group_keys):
+    # группы сливаются по выражениям GROUP BY; без GROUP BY все строки - одна группа
+    groups = {}
+    for result in results:
+        for row in result:
+            key = tuple(row[position] for position in group_keys)
+            current = groups.get(key)
+            if current is None:
+                groups[key] = list(row)
+                continue
+            for position, name in aggregates.items():
+                current[position] = COMBINERS[name](current[position], row[position])
+    return list(groups.values())
+
+
+def _order_keys(stmt, columns):
+    # [(позиция в select, по убыванию)] для выражений ORDER BY
+    keys = []
+    for clause in stmt._order_by_clauses:
+        if isinstance(clause, _label_reference):
+            # order_by(label.desc()) оборачивает выражение в ссылку на метку
+            clause = clause.element
+        descending = isinstance(clause, UnaryExpression) and clause.modifier is operators.desc_op
+        element = clause.element if isinstance(clause, UnaryExpression) else clause
+        keys.append((_position(columns, element, 'ORDER BY'), descending))
+    return keys
+
+
+def _position(columns, element, clause):
+    # позиция выражения ORDER BY или GROUP BY в списке select
+    if isinstance(element, _label_reference):
+        element = element.element
+    for position, column in enumerate(columns):
+        if column is element or column.compare(element) or \
+                (isinstance(column, Label) and column.element.compare(element)) or \
+                (isinstance(element, Label) and column.compare(element.element)):
+            return position
+    raise ValueError(f'{clause} {element} must be in the select list to merge shard results')
+
+
+def _comparator(order, dialect):
+    # NULL в PostgreSQL при сортировке по возрастанию идут последними, в SQLite - первыми
+    nulls_high = dialect.name == 'postgresql'
+
+    def compare(left, right):
+        for position, descending in order:
+            a, b = left[position], right[position]
+            if a == b:
+                continue
+            if a is None or b is None:
+                result = (1 if a is None else -1) if nulls_high else (-1 if a is None else 1)
+            else:
+                result = -1 if a < b else 1
+            return -result if descending else result
+        return 0
+    return compare
@@ -0,0 +1,26 @@
+# stacklevel для warnings.warn, чтобы предупреждение показывало на код пользователя,
+# а не на модуль репозитория или sqlalchemy, через которые до него дошел вызов:
+#
+#   warnings.warn(message, SomeWarning, stacklevel=caller_stacklevel(__file__))
+import os
+import sys
+
+import sqlalchemy
+
+SQLALCHEMY = os.path.dirname(os.path.abspath(sqlalchemy.__file__)) + os.sep
+
+
+def caller_stacklevel(*internal):
+    # internal - файлы модулей (__file__) и каталоги (с os.sep на конце), кадры которых
+    # пропускаются; отсчет идет от функции, вызывающей warnings.warn
+    internal = tuple(path if path.endswith(os.sep) else os.path.abspath(path) for path in internal)
+    frame = sys._getframe(1)
+    level = 1
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not any(filename.startswith(path) if path.endswith(os.sep) else filename == path
+                   for path in internal):
+            break
+        frame = frame.f_back
+        level += 1
+    return level
@@ -0,0 +1,109 @@
+# Реестр параметризованных инструкций.
+# В first_db.py инструкции insert/update/delete каждый раз собираются заново
+# с конкретными значениями внутри .values()/.where(). Здесь каждая "форма"
+# инструкции строится один раз с bindparam, а значения передаются при выполнении.
+# Скомпилированный SQL хранится в LRU-кэше (отдельно для каждого диалекта),
+# который передается в sqlalchemy через execution_options(compiled_cache=...).
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, insert, update, delete
+
+from sales_schema import customers, items, orders, order_lines
+
+
+class LRUCache:
+    # словарь с ограниченным размером и счетчиками попаданий/промахов;
+    # sqlalchemy использует у compiled_cache только get() и []=
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+        }
+
+
+class StatementRegistry:
+    def __init__(self, maxsize=500):
+        self.cache = LRUCache(maxsize)
+        self._builders = {}
+        self._statements = {}
+
+    def register(self, name, builder):
+        # builder - функция без аргументов, возвращающая инструкцию с bindparam;
+        # вызывается один раз, при первом обращении
+        self._builders[name] = builder
+        self._statements.pop(name, None)
+
+    def statement(self, name):
+        stmt = self._statements.get(name)
+        if stmt is None:
+            stmt = self._statements[name] = self._builders[name]()
+        return stmt
+
+    def compiled(self, name, dialect):
+        # скомпилированная форма для просмотра SQL, как ins.compile() в first_db.py
+        # ключ - сам объект диалекта, как в compiled_cache sqlalchemy: у psycopg2, psycopg 3
+        # и asyncpg name одинаковый ('postgresql'), а стиль параметров разный
+        key = ('registry', name, dialect)
+        compiled = self.cache.get(key)
+        if compiled is None:
+            compiled = self.statement(name).compile(dialect=dialect)
+            self.cache[key] = compiled
+        return compiled
+
+    def execute(self, connection, name, parameters=None):
+        # parameters - словарь или список словарей (executemany)
+        connection = connection.execution_options(compiled_cache=self.cache)
+        if parameters is None:
+            return connection.execute(self.statement(name))
+        return connection.execute(self.statement(name), parameters)
+
+
+# формы инструкций из first_db.py
+sales_statements = StatementRegistry()
+sales_statements.register('insert_customer', lambda: insert(customers))
+sales_statements.register('insert_item', lambda: insert(items))
+sales_statements.register('insert_order', lambda: insert(orders))
+sales_statements.register('insert_order_line', lambda: insert(order_lines))
+# SET формируется из переданных ключей: {'item_name': ..., 'selling_price': ..., 'quantity': ...}
+sales_statements.register('update_item_by_name', lambda: update(items).where(
+    items.c.name == bindparam('item_name')))
+sales_statements.register('delete_customers_like', lambda: delete(customers).where(
+    customers.c.username.like(bindparam('pattern'))))
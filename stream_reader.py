@@ -0,0 +1,86 @@
+# Потоковое чтение больших таблиц схемы sales.
+# Обычный Result буферизует все строки в памяти; здесь результат читается
+# порциями фиксированного размера через execution_options(yield_per=...),
+# что включает stream_results - на psycopg2 это серверный (именованный) курсор.
+# Порции отдаются как кортежи, словари или колонки (массивы numpy, если он установлен).
+from sqlalchemy import select
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_PARTITION_SIZE = 10000
+FORMATS = ('tuples', 'dicts', 'columns')
+
+
+def _columns(keys, partition):
+    # порция строк -> {колонка: массив значений}
+    columns = list(zip(*partition))
+    if numpy is None:
+        return {key: list(values) for key, values in zip(keys, columns)}
+    return {key: numpy.array(values) for key, values in zip(keys, columns)}
+
+
+def _check_format(as_):
+    # до выполнения запроса: иначе ошибка появилась бы только после чтения первой порции
+    if as_ not in FORMATS:
+        raise ValueError(f'unknown partition format: {as_}')
+
+
+def stream_partitions(connection, stmt, partition_size=DEFAULT_PARTITION_SIZE, as_='tuples'):
+    # as_: 'tuples', 'dicts' или 'columns'
+    _check_format(as_)
+    return _partitions(connection, stmt, partition_size, as_)
+
+
+def _partitions(connection, stmt, partition_size, as_):
+    result = connection.execution_options(yield_per=partition_size).execute(stmt)
+    keys = list(result.keys())
+    try:
+        for partition in result.partitions(partition_size):
+            if as_ == 'tuples':
+                yield [tuple(row) for row in partition]
+            elif as_ == 'dicts':
+                yield [dict(row._mapping) for row in partition]
+            else:
+                yield _columns(keys, partition)
+    finally:
+        result.close()
+
+
+def stream_table(engine, table, partition_size=DEFAULT_PARTITION_SIZE, as_='tuples', where=None):
+    _check_format(as_)
+    stmt = select(table)
+    if where is not None:
+        stmt = stmt.where(where)
+    return _stream_table(engine, stmt, partition_size, as_)
+
+
+def _stream_table(engine, stmt, partition_size, as_):
+    # соединение держится открытым, пока читается генератор
+    with engine.connect() as connection:
+        yield from _partitions(connection, stmt, partition_size, as_)
+
+
+def stream_rows(engine, table, partition_size=DEFAULT_PARTITION_SIZE, where=None):
+    # построчно, но с теми же ограничениями по памяти
+    for partition in stream_table(engine, table, partition_size, 'tuples', where):
+        yield from partition
+
+
+def stream_objects(session, stmt, partition_size=DEFAULT_PARTITION_SIZE):
+    # для ORM: select(Customer) -> порции объектов. Перед чтением следующей порции
+    # объекты предыдущей отсоединяются от сессии, иначе все прочитанные объекты накопятся
+    # в identity map; изменения в них нужно сохранить (session.flush()) до перехода
+    # к следующей. expunge_all() здесь не годится: он заменяет identity map, в которую
+    # еще пишет незаконченная загрузка yield_per
+    result = session.execute(stmt.execution_options(yield_per=partition_size))
+    try:
+        for partition in result.scalars().partitions(partition_size):
+            yield partition
+            for instance in partition:
+                if instance in session:
+                    session.expunge(instance)
+    finally:
+        result.close()
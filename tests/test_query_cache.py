@@ -0,0 +1,109 @@
+from sqlalchemy import select, text, insert, update, event
+from sqlalchemy.orm import Session
+
+from query_cache import QueryCache
+from sales_models import Item
+from sales_schema import metadata, items
+
+
+def load(engine):
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(items), [
+            {'name': 'Pen', 'cost_price': 1, 'selling_price': 2, 'quantity': 3},
+            {'name': 'Cup', 'cost_price': 4, 'selling_price': 5, 'quantity': 6},
+        ])
+
+
+def pen_quantity():
+    return select(items.c.quantity).where(items.c.name == 'Pen')
+
+
+def test_core_select_is_not_stale_after_update(engine):
+    load(engine)
+    cache = QueryCache(engine)
+    with engine.connect() as conn:
+        assert cache.execute(conn, pen_quantity()).all() == [(3,)]
+        assert cache.execute(conn, pen_quantity()).all() == [(3,)]
+        assert cache.hits == 1
+    with engine.begin() as conn:
+        conn.execute(update(items).where(items.c.name == 'Pen').values(quantity=11))
+    with engine.connect() as conn:
+        assert cache.execute(conn, pen_quantity()).all() == [(11,)]
+
+
+def test_uncommitted_write_is_not_cached_for_other_connections(engine):
+    load(engine)
+    cache = QueryCache(engine)
+    with engine.connect() as writer:
+        with writer.begin():
+            writer.execute(update(items).where(items.c.name == 'Pen').values(quantity=7))
+            # в своей транзакции кэш не используется: видно собственное изменение
+            assert cache.execute(writer, pen_quantity()).all() == [(7,)]
+    with engine.connect() as conn:
+        assert cache.execute(conn, pen_quantity()).all() == [(7,)]
+
+
+def test_orm_select_is_not_stale_after_update(engine):
+    load(engine)
+    cache = QueryCache(engine)
+    stmt = select(Item).where(Item.name == 'Pen')
+    with Session(engine) as session:
+        assert cache.execute(session, stmt).scalars().one().quantity == 3
+    with engine.begin() as conn:
+        conn.execute(update(items).where(items.c.name == 'Pen').values(quantity=9))
+    with Session(engine) as session:
+        assert cache.execute(session, stmt).scalars().one().quantity == 9
+
+
+def test_text_without_tables_is_not_cached(engine):
+    load(engine)
+    cache = QueryCache(engine)
+    stmt = text("SELECT quantity FROM items WHERE name = 'Pen'")
+    with engine.connect() as conn:
+        assert cache.execute(conn, stmt).all() == [(3,)]
+    with engine.begin() as conn:
+        conn.execute(update(items).where(items.c.name == 'Pen').values(quantity=11))
+    with engine.connect() as conn:
+        assert cache.execute(conn, stmt).all() == [(11,)]
+    assert cache.hits == 0 and len(cache.backend) == 0
+
+
+def test_text_with_explicit_tables_is_invalidated(engine):
+    load(engine)
+    cache = QueryCache(engine)
+    stmt = text("SELECT quantity FROM items WHERE name = 'Pen'")
+    with engine.connect() as conn:
+        cache.execute(conn, stmt, tables=[items])
+        assert cache.execute(conn, stmt, tables=[items]).all() == [(3,)]
+        assert cache.hits == 1
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE items SET quantity = 11 WHERE name = 'Pen'"))
+    with engine.connect() as conn:
+        assert cache.execute(conn, stmt, tables=[items]).all() == [(11,)]
+
+
+def test_result_read_during_invalidation_is_not_stored(engine):
+    load(engine)
+    cache = QueryCache(engine)
+
+    # другое соединение фиксирует изменение, пока этот запрос читается
+    def concurrent_commit(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT'):
+            cache.invalidate(items)
+
+    event.listen(engine, 'after_cursor_execute', concurrent_commit)
+    with engine.connect() as conn:
+        cache.execute(conn, pen_quantity())
+    event.remove(engine, 'after_cursor_execute', concurrent_commit)
+    assert len(cache.backend) == 0
+
+
+def test_params_as_list_or_dict(engine):
+    load(engine)
+    cache = QueryCache(engine)
+    stmt = text('SELECT quantity FROM items WHERE name = :name')
+    with engine.connect() as conn:
+        assert cache.execute(conn, stmt, {'name': 'Cup'}, tables=[items]).all() == [(6,)]
+        assert cache.execute(conn, stmt, {'name': 'Pen'}, tables=[items]).all() == [(3,)]
+        assert cache._key(conn.dialect, stmt, [{'name': 'Cup'}, {'name': 'Pen'}])
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, exc, func, insert, select
+
+from routing import ReplicaSet, routing_sessionmaker
+from sales_models import Item
+from sales_schema import metadata, items
+
+
+@pytest.fixture
+def replica_set(tmp_path):
+    # отдельные файлы без репликации: то, что записано на primary, на репликах не видно
+    engines = [create_engine(f'sqlite:///{tmp_path / name}.db') for name in ('primary', 'replica0', 'replica1')]
+    for engine in engines:
+        metadata.create_all(engine)
+    replica_set = ReplicaSet(engines[0], engines[1:], read_your_writes=0.2)
+    yield replica_set
+    replica_set.close()
+    for engine in engines:
+        engine.dispose()
+
+
+def item_count():
+    return select(func.count()).select_from(items)
+
+
+def pen():
+    return {'name': 'Pen', 'cost_price': 1, 'selling_price': 2, 'quantity': 3}
+
+
+def test_new_session_reads_own_write_after_commit(replica_set):
+    Session = routing_sessionmaker(replica_set)
+    with Session() as session:
+        session.add(Item(**pen()))
+        session.commit()
+    with Session() as session:
+        assert session.execute(item_count()).scalar() == 1
+
+
+def test_core_write_opens_read_your_writes_window(replica_set):
+    replica_set.execute(insert(items), pen())
+    assert replica_set.execute(item_count()).scalar() == 1
+    with replica_set.connect(readonly=True) as conn:
+        assert conn.execute(item_count()).scalar() == 1
+
+
+def test_reads_return_to_replicas_after_window(replica_set):
+    replica_set.execute(insert(items), pen())
+    time.sleep(0.25)
+    assert replica_set.execute(item_count()).scalar() == 0
+    Session = routing_sessionmaker(replica_set)
+    with Session() as session:
+        assert session.execute(item_count()).scalar() == 0
+        with session.primary():
+            assert session.execute(item_count()).scalar() == 1
+
+
+def test_transaction_reads_from_one_replica(replica_set):
+    Session = routing_sessionmaker(replica_set)
+    with Session() as session:
+        for _ in range(4):
+            session.execute(item_count()).scalar()
+        assert sorted(replica_set.reads[engine] for engine in replica_set.replicas) == [0, 1]
+        session.rollback()
+        session.execute(item_count()).scalar()
+        assert [replica_set.reads[engine] for engine in replica_set.replicas] == [1, 1]
+
+
+def test_write_in_transaction_reads_from_primary(replica_set):
+    Session = routing_sessionmaker(replica_set)
+    with Session() as session:
+        session.add(Item(**pen()))
+        session.flush()
+        assert session.execute(item_count()).scalar() == 1
+        session.rollback()
+        assert session.execute(item_count()).scalar() == 0
+
+
+def test_failed_replica_is_ejected(tmp_path, replica_set):
+    broken = create_engine(f'sqlite:///{tmp_path / "missing" / "replica.db"}')
+    fallback = ReplicaSet(replica_set.primary, [broken, replica_set.replicas[0]], cooldown=60)
+    try:
+        for _ in range(3):
+            assert fallback.execute(item_count()).scalar() == 0
+        assert fallback.healthy() == [replica_set.replicas[0]]
+        assert fallback.ejections == 1
+    finally:
+        fallback.close()
+
+
+def test_explicit_transaction_reads_from_primary(replica_set):
+    with replica_set.primary.begin() as conn:
+        conn.execute(insert(items), pen())
+    time.sleep(0.25)
+    Session = routing_sessionmaker(replica_set)
+    with Session() as session:
+        with session.begin():
+            assert session.execute(item_count()).scalar() == 1
+        assert session.execute(item_count()).scalar() == 0
+
+
+def test_statement_error_does_not_eject_replica(replica_set):
+    # таблицы нет на репликах: ошибка инструкции, а не соединения
+    other = MetaData()
+    notes = Table('notes', other, Column('id', Integer, primary_key=True))
+    other.create_all(replica_set.primary)
+    with pytest.raises(exc.OperationalError):
+        replica_set.execute(select(notes))
+    assert replica_set.ejections == 0
+    assert replica_set.healthy() == replica_set.replicas
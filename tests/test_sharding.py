@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import create_engine, exc, func, select
+
+from sales_schema import metadata, customers, orders, order_lines, items
+from sharding import ShardSet
+
+# заказов у покупателей 1..4: 3, 1, 2, 4 - покупатели распределяются по трем шардам
+ORDERS_PER_CUSTOMER = {1: 3, 2: 1, 3: 2, 4: 4}
+
+
+def customer(username):
+    return {'first_name': 'A', 'last_name': 'B', 'username': username, 'email': f'{username}@example.com',
+            'address': 'Street 1', 'town': 'Town'}
+
+
+@pytest.fixture
+def shards(tmp_path):
+    engines = [create_engine(f'sqlite:///{tmp_path / f"shard{i}"}.db') for i in range(3)]
+    shards = ShardSet(engines)
+    shards.create_all(metadata)
+    yield shards
+    shards.close()
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def loaded(shards):
+    shards.insert(items, [{'name': 'Pen', 'cost_price': 1, 'selling_price': 2, 'quantity': 3}])
+    shards.insert(customers, [customer(f'user{i}') for i in ORDERS_PER_CUSTOMER])
+    placed = shards.insert(orders, [{'customer_id': customer_id}
+                                    for customer_id, count in ORDERS_PER_CUSTOMER.items()
+                                    for _ in range(count)])
+    shards.insert(order_lines, [{'order_id': order['id'], 'item_id': 1, 'quantity': order['customer_id']}
+                                for order in placed])
+    return placed
+
+
+def rows_in(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(select(table)).all()
+
+
+def test_rows_are_placed_by_customer(shards, loaded):
+    for shard, engine in enumerate(shards.engines):
+        assert all(shards.shard_for_key(row.customer_id) == shard for row in rows_in(engine, orders))
+        # строки заказа лежат рядом со своим заказом, справочник - в каждом шарде
+        local = {row.id for row in rows_in(engine, orders)}
+        assert all(row.order_id in local for row in rows_in(engine, order_lines))
+        assert len(rows_in(engine, items)) == 1
+
+
+def test_get_finds_assigned_ids(shards, loaded):
+    for order in loaded:
+        assert shards.get(orders, order['id']).customer_id == order['customer_id']
+    assert shards.get(customers, 3).username == 'user3'
+
+
+def test_explicit_id_must_match_its_shard(shards, loaded):
+    with pytest.raises(ValueError):
+        shards.insert(orders, [{'id': 100, 'customer_id': 2}])
+    placed = shards.insert(orders, [{'id': 101, 'customer_id': 2}, {'customer_id': 2}])
+    assert shards.get(orders, 101).customer_id == 2
+    # следующий выданный id не совпадает с явно заданным
+    assert placed[1]['id'] > 101 and shards.get(orders, placed[1]['id']) is not None
+
+
+def test_execute_needs_key_or_shard(shards, loaded):
+    stmt = select(func.count()).select_from(orders).where(orders.c.customer_id == 4)
+    assert shards.execute(stmt, key=4).scalar() == 4
+    with pytest.raises(exc.ArgumentError):
+        shards.execute(stmt)
+
+
+def test_order_by_and_limit_are_merged(shards, loaded):
+    ids = sorted(order['id'] for order in loaded)
+    stmt = select(orders.c.id).order_by(orders.c.id.desc()).offset(2).limit(4)
+    assert shards.select(stmt).scalars().all() == sorted(ids, reverse=True)[2:6]
+
+
+def test_aggregates_are_combined(shards, loaded):
+    total = select(func.count(), func.sum(order_lines.c.quantity), func.max(order_lines.c.quantity))
+    assert shards.select(total).all() == [(10, 27, 4)]
+    per_customer = select(orders.c.customer_id, func.count().label('placed')) \
+        .group_by(orders.c.customer_id).order_by(orders.c.customer_id)
+    assert shards.select(per_customer).all() == list(ORDERS_PER_CUSTOMER.items())
+
+
+def test_group_by_is_merged_by_group_key(shards, loaded):
+    # покупатели 1 и 4 лежат в одном шарде: группы не должны слиться в одну строку
+    stmt = select(orders.c.customer_id, func.count()).group_by(orders.c.customer_id)
+    assert sorted(shards.select(stmt).all()) == sorted(ORDERS_PER_CUSTOMER.items())
+    with pytest.raises(ValueError):
+        shards.select(select(func.count()).select_from(orders).group_by(orders.c.customer_id))
+
+
+def test_having_and_avg_are_rejected(shards, loaded):
+    with pytest.raises(ValueError):
+        shards.select(select(orders.c.customer_id, func.count()).group_by(orders.c.customer_id)
+                      .having(func.count() > 1))
+    with pytest.raises(ValueError):
+        shards.select(select(func.avg(order_lines.c.quantity)))
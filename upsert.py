@@ -0,0 +1,225 @@
+# Пакетный upsert (вставить или обновить) для таблиц Core.
+# Повторный запуск first_db.py или загрузка очередной выгрузки дублирует строки
+# items (по name) и customers (по username). upsert() вставляет новые строки
+# и обновляет существующие одной инструкцией на порцию:
+#   PostgreSQL - INSERT ... SELECT FROM unnest(...) ON CONFLICT (...) DO UPDATE
+#                (массивы вместо VALUES - SQL не зависит от размера порции)
+#   SQLite     - INSERT ... ON CONFLICT (...) DO UPDATE через executemany
+#   MySQL      - INSERT ... ON DUPLICATE KEY UPDATE
+#   MERGE      - MERGE INTO ... AS t USING (VALUES ...) AS s (...) (method='merge'):
+#                такой синтаксис только у PostgreSQL 15+ и SQL Server, у Oracle и
+#                других баз он другой, поэтому для них upsert() - ValueError
+# Конфликт определяется уникальным ограничением или индексом: объектом, его именем
+# или списком колонок. Колонки с onupdate (updated_on=datetime.now) получают новое
+# значение при обновлении, даже если их нет во входных строках.
+#
+#   natural_key_indexes(metadata)            # уникальные индексы items.name, customers.username
+#   upsert(conn, items, items_list, conflict=['name'], update=['selling_price', 'quantity'])
+from sqlalchemy import Index, UniqueConstraint, bindparam, cast, func, select, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from bulk_load import DEFAULT_CHUNK_SIZE, _python_defaults, chunked, same_keys
+from bulk_orm import MAX_PARAMETERS
+
+# естественные ключи таблиц sales_schema.py
+NATURAL_KEYS = {
+    'items': ('name',),
+    'customers': ('username',),
+}
+
+# диалекты, для которых годится SQL из _merge
+MERGE_DIALECTS = ('postgresql', 'mssql')
+
+
+def natural_key_indexes(metadata, keys=NATURAL_KEYS):
+    # добавляет в metadata уникальные индексы uq_<таблица>_<колонки>, если их еще нет;
+    # создать их в существующей БД можно через schema_reconcile.reconcile()
+    indexes = []
+    for table_name, columns in keys.items():
+        table = metadata.tables.get(table_name)
+        if table is None:
+            continue
+        name = 'uq_{}_{}'.format(table_name, '_'.join(columns))
+        existing = [index for index in table.indexes if index.name == name]
+        if existing:
+            indexes.extend(existing)
+            continue
+        indexes.append(Index(name, *(table.c[column] for column in columns), unique=True))
+    return indexes
+
+
+def conflict_columns(table, conflict):
+    # имена колонок цели конфликта: UniqueConstraint/Index, его имя или список колонок
+    if isinstance(conflict, str):
+        for element in list(table.constraints) + list(table.indexes):
+            if element.name == conflict:
+                conflict = element
+                break
+        else:
+            raise ValueError(f'{table.name}: no unique constraint or index named {conflict!r}')
+    if isinstance(conflict, (UniqueConstraint, Index)):
+        if isinstance(conflict, Index) and not conflict.unique:
+            raise ValueError(f'{table.name}: index {conflict.name} is not unique')
+        return [column.name for column in conflict.columns]
+    return [getattr(column, 'name', column) for column in conflict]
+
+
+def _onupdate_values(table, names):
+    # значения onupdate на стороне python для колонок, которые не обновляются явно
+    values = {}
+    for column in table.columns:
+        if column.name in names or column.onupdate is None:
+            continue
+        onupdate = column.onupdate
+        if onupdate.is_callable:
+            values[column.name] = onupdate.arg(None)
+        elif onupdate.is_scalar:
+            values[column.name] = onupdate.arg
+    return values
+
+
+def _update_columns(table, names, keys, update):
+    if update is None:
+        # по умолчанию обновляется все, что пришло во входных строках, кроме ключей
+        pk = {column.name for column in table.primary_key.columns}
+        return [name for name in names if name not in keys and name not in pk]
+    return [getattr(column, 'name', column) for column in update]
+
+
+def _last_per_key(chunk, keys):
+    # одна инструкция не может обновить строку дважды (PostgreSQL: "cannot affect row
+    # a second time", MERGE - тоже), поэтому из строк с одинаковым ключом в порции
+    # остается последняя, как если бы они применялись по очереди; строки с NULL
+    # в ключе не конфликтуют и остаются все
+    unique, nulls = {}, []
+    for position, row in enumerate(chunk):
+        key = tuple(row.get(name) for name in keys)
+        if None in key:
+            nulls.append((position, row))
+        else:
+            unique.pop(key, None)
+            unique[key] = (position, row)
+    if not nulls and len(unique) == len(chunk):
+        return chunk
+    return [row for _, row in sorted(list(unique.values()) + nulls, key=lambda item: item[0])]
+
+
+def _method(dialect, method):
+    if method is None:
+        method = dialect.name if dialect.name in ('postgresql', 'sqlite', 'mysql') else 'merge'
+    if method == 'merge':
+        if dialect.name not in MERGE_DIALECTS:
+            raise ValueError(f'upsert: MERGE is not supported for {dialect.name}')
+        if dialect.name == 'postgresql' and (dialect.server_version_info or (15,)) < (15,):
+            raise ValueError('upsert: MERGE needs PostgreSQL 15 or later')
+    return method
+
+
+def _postgresql(table, names, keys, update, onupdate):
+    arrays = [cast(bindparam(name), ARRAY(table.c[name].type)) for name in names]
+    source = func.unnest(*arrays).table_valued(*names).render_derived()
+    stmt = postgresql.insert(table).from_select(names, select(*[source.c[name] for name in names]))
+    if not update and not onupdate:
+        return stmt.on_conflict_do_nothing(index_elements=keys)
+    values = {name: stmt.excluded[name] for name in update}
+    values.update({name: bindparam(f'onupdate_{name}', type_=table.c[name].type) for name in onupdate})
+    return stmt.on_conflict_do_update(index_elements=keys, set_=values)
+
+
+def _sqlite(table, names, keys, update, onupdate):
+    stmt = sqlite.insert(table)
+    if not update and not onupdate:
+        return stmt.on_conflict_do_nothing(index_elements=keys)
+    values = {name: stmt.excluded[name] for name in update}
+    values.update({name: bindparam(f'onupdate_{name}', type_=table.c[name].type) for name in onupdate})
+    return stmt.on_conflict_do_update(index_elements=keys, set_=values)
+
+
+def _mysql(table, rows, update, onupdate):
+    stmt = mysql.insert(table).values(rows)
+    values = {name: stmt.inserted[name] for name in update}
+    values.update(onupdate)
+    if not values:
+        # DO NOTHING: присваивание ключа самому себе
+        first = next(iter(table.primary_key.columns))
+        values = {first.name: table.c[first.name]}
+    return stmt.on_duplicate_key_update(**values)
+
+
+def _merge(dialect, table, names, keys, update, onupdate, count):
+    # MERGE INTO t USING (VALUES (...), ...) AS s (...) ON ... WHEN MATCHED ... WHEN NOT MATCHED ...
+    quote = dialect.identifier_preparer.quote
+    rows = ', '.join('({})'.format(', '.join(f':p{i}_{n}' for n in range(len(names))))
+                     for i in range(count))
+    columns = ', '.join(quote(name) for name in names)
+    on = ' AND '.join(f't.{quote(key)} = s.{quote(key)}' for key in keys)
+    sql = (f'MERGE INTO {dialect.identifier_preparer.format_table(table)} AS t '
+           f'USING (VALUES {rows}) AS s ({columns}) ON {on}')
+    assignments = [f'{quote(name)} = s.{quote(name)}' for name in update]
+    assignments += [f'{quote(name)} = :onupdate_{name}' for name in onupdate]
+    if assignments:
+        sql += ' WHEN MATCHED THEN UPDATE SET ' + ', '.join(assignments)
+    sql += ' WHEN NOT MATCHED THEN INSERT ({}) VALUES ({})'.format(
+        columns, ', '.join(f's.{quote(name)}' for name in names))
+    if dialect.name == 'mssql':
+        # в SQL Server MERGE обязан заканчиваться точкой с запятой
+        sql += ';'
+    binds = [bindparam(f'p{i}_{n}', type_=table.c[name].type)
+             for i in range(count) for n, name in enumerate(names)]
+    binds += [bindparam(f'onupdate_{name}', type_=table.c[name].type) for name in onupdate]
+    return text(sql).bindparams(*binds)
+
+
+def upsert(connection, table, rows, conflict, update=None, chunk_size=DEFAULT_CHUNK_SIZE, method=None):
+    # rows - итерируемый объект словарей с одинаковым набором ключей (иначе ValueError;
+    # из строк с одним и тем же ключом конфликта в порции применяется последняя);
+    # update - колонки, которые обновляются при конфликте ([] - только вставка новых строк);
+    # method - 'postgresql', 'sqlite', 'mysql' или 'merge' (по умолчанию - по диалекту).
+    # Возвращает число обработанных строк
+    dialect = connection.dialect
+    method = _method(dialect, method)
+    keys = conflict_columns(table, conflict)
+    statements = {}
+    count = 0
+    for chunk in chunked(same_keys(rows), chunk_size):
+        count += len(chunk)
+        chunk = _last_per_key(chunk, keys)
+        names = [column.name for column in table.columns if column.name in chunk[0]]
+        if len(names) != len(chunk[0]):
+            unknown = sorted(set(chunk[0]) - set(names))
+            raise ValueError(f'{table.name}: no columns {unknown}')
+        defaults = _python_defaults(table, names)
+        if defaults:
+            # значения по умолчанию (created_on и т.п.) - одни на всю порцию
+            values = {name: make() for name, make in defaults.items()}
+            chunk = [dict(row, **values) for row in chunk]
+        update_names = _update_columns(table, names, keys, update)
+        onupdate = _onupdate_values(table, set(update_names)) if update != [] else {}
+        all_names = names + list(defaults)
+        shape = (tuple(all_names), tuple(update_names), tuple(onupdate))
+        extra = {f'onupdate_{name}': value for name, value in onupdate.items()}
+
+        if method == 'postgresql':
+            stmt = statements.get(shape)
+            if stmt is None:
+                stmt = statements[shape] = _postgresql(table, all_names, keys, update_names, onupdate)
+            parameters = {name: [row[name] for row in chunk] for name in all_names}
+            parameters.update(extra)
+            connection.execute(stmt, parameters)
+        elif method == 'sqlite':
+            stmt = statements.get(shape)
+            if stmt is None:
+                stmt = statements[shape] = _sqlite(table, all_names, keys, update_names, onupdate)
+            connection.execute(stmt, [dict(row, **extra) for row in chunk] if extra else chunk)
+        elif method == 'mysql':
+            connection.execute(_mysql(table, chunk, update_names, onupdate))
+        else:
+            size = max(min(len(chunk), MAX_PARAMETERS // len(all_names)), 1)
+            for part in chunked(chunk, size):
+                stmt = _merge(dialect, table, all_names, keys, update_names, onupdate, len(part))
+                parameters = {f'p{i}_{n}': row[name]
+                              for i, row in enumerate(part) for n, name in enumerate(all_names)}
+                parameters.update(extra)
+                connection.execute(stmt, parameters)
+    return count
@@ -0,0 +1,251 @@
+# Отложенная запись (write-behind) для частых одиночных вставок.
+# Сервис, который на каждый запрос вставляет одну строку в orders или order_lines
+# (как insert в first_db.py), платит за отдельную транзакцию и фиксацию на каждую
+# строку. Здесь строки складываются в очередь, а фоновый поток собирает их в порции
+# и пишет одной транзакцией: порция уходит, когда набралось batch_size строк или
+# прошло flush_interval секунд с первой строки порции.
+# put() сразу возвращает concurrent.futures.Future, который получит первичный ключ
+# вставленной строки или исключение, если ее не удалось записать; put_async() - то же
+# для asyncio. Очередь ограничена max_pending строками: если запись не успевает,
+# put() ждет (или выбрасывает queue.Full по timeout) - так память не растет без предела.
+# close() (и выход из with, и завершение интерпретатора) дописывает все, что в очереди.
+#
+#   with WriteBehind(engine, orders) as writer:
+#       future = writer.put({'customer_id': 7})
+#       order_id = future.result()
+#   order_id = await writer.put_async({'customer_id': 7})
+import asyncio
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_MAX_PENDING = 10000
+
+# метка в очереди: "записать все, что перед ней" (flush) или "остановиться" (close)
+_STOP = object()
+
+
+def _resolve(future, key=None, exc=None):
+    # future, отмененный ожидающим (например, через asyncio), результат уже не принимает
+    try:
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(key)
+    except InvalidStateError:
+        pass
+
+
+class _Flush:
+    def __init__(self):
+        self.future = Future()
+
+
+class WriteBehind:
+    def __init__(self, engine, table, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.engine = engine
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.key = list(table.primary_key.columns)
+        self.commits = 0
+        self.rows = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        # сколько put()/flush() сейчас кладут в очередь: после close() worker ждет их
+        self._putting = 0
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name=f'write-behind-{table.name}', daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def put(self, row, timeout=None):
+        # timeout - сколько ждать места в очереди; None - ждать, сколько понадобится
+        future = Future()
+        if not self._enqueue((dict(row), future), timeout):
+            raise RuntimeError(f'write-behind queue for {self.table.name} is closed')
+        return future
+
+    def _enqueue(self, item, timeout=None):
+        # ожидание места в очереди идет без блокировки: иначе put_async(), отдавший put()
+        # в поток, держал бы ее, и следующий put(timeout=0) в цикле событий ждал бы ее.
+        # Элемент, попавший в очередь после метки остановки, worker дописывает в _drain()
+        with self._lock:
+            if self._closed:
+                return False
+            self._check_worker()
+            self._putting += 1
+        try:
+            self._queue.put(item, timeout=timeout)
+        finally:
+            with self._lock:
+                self._putting -= 1
+        return True
+
+    async def put_async(self, row):
+        # ждет записи строки, не блокируя цикл событий; при полной очереди
+        # место ожидается в потоке по умолчанию
+        try:
+            future = self.put(row, timeout=0)
+        except queue.Full:
+            future = await asyncio.get_running_loop().run_in_executor(None, self.put, row)
+        return await asyncio.wrap_future(future)
+
+    def flush(self, timeout=None):
+        # дождаться записи всего, что поставлено в очередь до этого вызова
+        marker = _Flush()
+        if self._enqueue(marker):
+            marker.future.result(timeout)
+
+    def close(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+
+    def _check_worker(self):
+        # без фонового потока строки остались бы в очереди навсегда
+        if not self._worker.is_alive():
+            raise RuntimeError(f'write-behind worker for {self.table.name} has stopped')
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _next_batch(self):
+        # -> (строки с их future, метки flush, остановиться ли)
+        batch, markers = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is _STOP:
+                return batch, markers, True
+            if isinstance(item, _Flush):
+                # все, что было до метки, уже в batch - порцию можно писать
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, markers, False
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return batch, markers, False
+
+    def _run(self):
+        stop = False
+        try:
+            while not stop:
+                batch, markers, stop = self._next_batch()
+                self._handle(batch, markers)
+            while True:
+                batch, markers = self._drain()
+                if not batch and not markers:
+                    break
+                self._handle(batch, markers)
+        finally:
+            if not stop:
+                self._abandon(RuntimeError(f'write-behind worker for {self.table.name} has stopped'))
+
+    def _handle(self, batch, markers):
+        try:
+            if batch:
+                self._write(batch)
+        except Exception as exc:
+            # ошибка вне самой записи не должна останавливать поток:
+            # порция отклоняется, ожидающие получают исключение
+            self.errors += len(batch)
+            for _, future in batch:
+                _resolve(future, exc=exc)
+        for marker in markers:
+            _resolve(marker.future)
+
+    def _drain(self):
+        # после метки остановки: то, что положили put() и flush(), начатые до close()
+        batch, markers = [], []
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._putting == 0 and self._queue.empty():
+                        break
+                time.sleep(0.001)
+                continue
+            if isinstance(item, _Flush):
+                markers.append(item)
+            else:
+                batch.append(item)
+        return batch, markers
+
+    def _abandon(self, exc):
+        # поток завершается аварийно: все, что осталось в очереди, получает ошибку
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, _Flush):
+                _resolve(item.future, exc=exc)
+            elif item is not _STOP:
+                _resolve(item[1], exc=exc)
+
+    def _identity(self, values):
+        return values[0] if len(values) == 1 else tuple(values)
+
+    def _insert(self, connection, rows):
+        # -> первичные ключи в порядке строк
+        if connection.dialect.insert_executemany_returning:
+            # psycopg2: одна команда INSERT ... VALUES (...), (...) RETURNING id
+            result = connection.execute(self.table.insert().returning(*self.key), rows)
+            return [self._identity(row) for row in result]
+        # без RETURNING для executemany строки вставляются по одной, но в той же транзакции
+        return [self._identity(connection.execute(self.table.insert(), row).inserted_primary_key)
+                for row in rows]
+
+    def _write(self, batch):
+        # executemany требует одинаковый набор колонок, поэтому строки группируются по нему
+        groups = {}
+        for row, future in batch:
+            groups.setdefault(frozenset(row), []).append((row, future))
+        try:
+            with self.engine.begin() as connection:
+                identities = [(group, self._insert(connection, [row for row, _ in group]))
+                              for group in groups.values()]
+        except Exception:
+            # одна плохая строка не должна терять остальные: каждая пишется отдельно
+            self._write_each(batch)
+            return
+        for group, keys in identities:
+            for (_, future), key in zip(group, keys):
+                _resolve(future, key)
+        self.commits += 1
+        self.rows += len(batch)
+
+    def _write_each(self, batch):
+        for row, future in batch:
+            try:
+                with self.engine.begin() as connection:
+                    key = self._insert(connection, [row])[0]
+            except Exception as exc:
+                self.errors += 1
+                _resolve(future, exc=exc)
+            else:
+                self.commits += 1
+                self.rows += 1
+                _resolve(future, key)